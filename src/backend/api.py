@@ -1,27 +1,39 @@
-from fastapi import FastAPI, Form, Response, File, UploadFile
+from fastapi import FastAPI, Form, Request, Response, File, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-import os
 
 from log import setup_logger
-from storage import load_data, query, retrieve_object_ids
+from storage import celery_app, load_data, submit_load, aquery, close_search, retrieve_object_ids
+from queues import queue_stats
 from serverutils import Health, Status,Query
+from typeutils import get_bytestype
+from registry import TaskRegistry
+from progress import subscribe
+from uploads import QueueFull, UploadTooLarge, check_queue, spool_upload
 
 import json
 
 from config import config
 
 TEMP_DIR = config.TEMP_DIR
-TASK_ID_FILE = 'task_ids.json'
+UPLOAD_MAX_BYTES = config.UPLOAD_MAX_BYTES
+TASK_ID_FILE = 'task_ids.json' # pre-registry task list, imported on startup
 
 logger = setup_logger("api")
 logger.info("LOGGER READY")
 
+registry = TaskRegistry()
+
 # https://fastapi.tiangolo.com/advanced/events/
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await registry.import_json(TASK_ID_FILE)
 
     yield
+    await close_search()
+    await registry.aclose()
     # free_db(dbconn)
     # free resources
     # telemetry?
@@ -50,6 +62,21 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+@app.middleware("http")
+async def upload_limits(request: Request, call_next):
+    # starlette reads the whole multipart body before /load runs, so reject on the declared size
+    if request.method == "POST" and request.url.path == "/load":
+        length = int(request.headers.get("content-length") or 0)
+        if length > UPLOAD_MAX_BYTES:
+            return JSONResponse(status_code=413, content={"status": "fail", "reason": f"upload is larger than {UPLOAD_MAX_BYTES} bytes"})
+        try:
+            await run_in_threadpool(check_queue, length) # walks TEMP_DIR
+        except QueueFull as e:
+            logger.warning(f"LOAD rejected: {e}")
+            return JSONResponse(status_code=503, content={"status": "fail", "reason": str(e)}, headers={"Retry-After": "60"})
+
+    return await call_next(request)
+
 @app.get("/health")
 async def health_endpoint():
     return {"health": health}
@@ -57,7 +84,7 @@ async def health_endpoint():
 
 @app.get("/task/{task_id}")
 async def get_task_result(task_id: str):
-    # note: no point adding a progress bar, the longest part (unstructured) is opaque
+    # one-off status, use /task/{task_id}/events to follow a task
 
     task = load_data.AsyncResult(task_id)
 
@@ -66,28 +93,40 @@ async def get_task_result(task_id: str):
     #     result = task.get(timeout=1)
     #     return {"task_id": task_id, "status": task.state, "result": result}
 
+    if task.state == 'PROGRESS': # directory loads report counts while they run
+        return {"task_id": task_id, "status": task.state, "progress": task.info}
+
     return {"task_id": task_id, "status": task.state}
 
-@app.get("/integrations")
-async def get_all_integration():
-    tasks = []
+@app.get("/task/{task_id}/events")
+async def task_events(task_id: str, request: Request):
+    # server-sent events: state transitions and stage counts pushed by the worker, no polling
+
+    async def celery_state():
+        return await run_in_threadpool(lambda: load_data.AsyncResult(task_id).state)
 
-    # Read task ids from the task ids file
-    if os.path.exists(TASK_ID_FILE):
-        with open(TASK_ID_FILE, 'r') as file:
-            tasks = json.load(file)
+    async def stream():
+        async for event in subscribe(task_id, fallback_state=celery_state):
+            if await request.is_disconnected():
+                return
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"data: {json.dumps(event)}\n\n"
 
-    task_states = []
-    for task_id in tasks:
-        task = load_data.AsyncResult(task_id["task_id"])
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-        if task.state == 'SUCCESS':
-            result = task.get(timeout=1)
-            task_states.append({"task_id": task_id["task_id"], "status": task.state, "filename": task_id["filename"], "type": result})
-        else:
-            task_states.append({"task_id": task_id["task_id"], "status": task.state, "filename": task_id["filename"]})
+@app.get("/queues")
+async def get_queues():
+    # depth, recent wait p50/p95 and age of the oldest waiting task, per ingestion queue
+    return {"queues": await run_in_threadpool(queue_stats, celery_app)}
 
-    return {"tasks": task_states}
+@app.get("/integrations")
+async def get_all_integration(offset: int = 0, limit: int = 50):
+    # newest first, one page of states per redis round trip
+    limit = max(1, min(limit, 500))
+    tasks = await registry.page(offset, limit)
+    return {"tasks": tasks, "total": await registry.count(), "offset": offset, "limit": limit}
 
 @app.get("/retrieve_ids/{index}")
 async def retrieve_all(index: str):
@@ -100,33 +139,23 @@ async def retrieve_all(index: str):
 @app.post("/load")
 async def load_data_ep(response: Response, file: UploadFile = File(...), c_type: str = Form(None)):
     try:
-        os.makedirs(TEMP_DIR, exist_ok=True)
-
-        temp_file_path = os.path.join(TEMP_DIR, file.filename)
-        with open(temp_file_path, "wb") as temp_file:
-            temp_file.write(await file.read())
-
-        task = load_data.delay(temp_file_path, file.filename, c_type)
+        # chunked copy to TEMP_DIR, the size cap also covers uploads without a content-length
+        upload = await spool_upload(file)
 
-        # Read existing tasks
-        if os.path.exists(TASK_ID_FILE):
-            with open(TASK_ID_FILE, 'r') as f:
-                try:
-                    tasks = json.load(f)
-                except json.JSONDecodeError:
-                    tasks = []
-        else:
-            tasks = []
+        if not c_type:
+            c_type = get_bytestype(upload.head, file.filename)
 
-        # Append new task
-        tasks.append({"task_id": task.id, "filename": file.filename})
+        task = submit_load(upload.path, c_type, size=upload.size)
 
-        with open(TASK_ID_FILE, 'w') as f:
-            json.dump(tasks, f)
+        await registry.add(task.id, file.filename, sha256=upload.sha256)
 
         response.status_code = 202
         logger.info(f"LOAD accepted: {file.filename}")
-        return {"status": "accepted", "task_id": task.id}
+        return {"status": "accepted", "task_id": task.id, "type": c_type, "size": upload.size, "sha256": upload.sha256}
+    except UploadTooLarge as e:
+        logger.warning(f"LOAD rejected: {file.filename}, {e}")
+        response.status_code = 413
+        return {"health": "ok", "status": "fail", "reason": str(e)}
     except NotImplementedError:
         logger.warning(f"LOAD incomplete: {file.filename}")
         response.status_code = 400
@@ -137,9 +166,13 @@ async def load_data_ep(response: Response, file: UploadFile = File(...), c_type:
 # returns distance
 
 @app.post("/query")
-async def nl_query(input: Query):
+async def nl_query(input: Query, response: Response):
 
-    resp = query(input.query, input.index, input.doc_ids)
+    try:
+        resp = await aquery(input.query, input.index, input.doc_ids, mode=input.retrieval_mode, rerank=input.rerank, **input.fusion_args())
+    except ValueError as e:
+        response.status_code = 400
+        return {"health": health, "status" : "fail", "query" : input.query, "reason" : str(e)}
 
     # if input.use_llm:
     #     # context_list = [x["fields"]["text"] for x in resp.hits] this is for vespa, need to switch to es
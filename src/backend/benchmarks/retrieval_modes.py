@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Compare hybrid search retrieval modes (client_rrf, msearch_rrf, server_rrf)
+against the live ES cluster configured in config.py.
+
+Run from the backend dir: python benchmarks/retrieval_modes.py
+"""
+
+import sys
+import time
+import statistics
+from pathlib import Path
+
+# Get the absolute path of the parent directory
+parent_dir = Path(__file__).resolve().parent.parent
+sys.path.append(str(parent_dir))
+
+from elasticutils import Search, RETRIEVAL_MODES, query_cache
+
+INDEX = "text_chunk"
+ROUNDS = 50
+QUERIES = [
+    "What is GQA?",
+    "sliding window attention",
+    "how many parameters does the model have",
+    "rolling buffer cache",
+    "instruction fine-tuning results",
+]
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+def run_mode(es, mode):
+    latencies = []
+    shapes = set()
+
+    for _ in range(ROUNDS):
+        for q in QUERIES:
+            start = time.perf_counter()
+            results = es.hybrid_search(q, INDEX, mode=mode)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+            if results:
+                shapes.add(tuple(sorted(results[0].keys())))
+
+    return latencies, shapes
+
+def main():
+    es = Search()
+
+    # warm the query cache so every mode measures ES round trips, not the model
+    for q in QUERIES:
+        es.hybrid_search(q, INDEX)
+    print(f"query cache: {query_cache.stats()}")
+
+    print(f"\n{'mode':<14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}  result keys")
+    for mode in RETRIEVAL_MODES:
+        latencies, shapes = run_mode(es, mode)
+        print(
+            f"{mode:<14}"
+            f"{percentile(latencies, 0.50):>10.2f}"
+            f"{percentile(latencies, 0.95):>10.2f}"
+            f"{percentile(latencies, 0.99):>10.2f}"
+            f"{statistics.mean(latencies):>10.2f}"
+            f"  {sorted(shapes)}"
+        )
+
+    if not es._server_rrf_supported:
+        print("\nserver_rrf is not supported by this cluster, its numbers are the client_rrf fallback.")
+
+if __name__ == "__main__":
+    main()
@@ -10,12 +10,31 @@ class config:
 
     TEMP_DIR = "./tmp"
 
+    # uploads, see uploads.py
+    UPLOAD_CHUNK_BYTES = int(os.getenv('UPLOAD_CHUNK_BYTES', 1024 * 1024)) # read/write size while spooling
+    UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', 2 * 1024 ** 3)) # larger uploads get a 413
+    UPLOAD_SNIFF_BYTES = int(os.getenv('UPLOAD_SNIFF_BYTES', 64 * 1024)) # head of the upload used for type detection
+    QUEUE_MAX_BYTES = int(os.getenv('QUEUE_MAX_BYTES', 20 * 1024 ** 3)) # bytes waiting in TEMP_DIR before uploads get a 503
+
     # auto description
     OPENAI_KEY = os.getenv("OPENAI_KEY", "")
 
     # e5_small
     E5_SMALL_MAX_LEN = int(os.getenv('E5_SMALL_MAX_LEN', 512))
 
+    # query embedding cache
+    QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', 1024))
+    QUERY_CACHE_TTL = int(os.getenv('QUERY_CACHE_TTL', 3600)) # seconds, 0 disables expiry
+    QUERY_CACHE_REDIS_URL = str(os.getenv('QUERY_CACHE_REDIS_URL', "")) # e.g. the celery broker url, empty keeps the cache local
+    QUERY_EMBED_WORKERS = int(os.getenv('QUERY_EMBED_WORKERS', 4)) # threads embedding queries for the async search path
+
+    # rerank
+    RERANK_BUDGET_MS = float(os.getenv('RERANK_BUDGET_MS', 150)) # p95 target for the rerank stage
+    RERANK_MIN_CANDIDATES = int(os.getenv('RERANK_MIN_CANDIDATES', 10))
+    RERANK_MAX_CANDIDATES = int(os.getenv('RERANK_MAX_CANDIDATES', 100))
+    RERANK_CACHE_SIZE = int(os.getenv('RERANK_CACHE_SIZE', 10000)) # cached (query, doc id) scores
+    RERANK_CACHE_TTL = int(os.getenv('RERANK_CACHE_TTL', 3600))
+
     # log
     LOG_LEVEL = str(os.getenv('LOG_LEVEL', 'INFO'))
 
@@ -27,11 +46,93 @@ class config:
     CELERY_BROKER_URL = str(os.getenv('CELERY_BROKER_URL', "redis://redis:6379/0"))
     CELERY_RESULT_BACKEND = str(os.getenv('CELERY_RESULT_BACKEND', "redis://redis:6379/0"))
 
+    # queue routing, see queues.py
+    HEAVY_TYPES = str(os.getenv('HEAVY_TYPES', "pdf,doc,ppt,pptx,epub")).split(",") # go to the heavy queue regardless of size
+    LIGHT_MAX_BYTES = int(os.getenv('LIGHT_MAX_BYTES', 8 * 1024 * 1024)) # larger files go to the heavy queue
+    PRIORITY_BASE_BYTES = int(os.getenv('PRIORITY_BASE_BYTES', 256 * 1024)) # files under this get the top priority, one level less per doubling
+    WORKER_PREFETCH_MULTIPLIER = int(os.getenv('WORKER_PREFETCH_MULTIPLIER', 1)) # default for workers started without --prefetch-multiplier
+
+    # crash recovery, see journal.py. a task whose worker dies is redelivered after TASK_VISIBILITY_TIMEOUT (redis broker)
+    TASK_VISIBILITY_TIMEOUT = int(os.getenv('TASK_VISIBILITY_TIMEOUT', 12 * 3600)) # must exceed the longest ingestion
+    JOURNAL_DIR = str(os.getenv('JOURNAL_DIR', os.path.join(TEMP_DIR, "journal"))) # partition output, shared like TEMP_DIR
+    JOURNAL_TTL = int(os.getenv('JOURNAL_TTL', 7 * 24 * 3600))
+    JOURNAL_ACK_EVERY = int(os.getenv('JOURNAL_ACK_EVERY', 500)) # indexed chunks between checkpoints
+
+    # task registry, see registry.py. must be the redis that holds celery results
+    TASK_REGISTRY_URL = str(os.getenv('TASK_REGISTRY_URL', CELERY_RESULT_BACKEND))
+
+    # task progress events, see progress.py
+    PROGRESS_REDIS_URL = str(os.getenv('PROGRESS_REDIS_URL', CELERY_BROKER_URL))
+    PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', 0.25)) # min seconds between count updates of one task
+    PROGRESS_TTL = int(os.getenv('PROGRESS_TTL', 24 * 3600)) # last event is kept for late subscribers
+    PROGRESS_KEEPALIVE = float(os.getenv('PROGRESS_KEEPALIVE', 15)) # seconds between sse keepalive comments
+
     # elasticutils
     ELASTIC_PASSWORD = str(os.getenv('ELASTIC_PASSWORD'))
     ELASTIC_CA_CERT_PATH = str(os.getenv('ELASTIC_CA_CERT_PATH', "./http_ca.crt"))
     ELASTIC_USER = str(os.getenv('ELASTIC_USER', "elastic"))
     ELASTIC_URL = str(os.getenv('ELASTIC_URL', "https://localhost:9200"))
+    RETRIEVAL_MODE = str(os.getenv('RETRIEVAL_MODE', "client_rrf")) # client_rrf | msearch_rrf | server_rrf
+
+    # vector storage, see elasticutils.VECTOR_PROFILES. changing these only affects new indices,
+    # use migrate_vectors.py to move existing ones
+    VECTOR_PROFILE = str(os.getenv('VECTOR_PROFILE', "int8_hnsw")) # float | int8_hnsw | int4_hnsw | bbq_hnsw
+    VECTOR_KNN_INDICES = str(os.getenv('VECTOR_KNN_INDICES', "text_chunk,table_meta,row_chunk,model_meta")).split(",") # others get index: false
+    E5_DIMS = int(os.getenv('E5_DIMS', 384))
+    HNSW_M = int(os.getenv('HNSW_M', 16))
+    HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', 100))
+
+    # bulk indexing
+    ES_BULK_CHUNK_SIZE = int(os.getenv('ES_BULK_CHUNK_SIZE', 500)) # docs per _bulk request
+    ES_BULK_MAX_BYTES = int(os.getenv('ES_BULK_MAX_BYTES', 10 * 1024 * 1024)) # bytes per _bulk request
+    ES_BULK_MAX_RETRIES = int(os.getenv('ES_BULK_MAX_RETRIES', 3)) # retries on 429 (back-pressure from ES)
+    EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', 64)) # docs embedded together before being handed to _bulk
+
+    # pdf ingestion, see pdfpages.py
+    PDF_WINDOW_PAGES = int(os.getenv('PDF_WINDOW_PAGES', 8)) # pages partitioned per worker call
+    PDF_WORKERS = int(os.getenv('PDF_WORKERS', os.cpu_count() or 1)) # spawned processes, 1 partitions in-process
+    PDF_MIN_TEXT_CHARS = int(os.getenv('PDF_MIN_TEXT_CHARS', 32)) # pages with less extractable text go through hi_res (ocr)
+
+    # directory and archive ingestion, see crawl.py
+    DIR_FANOUT = str(os.getenv('DIR_FANOUT', "celery")) # celery | local. use local with --pool=solo workers, a solo worker cannot run its own subtasks
+    DIR_WORKERS = int(os.getenv('DIR_WORKERS', 4)) # threads for local fan out
+    DIR_MAX_IN_FLIGHT = int(os.getenv('DIR_MAX_IN_FLIGHT', 64)) # files queued or being ingested at once
+    DIR_TYPE_BATCH_SIZE = int(os.getenv('DIR_TYPE_BATCH_SIZE', 128)) # files per type detection batch
+    DIR_POLL_INTERVAL = float(os.getenv('DIR_POLL_INTERVAL', 0.5)) # seconds between subtask state checks
+    DIR_PROGRESS_INTERVAL = float(os.getenv('DIR_PROGRESS_INTERVAL', 2)) # seconds between progress updates
+
+    # tabular ingestion, see tables.py
+    TABLE_BATCH_ROWS = int(os.getenv('TABLE_BATCH_ROWS', 65536)) # rows per record batch (parquet, xlsx)
+    TABLE_CSV_BLOCK_BYTES = int(os.getenv('TABLE_CSV_BLOCK_BYTES', 16 * 1024 * 1024)) # bytes per csv/tsv block
+    TABLE_SAMPLE_SIZE = int(os.getenv('TABLE_SAMPLE_SIZE', 10000)) # reservoir rows for correlation embeddings
+    TABLE_ROW_CHUNKS = os.getenv('TABLE_ROW_CHUNKS', "false").lower() == "true" # also index rows as text_chunk docs
+    TABLE_ROWS_PER_CHUNK = int(os.getenv('TABLE_ROWS_PER_CHUNK', 50))
+
+    # database connectors, see connect/postgres.py
+    PG_SAMPLE_ROWS = int(os.getenv('PG_SAMPLE_ROWS', 10000)) # reservoir rows per table for correlation embeddings
+    PG_FETCH_ROWS = int(os.getenv('PG_FETCH_ROWS', 10000)) # rows per round trip on the server side cursor
+    PG_TABLESAMPLE_MIN_ROWS = int(os.getenv('PG_TABLESAMPLE_MIN_ROWS', 1000000)) # bigger tables are block sampled
+    PG_TABLESAMPLE_FACTOR = float(os.getenv('PG_TABLESAMPLE_FACTOR', 10)) # rows read per reservoir row when sampling
+    PG_CRAWL_WORKERS = int(os.getenv('PG_CRAWL_WORKERS', 8)) # tables profiled at once, across databases
+    PG_POOL_SIZE = int(os.getenv('PG_POOL_SIZE', 4)) # max connections per database
+    PG_FINGERPRINT = os.getenv('PG_FINGERPRINT', "false").lower() == "true" # also hash row content on re-sync (one scan per table)
+
+    # row level indexing into row_chunk, see rows.py
+    DB_ROW_INDEX = os.getenv('DB_ROW_INDEX', "false").lower() == "true" # index every row of synced tables
+    DB_COPY_BLOCK_BYTES = int(os.getenv('DB_COPY_BLOCK_BYTES', 4 * 1024 * 1024)) # csv parsed per block of COPY output
+    DB_COPY_QUEUE_CHUNKS = int(os.getenv('DB_COPY_QUEUE_CHUNKS', 256)) # COPY output chunks buffered between the reader thread and the parser
+    MYSQL_FETCH_ROWS = int(os.getenv('MYSQL_FETCH_ROWS', 10000)) # rows per fetch on the unbuffered cursor
+    ROW_TEMPLATES = str(os.getenv('ROW_TEMPLATES', "row_templates.yaml")) # "db.table": "str.format template", per table row text
+
+    # postgres change feed, see connect/replication.py
+    CDC_SLOT = str(os.getenv('CDC_SLOT', "bridge")) # logical replication slot, created with the wal2json plugin
+    CDC_BATCH_SIZE = int(os.getenv('CDC_BATCH_SIZE', 1000)) # changes per flush to ES
+    CDC_FLUSH_INTERVAL = float(os.getenv('CDC_FLUSH_INTERVAL', 5)) # seconds, flush a partial batch after this
+    CDC_ROW_CHUNKS = os.getenv('CDC_ROW_CHUNKS', "false").lower() == "true" # also keep row_chunk docs in sync
+    CDC_RECONNECT_DELAY = float(os.getenv('CDC_RECONNECT_DELAY', 5)) # seconds before reconnecting after an error
+
+    # json / yaml / linear ingestion, see records.py
+    RECORD_CHUNK_CHARS = int(os.getenv('RECORD_CHUNK_CHARS', 2000)) # flattened record text per chunk
 
     TRITON_URL = str(os.getenv('TRITON_URL', "localhost:9000"))
 
@@ -6,12 +6,23 @@ import os
 import yaml
 import sys
 from pathlib import Path
+from uuid import uuid4, uuid5, NAMESPACE_URL
 
 # Get the absolute path of the parent directory
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
 
-from auto_description import desc_gen
+from config import config
+from log import setup_logger
+from auto_description import describe_table
+from rows import index_table_rows
+
+# logger
+logger = setup_logger("mysql")
+
+MYSQL_FETCH_ROWS = config.MYSQL_FETCH_ROWS
+
+SYSTEM_MYSQL_DBS = ['information_schema', 'mysql', 'performance_schema', 'sakila', 'sys']
 
 # Function to fetch constraints data
 def get_constraints(db_name, mydb):
@@ -43,7 +54,7 @@ def mysql_to_yamls(host, user, password):
     )
 
     # Main database for the process // EXCLUDED sys 'world' db for azure vm testing
-    system_mysql_dbs = ['information_schema', 'mysql', 'performance_schema','sakila','sys']
+    system_mysql_dbs = SYSTEM_MYSQL_DBS
 
     all_dbs = pd.read_sql("SHOW DATABASES", mydb)
     all_dbs = all_dbs['Database'].values.tolist()
@@ -64,7 +75,7 @@ def mysql_to_yamls(host, user, password):
         tables = df['table_name'].unique()
         for table in tables:        
             table_df = df[df['table_name'] == table]
-            description = desc_gen(table_df)
+            description = describe_table(str(table_df))
             table_constraints_df = df_constraints[df_constraints['table_name'] == table]
             primary_keys = table_constraints_df[table_constraints_df['constraint_name'] == 'PRIMARY']['column_name'].tolist()
             foreign_keys = table_constraints_df[table_constraints_df['constraint_name'] != 'PRIMARY']
@@ -106,6 +117,85 @@ def mysql_to_yamls(host, user, password):
     
     return yamls
 
+## rows
+
+def mysql_database_id(host):
+    return str(uuid5(NAMESPACE_URL, f"mysql://{host}"))
+
+def mysql_table_id(host, db_name, table):
+    return str(uuid5(NAMESPACE_URL, f"mysql://{host}/{db_name}.{table}"))
+
+def get_primary_keys(db_name, mydb):
+    cur = mydb.cursor()
+    cur.execute(
+        """
+        SELECT TABLE_NAME, COLUMN_NAME
+        FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = %s AND CONSTRAINT_NAME = 'PRIMARY'
+        ORDER BY TABLE_NAME, ORDINAL_POSITION;
+        """,
+        (db_name,),
+    )
+    primary_keys = {}
+    for table, column_name in cur.fetchall():
+        primary_keys.setdefault(table, []).append(column_name)
+    cur.close()
+    return primary_keys
+
+def _quote(name):
+    return "`" + name.replace("`", "``") + "`"
+
+def mysql_rows(db_name, table, conn, fetch_rows=MYSQL_FETCH_ROWS):
+    """Yields every row of a table as a dict. The cursor is unbuffered, rows are streamed from the server."""
+    cur = conn.cursor(buffered=False)
+    try:
+        cur.execute(f"SELECT * FROM {_quote(db_name)}.{_quote(table)}")
+        names = cur.column_names
+        while True:
+            rows = cur.fetchmany(fetch_rows)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(names, row))
+    finally:
+        try:
+            if conn.unread_result: # stopped early, an unbuffered result must be read to the end
+                conn.consume_results()
+            cur.close()
+        except mysql.connector.Error as e: # e.g. the connection is gone, don't hide the error that got us here
+            logger.warning(f"Could not close the cursor of {db_name}.{table}: {e}")
+
+def mysql_index_rows(host, user, password, es):
+    """Opt in row level indexing of every table with a primary key, into row_chunk."""
+    mydb = mysql.connector.connect(host=host, user=user, password=password, database="information_schema")
+    stream = mysql.connector.connect(host=host, user=user, password=password) # the unbuffered cursor holds its connection
+
+    db_id = mysql_database_id(host)
+    sync = uuid4().hex
+
+    indexed = 0
+    try:
+        all_dbs = pd.read_sql("SHOW DATABASES", mydb)['Database'].values.tolist()
+        for db_name in [db for db in all_dbs if db not in SYSTEM_MYSQL_DBS]:
+            for table, key_columns in get_primary_keys(db_name, mydb).items():
+                try:
+                    indexed += index_table_rows(
+                        es,
+                        mysql_rows(db_name, table, stream),
+                        db_id,
+                        mysql_table_id(host, db_name, table),
+                        f"{db_name}.{table}",
+                        key_columns,
+                        sync=sync,
+                    )
+                except RuntimeError as e: # the table keeps the rows of its previous sync
+                    logger.error(f"Failed to index the rows of {db_name}.{table}: {e}")
+    finally:
+        stream.close()
+        mydb.close()
+
+    return indexed
+
 if __name__ == "__main__":
 
     host="20.42.102.160"
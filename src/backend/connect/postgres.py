@@ -1,279 +1,523 @@
-import pandas as pd
 import psycopg2
 import os
 import yaml
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
 import json
+import hashlib
+import io
+import queue
+from uuid import uuid5, NAMESPACE_URL
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 
 # Get the absolute path of the parent directory
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
 
+from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
+
+from config import config
 from auto_description import describe_table
-from .correlation import correlation_embedding
-
-# Function to fetch constraints data, adapted for PostgreSQL
-def get_constraints(db_name, table_name, conn):
-    query = f"""
-    SELECT
-        tc.constraint_name,
-        tc.table_name,
-        kcu.column_name,
-        ccu.table_name AS foreign_table_name,
-        ccu.column_name AS foreign_column_name,
-		tc.constraint_type as constraint_type
-    FROM
-        information_schema.table_constraints AS tc
-        JOIN information_schema.key_column_usage AS kcu
-            ON tc.constraint_name = kcu.constraint_name
-            AND tc.table_schema = kcu.table_schema
-        LEFT JOIN information_schema.constraint_column_usage AS ccu
-            ON ccu.constraint_name = tc.constraint_name
-            AND ccu.table_schema = tc.table_schema
-    WHERE
-        tc.constraint_type IN ('PRIMARY KEY', 'FOREIGN KEY')
-        AND tc.table_catalog = '{db_name}'
-        AND tc.table_name = '{table_name}'
-    ORDER BY
-        tc.table_name, kcu.ordinal_position;
-    """
-    return pd.read_sql(query, conn)
-
-def get_tables(db_name, conn):
-    query = f"""SELECT *
-    FROM
-        information_schema.tables
-    WHERE
-        table_catalog = '{db_name}' 
-        AND table_schema = 'public' """
-        
+from tables import TableProfile, rows_to_batch
+
+PG_SAMPLE_ROWS = config.PG_SAMPLE_ROWS
+PG_FETCH_ROWS = config.PG_FETCH_ROWS
+PG_TABLESAMPLE_MIN_ROWS = config.PG_TABLESAMPLE_MIN_ROWS
+PG_TABLESAMPLE_FACTOR = config.PG_TABLESAMPLE_FACTOR
+PG_CRAWL_WORKERS = config.PG_CRAWL_WORKERS
+PG_POOL_SIZE = config.PG_POOL_SIZE
+PG_FINGERPRINT = config.PG_FINGERPRINT
+DB_COPY_BLOCK_BYTES = config.DB_COPY_BLOCK_BYTES
+DB_COPY_QUEUE_CHUNKS = config.DB_COPY_QUEUE_CHUNKS
+
+# Tables are read once: a server side (named) cursor streams the rows PG_FETCH_ROWS at a
+# time into a TableProfile, which keeps a PG_SAMPLE_ROWS reservoir and computes every
+# column's correlation embedding from it. Tables estimated over PG_TABLESAMPLE_MIN_ROWS
+# are read through TABLESAMPLE SYSTEM, so only ~PG_TABLESAMPLE_FACTOR rows per reservoir
+# row come off disk.
+
+def estimated_rows(table, conn, schema="public"):
+    # planner estimate, -1 (pg 14+) or 0 for tables that were never analyzed
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)",
+            (sql.Identifier(schema, table).as_string(conn),),
+        )
+        row = cur.fetchone()
+    return row[0] if row else 0
+
+def sample_percent(rows, sample_rows=PG_SAMPLE_ROWS):
+    """TABLESAMPLE SYSTEM percentage for a table of ~rows rows, None to read it all."""
+    if rows < PG_TABLESAMPLE_MIN_ROWS:
+        return None
+    return min(100.0, 100.0 * sample_rows * PG_TABLESAMPLE_FACTOR / rows)
+
+def scan_query(table, column_names, percent=None, schema="public"):
+    query = sql.SQL("SELECT {} FROM {}").format(
+        sql.SQL(", ").join(sql.Identifier(name) for name in column_names),
+        sql.Identifier(schema, table),
+    )
+    if percent is not None:
+        query = sql.SQL("{} TABLESAMPLE SYSTEM ({})").format(query, sql.Literal(percent))
+    return query
+
+def profile_table(table, column_names, conn, sample_rows=PG_SAMPLE_ROWS, schema="public"):
+    """One pass over the table (or a block sample of it) into a TableProfile."""
+    profile = TableProfile(sample_size=sample_rows)
+    percent = sample_percent(estimated_rows(table, conn, schema), sample_rows)
+
+    # named cursors only live inside a transaction, which is rolled back: we only read
+    with conn.cursor(name="bridge_scan") as cur:
+        cur.itersize = PG_FETCH_ROWS
+        cur.execute(scan_query(table, column_names, percent, schema))
+        while True:
+            rows = cur.fetchmany(PG_FETCH_ROWS)
+            if not rows:
+                break
+            profile.update(rows_to_batch(column_names, rows))
+    conn.rollback()
+
+    if percent is not None:
+        print(f"Sampled {profile.rows} row(s) of {table} ({percent:.3f}%)")
+    return profile
+
+def column_embeddings(table, column_names, conn, sample_rows=PG_SAMPLE_ROWS, schema="public"):
+    # columns without numeric values have no embedding
+    return profile_table(table, column_names, conn, sample_rows, schema).correlation_embeddings()
+
+## rows
+
+# COPY ... TO STDOUT is the fastest way rows leave postgres (no per row protocol overhead).
+# psycopg2 pushes the output into a file object from a reader thread, a bounded queue
+# hands it over to pyarrow's csv parser here, and rows come out a csv block at a time.
+# Values stay strings (NULL is None), they are only rendered to text.
+
+_COPY_DONE = object()
+
+class _CopyStream(io.RawIOBase):
+    def __init__(self, chunks: queue.Queue):
+        self._chunks = chunks
+        self._buffer = b""
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and not self._done:
+            chunk = self._chunks.get()
+            if chunk is _COPY_DONE:
+                self._done = True
+            elif isinstance(chunk, BaseException):
+                raise chunk
+            else:
+                self._buffer = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+class _CopyWriter:
+    def __init__(self, chunks: queue.Queue, stop: threading.Event):
+        self._chunks = chunks
+        self._stop = stop
+
+    def put(self, item):
+        while True:
+            if self._stop.is_set():
+                raise InterruptedError("COPY abandoned by the reader")
+            try:
+                self._chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data):
+        self.put(data)
+        return len(data)
+
+def copy_query(table, column_names, schema="public"):
+    return sql.SQL("COPY (SELECT {} FROM {}) TO STDOUT WITH (FORMAT csv, HEADER true)").format(
+        sql.SQL(", ").join(sql.Identifier(name) for name in column_names),
+        sql.Identifier(schema, table),
+    )
+
+def copy_rows(table, column_names, conn, schema="public"):
+    """Yields every row of a table as a dict of strings, streamed with COPY."""
+    chunks = queue.Queue(maxsize=DB_COPY_QUEUE_CHUNKS)
+    stop = threading.Event()
+    writer = _CopyWriter(chunks, stop)
+    query = copy_query(table, column_names, schema).as_string(conn)
+
+    def produce():
+        try:
+            with conn.cursor() as cur:
+                cur.copy_expert(query, writer)
+            writer.put(_COPY_DONE)
+        except InterruptedError:
+            pass
+        except Exception as e:
+            try:
+                writer.put(e)
+            except InterruptedError:
+                pass
+
+    thread = threading.Thread(target=produce, name=f"copy-{table}", daemon=True)
+    thread.start()
     try:
-        df = pd.read_sql(query, conn)
-        if df.empty:
-            print(f"No tables found in database '{db_name}' within the 'public' schema.")
-        else:
-            print("Tables found")
-        return df
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
-def get_columns(db_name, table_name, conn):
-    query = f"""
-    SELECT
-        table_name,
-        column_name,
-        data_type
-    FROM
-        information_schema.columns
-    WHERE
-        table_catalog = '{db_name}' AND table_name = '{table_name}'
-    ORDER BY
-        table_name, ordinal_position;
-    
-    """
+        reader = pa_csv.open_csv(
+            io.BufferedReader(_CopyStream(chunks), buffer_size=DB_COPY_BLOCK_BYTES),
+            read_options=pa_csv.ReadOptions(block_size=DB_COPY_BLOCK_BYTES),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={name: pa.string() for name in column_names},
+                null_values=[""], # COPY csv writes NULL unquoted and empty strings as ""
+                strings_can_be_null=True,
+                quoted_strings_can_be_null=False,
+            ),
+        )
+        for batch in reader:
+            yield from batch.to_pylist()
+    finally:
+        stop.set()
+        thread.join()
+
+## catalog
+
+COLUMNS_QUERY = """
+SELECT
+    c.table_name,
+    c.column_name,
+    c.data_type
+FROM
+    information_schema.columns AS c
+    JOIN information_schema.tables AS t
+        ON t.table_schema = c.table_schema
+        AND t.table_name = c.table_name
+WHERE
+    c.table_schema = %s
+ORDER BY
+    c.table_name, c.ordinal_position;
+"""
+
+CONSTRAINTS_QUERY = """
+SELECT
+    tc.constraint_name,
+    tc.table_name,
+    kcu.column_name,
+    ccu.table_name AS foreign_table_name,
+    ccu.column_name AS foreign_column_name,
+    tc.constraint_type AS constraint_type
+FROM
+    information_schema.table_constraints AS tc
+    JOIN information_schema.key_column_usage AS kcu
+        ON tc.constraint_name = kcu.constraint_name
+        AND tc.table_schema = kcu.table_schema
+    LEFT JOIN information_schema.constraint_column_usage AS ccu
+        ON ccu.constraint_name = tc.constraint_name
+        AND ccu.table_schema = tc.table_schema
+WHERE
+    tc.constraint_type IN ('PRIMARY KEY', 'FOREIGN KEY')
+    AND tc.table_schema = %s
+ORDER BY
+    tc.table_name, kcu.ordinal_position;
+"""
+
+def list_databases(host, user, password):
+    conn = psycopg2.connect(host=host, user=user, password=password)
     try:
-        df = pd.read_sql(query, conn)
-        if df.empty:
-            print(f"No columns found in table '{table_name}' within the 'public' schema.")
-        return df
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
-# Function to fetch tables and columns data, adapted for PostgreSQL
-# def get_tables_and_columns(db_name):
-#     query = f"""
-#     SELECT
-#         table_name,
-#         column_name,
-#         data_type
-#     FROM
-#         information_schema.columns
-#     WHERE
-#         table_schema = '{db_name}'
-#     ORDER BY
-#         table_name, ordinal_position;
-#     """
-#     return pd.read_sql(query, conn)
-        
+        with conn.cursor() as cur:
+            cur.execute("SELECT datname FROM pg_database WHERE datistemplate = false AND datname <> %s;", ("postgres",))
+            return [row[0] for row in cur.fetchall()]
+    finally:
+        conn.close()
 
-def postgres_to_yamls(host, user, password):
-    conn = psycopg2.connect(
-        host=host,
-        user=user,
-        password=password
+def get_catalog(conn, schema="public"):
+    """
+    {table: {"columns": [(name, type)], "primary_keys": [...], "foreign_keys": [...]}}
+    for every table in a schema, from two catalog queries per database.
+    """
+    catalog = {}
+    with conn.cursor() as cur:
+        cur.execute(COLUMNS_QUERY, (schema,))
+        for table, column_name, data_type in cur.fetchall():
+            entry = catalog.setdefault(table, {"columns": [], "primary_keys": [], "foreign_keys": []})
+            entry["columns"].append((column_name, data_type))
+
+        cur.execute(CONSTRAINTS_QUERY, (schema,))
+        for _, table, column_name, foreign_table, foreign_column, constraint_type in cur.fetchall():
+            if table not in catalog:
+                continue
+            if constraint_type == "PRIMARY KEY":
+                catalog[table]["primary_keys"].append(column_name)
+            else:
+                catalog[table]["foreign_keys"].append((column_name, foreign_table, foreign_column))
+    conn.rollback()
+    return catalog
+
+## change detection
+
+# A table's hash covers its schema (columns, types, keys), its pg_stat_user_tables write
+# counters and its relation size, all read from the catalog once per database. Tables whose
+# hash matches the indexed one are not scanned again. Counters reset with the stats (crash,
+# pg_stat_reset), which only costs a re-profile. Views have no counters: PG_FINGERPRINT adds
+# a count + sum(hashtext(row)) aggregate, one full scan per table but no data transfer.
+
+STATS_QUERY = """
+SELECT
+    c.relname,
+    coalesce(s.n_tup_ins, 0),
+    coalesce(s.n_tup_upd, 0),
+    coalesce(s.n_tup_del, 0),
+    coalesce(s.n_live_tup, 0),
+    pg_relation_size(c.oid)
+FROM
+    pg_class AS c
+    JOIN pg_namespace AS n ON n.oid = c.relnamespace
+    LEFT JOIN pg_stat_user_tables AS s ON s.relid = c.oid
+WHERE
+    n.nspname = %s
+    AND c.relkind IN ('r', 'p', 'v', 'm', 'f');
+"""
+
+def get_table_stats(conn, schema="public"):
+    with conn.cursor() as cur:
+        cur.execute(STATS_QUERY, (schema,))
+        stats = {row[0]: list(row[1:]) for row in cur.fetchall()}
+    conn.rollback()
+    return stats
+
+def fingerprint(table, conn, schema="public"):
+    query = sql.SQL("SELECT count(*), coalesce(sum(hashtext(t::text)::bigint), 0) FROM {} AS t").format(
+        sql.Identifier(schema, table),
     )
+    with conn.cursor() as cur:
+        cur.execute(query)
+        row = cur.fetchone()
+    return [int(value) for value in row]
+
+def table_hash(entry, stats=None, row_fingerprint=None):
+    signals = {
+        "columns": entry["columns"],
+        "primary_keys": entry["primary_keys"],
+        "foreign_keys": entry["foreign_keys"],
+        "stats": stats,
+        "fingerprint": row_fingerprint,
+    }
+    return hashlib.sha256(json.dumps(signals, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def database_id(host):
+    return str(uuid5(NAMESPACE_URL, f"postgres://{host}"))
+
+def table_id(host, db, table, schema="public"):
+    # stable table_meta _id, so a re-sync overwrites instead of adding a copy
+    return str(uuid5(NAMESPACE_URL, f"postgres://{host}/{db}/{schema}.{table}"))
+
+def table_yaml(db, table, entry, embeddings, description):
+    foreign_columns = [column_name for column_name, _, _ in entry["foreign_keys"]]
+
+    dimensions = []
+    for column_name, data_type in entry["columns"]:
+        column = {"name": column_name, "type": data_type, "sql": column_name}
+        column["embedding"] = embeddings.get(column_name)
+
+        if column_name in entry["primary_keys"]:
+            column["primary_key"] = True
+        elif column_name in foreign_columns:
+            column["foreign_key"] = True
+        dimensions.append(column)
+
+    joins = []
+    for column_name, foreign_table, foreign_column in entry["foreign_keys"]:
+        join = {
+            "name": foreign_table,
+            "sql": f"{{{table}}}.{column_name} = {{{foreign_table}}}.{foreign_column}"
+        }
+        joins.append(join)
+
+    return {
+        "id": entry.get("id"),
+        "table_hash": entry.get("table_hash"),
+        "row_count": entry["stats"][3] if entry.get("stats") else None, # n_live_tup, the change feed moves it from there
+        "name": table,
+        "sql_name": f"{db}.{table}",
+        "dimensions": dimensions,
+        **({"joins": joins} if joins else {}),
+        "description": description
+    }
+
+## crawler
+
+class DatabasePool:
+    """ThreadedConnectionPool that blocks when exhausted instead of raising PoolError."""
+
+    def __init__(self, db, size, **connect_args):
+        self.db = db
+        self._pool = ThreadedConnectionPool(1, size, dbname=db, **connect_args)
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            conn = self._pool.getconn()
+            try:
+                yield conn
+            finally:
+                try:
+                    if not conn.closed:
+                        conn.rollback() # read only, never leave a transaction open in the pool
+                except psycopg2.Error: # e.g. an abandoned COPY, the connection is not reused
+                    conn.close()
+                self._pool.putconn(conn, close=bool(conn.closed))
+
+    def close(self):
+        self._pool.closeall()
+
+class PostgresCrawler:
+    """
+    Schema + profile crawl of every database on a server.
 
-    # Example of listing all databases in PostgreSQL (requires different approach)
-    cur = conn.cursor()
-    cur.execute("SELECT datname FROM pg_database WHERE datistemplate = false;")
-    all_dbs = cur.fetchall()
-    all_dbs = [db[0] for db in all_dbs if db[0] != "postgres"]
-
-    # You can then filter out system databases and process your databases as in the original script
-    # Note: PostgreSQL does not have a direct equivalent to MySQL's SHOW DATABASES, and listing databases might require connecting to a specific database first.
-
-    # Ensure to replace `SHOW DATABASES` and other MySQL-specific functions or queries with their PostgreSQL equivalents.
-
-    # Note: This code assumes you have the necessary privileges to access the listed databases and their schemas.
-
-    yamls = []
-
-    for db in all_dbs:
-                
-        conn = psycopg2.connect(dbname=db, user=user, password=password, host=host)
-        
-        temp_sys_table = get_tables(db, conn)
-        tables = temp_sys_table.loc[:, "table_name"].values.tolist() 
-
-        print(tables)
-        
-        for table in tables:
-            columns = get_columns(db_name=db, table_name=table, conn=conn)
-            description = describe_table(str(columns))
-            constraints = get_constraints(db_name=db, table_name=table, conn=conn)
-            primary_keys = constraints[constraints["constraint_type"] == "PRIMARY KEY"]["column_name"].tolist()
-            foreign_keys = constraints[constraints["constraint_type"] == "FOREIGN KEY"]
-            
-            dimensions = []
-            for _, row in columns.iterrows():
-                column = {"name": row["column_name"], "type": row["data_type"], "sql": row["column_name"]}
-
-                # Before running the query, ensure the column name is correctly formatted
-                column_name = row['column_name']
-                quoted_column_name = f'"{column_name}"'  # Enclose the column name in double quotes
-
-                # Use the quoted column name in the SQL query
-                query = f"SELECT {quoted_column_name} FROM \"{table}\""
-                column_data = pd.read_sql(query, conn)
-
-                # Then use the original column name to access the data, assuming it's correctly cased in `row['column_name']`
-                column["embedding"] = correlation_embedding(column_data[column_name].values)
-
-                if row["column_name"] in primary_keys:
-                    column["primary_key"] = True
-                elif row["column_name"] in foreign_keys["column_name"].tolist():
-                    column["foreign_key"] = True
-                dimensions.append(column)
-                
-            joins = []
-            for _, fk_row in foreign_keys.iterrows():
-                join = {
-                    "name": fk_row["foreign_table_name"],
-                    "sql": f"{{{table}}}.{fk_row['column_name']} = {{{fk_row['foreign_table_name']}}}.{fk_row['foreign_column_name']}"
-                }
-                joins.append(join)
-
-            yaml_structure = {
-                "name": table,
-                "sql_name": f"{db}.{table}",
-                "dimensions": dimensions,
-                **({"joins": joins} if joins else {}),
-                "description": description
-            }
-
-            yamls.append(yaml_structure)
-
-            yaml_str = yaml.dump(yaml_structure, default_flow_style=None, sort_keys=False)
-            os.makedirs("models/postgres/yamls", exist_ok=True)
-            with open(f"models/postgres/yamls/{table}.yaml", 'w') as yaml_file:
-                yaml_file.write(yaml_str)
-
-    conn.close()
+    Each database gets a pool of at most PG_POOL_SIZE connections, closed as soon as
+    its last table is done. Tables of all databases share one thread pool of
+    PG_CRAWL_WORKERS, which bounds the number of scans running at once.
 
-    return yamls
+    `known` maps table ids to their indexed table_hash, matching tables are skipped.
+    `row_sink(db, table, entry, rows)` gets the COPY stream of every changed table.
+    After a crawl, `seen` holds the id of every table found, and `skipped_databases`
+    the databases that could not be read (their tables are unknown, not gone).
+    """
 
+    def __init__(self, host, user, password, workers=PG_CRAWL_WORKERS, pool_size=PG_POOL_SIZE, schema="public", known=None, use_fingerprint=PG_FINGERPRINT, row_sink=None):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.workers = workers
+        self.pool_size = pool_size
+        self.schema = schema
+        self.known = known or {}
+        self.use_fingerprint = use_fingerprint
+        self.row_sink = row_sink
+
+        self.seen = set()
+        self.skipped_databases = set()
+        self.unchanged = 0
+
+    def _pool(self, db):
+        return DatabasePool(
+            db,
+            max(1, min(self.pool_size, self.workers)),
+            user=self.user,
+            password=self.password,
+            host=self.host,
+        )
+
+    def _unchanged(self, entry):
+        return self.known.get(entry["id"]) == entry["table_hash"]
+
+    def _table(self, db, pool, table, entry):
+        with pool.connection() as conn:
+            if self.use_fingerprint:
+                entry["table_hash"] = table_hash(entry, entry["stats"], fingerprint(table, conn, self.schema))
+                if self._unchanged(entry):
+                    return None
+            column_names = [column_name for column_name, _ in entry["columns"]]
+            embeddings = column_embeddings(table, column_names, conn, schema=self.schema)
+            if self.row_sink is not None:
+                self.row_sink(db, table, entry, copy_rows(table, column_names, conn, self.schema))
+
+        description = describe_table(str(entry["columns"]))
+        return table_yaml(db, table, entry, embeddings, description)
+
+    def crawl(self, on_table=None):
+        """Returns the table yamls, on_table(yaml) is called from the worker thread as each one is done."""
+        yamls = []
+        lock = threading.Lock()
+
+        def done(db, table, pool, remaining, future):
+            try:
+                yaml_structure = future.result()
+                if yaml_structure is None: # fingerprint unchanged
+                    with lock:
+                        self.unchanged += 1
+                    return
+                if on_table is not None:
+                    on_table(yaml_structure)
+                with lock:
+                    yamls.append(yaml_structure)
+            except Exception as e:
+                print(f"Failed to crawl {db}.{table}: {e}")
+            finally:
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    pool.close()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for db in list_databases(self.host, self.user, self.password):
+                pool = None
+                try:
+                    pool = self._pool(db)
+                    with pool.connection() as conn:
+                        catalog = get_catalog(conn, self.schema)
+                        stats = get_table_stats(conn, self.schema)
+                except psycopg2.Error as e:
+                    print(f"Skipping database '{db}': {e}")
+                    if pool is not None:
+                        pool.close()
+                    self.skipped_databases.add(db)
+                    continue
+
+                changed = {}
+                for table, entry in catalog.items():
+                    entry["id"] = table_id(self.host, db, table, self.schema)
+                    entry["stats"] = stats.get(table)
+                    entry["table_hash"] = table_hash(entry, entry["stats"])
+                    self.seen.add(entry["id"])
+                    if self.use_fingerprint or not self._unchanged(entry):
+                        changed[table] = entry
+                with lock:
+                    self.unchanged += len(catalog) - len(changed)
+
+                if not changed:
+                    print(f"No changed tables in database '{db}' within the '{self.schema}' schema.")
+                    pool.close()
+                    continue
+
+                remaining = [len(changed)]
+                for table, entry in changed.items():
+                    future = executor.submit(self._table, db, pool, table, entry)
+                    future.add_done_callback(partial(done, db, table, pool, remaining))
+
+        return yamls
+
+def write_yaml(yaml_structure, out_dir="models/postgres/yamls"):
+    # db qualified, tables with the same name in two databases would overwrite each other
+    yaml_str = yaml.dump(yaml_structure, default_flow_style=None, sort_keys=False)
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, f"{yaml_structure['sql_name']}.yaml"), 'w') as yaml_file:
+        yaml_file.write(yaml_str)
+
+def remove_yaml(sql_name, out_dir="models/postgres/yamls"):
+    path = os.path.join(out_dir, f"{sql_name}.yaml")
+    if os.path.isfile(path):
+        os.remove(path)
 
+def postgres_to_yamls(host, user, password):
+    return PostgresCrawler(host, user, password).crawl(on_table=write_yaml)
 
 def postgres_to_dicts(host, user, password):
-    conn = psycopg2.connect(
-        host=host,
-        user=user,
-        password=password
-    )
-
-    # Example of listing all databases in PostgreSQL (requires different approach)
-    cur = conn.cursor()
-    cur.execute("SELECT datname FROM pg_database WHERE datistemplate = false;")
-    all_dbs = cur.fetchall()
-    all_dbs = [db[0] for db in all_dbs if db[0] != "postgres"]
-
-    # You can then filter out system databases and process your databases as in the original script
-    # Note: PostgreSQL does not have a direct equivalent to MySQL's SHOW DATABASES, and listing databases might require connecting to a specific database first.
-
-    # Ensure to replace `SHOW DATABASES` and other MySQL-specific functions or queries with their PostgreSQL equivalents.
-
-    # Note: This code assumes you have the necessary privileges to access the listed databases and their schemas.
-
-    yamls = []
-
-    for db in all_dbs:
-                
-        conn = psycopg2.connect(dbname=db, user=user, password=password, host=host)
-        
-        temp_sys_table = get_tables(db, conn)
-        tables = temp_sys_table.loc[:, "table_name"].values.tolist() 
-
-        print(tables)
-        
-        for table in tables:
-            columns = get_columns(db_name=db, table_name=table, conn=conn)
-            description = describe_table(str(columns))
-            constraints = get_constraints(db_name=db, table_name=table, conn=conn)
-            primary_keys = constraints[constraints["constraint_type"] == "PRIMARY KEY"]["column_name"].tolist()
-            foreign_keys = constraints[constraints["constraint_type"] == "FOREIGN KEY"]
-            
-            dimensions = []
-            for _, row in columns.iterrows():
-                column = {"name": row["column_name"], "type": row["data_type"], "sql": row["column_name"]}
-
-                # Before running the query, ensure the column name is correctly formatted
-                column_name = row['column_name']
-                quoted_column_name = f'"{column_name}"'  # Enclose the column name in double quotes
-
-                # Use the quoted column name in the SQL query
-                query = f"SELECT {quoted_column_name} FROM \"{table}\""
-                column_data = pd.read_sql(query, conn)
-
-                # Then use the original column name to access the data, assuming it's correctly cased in `row['column_name']`
-                column["embedding"] = correlation_embedding(column_data[column_name].values) # Assuming the output can be converted to a list
-
-                if row["column_name"] in primary_keys:
-                    column["primary_key"] = True
-                elif row["column_name"] in foreign_keys["column_name"].tolist():
-                    column["foreign_key"] = True
-                dimensions.append(column)
-                
-            joins = []
-            for _, fk_row in foreign_keys.iterrows():
-                join = {
-                    "name": fk_row["foreign_table_name"],
-                    "sql": f"{{{table}}}.{fk_row['column_name']} = {{{fk_row['foreign_table_name']}}}.{fk_row['foreign_column_name']}"
-                }
-                joins.append(join)
-
-            yaml_structure = {
-                "name": table,
-                "sql_name": f"{db}.{table}",
-                "dimensions": dimensions,
-                **({"joins": joins} if joins else {}),
-                "description": description
-            }
-
-            yamls.append(yaml_structure)
-
-    conn.close()
-
-    return yamls
+    return PostgresCrawler(host, user, password).crawl()
 
 # TODO: finish this. current format is not croissant supported   
 def postgres_to_croissant(host, user, password, auto_describe=True):
-    # Connect to PostgreSQL server
-    conn = psycopg2.connect(host=host, user=user, password=password)
-    cur = conn.cursor()
-    cur.execute("SELECT datname FROM pg_database WHERE datistemplate = false;")
-    all_dbs = cur.fetchall()
-    all_dbs = [db[0] for db in all_dbs if db[0] != "postgres"]
+    all_dbs = list_databases(host, user, password)
 
     croissant_metadata_list = []
 
@@ -285,19 +529,14 @@ def postgres_to_croissant(host, user, password, auto_describe=True):
         tables = [table[0] for table in tables]
 
         for table in tables:
-            cur.execute(f"SELECT column_name, data_type FROM information_schema.columns WHERE table_name='{table}'")
+            cur.execute("SELECT column_name, data_type FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s", (table,))
             columns = cur.fetchall()
 
+            embeddings = column_embeddings(table, [column_name for column_name, _ in columns], conn)
+
             dimensions = []
             for column_name, data_type in columns:
-                quoted_column_name = f'"{column_name}"'  # Enclose the column name in double quotes
-
-                # Use the quoted column name in the SQL query
-                query = f"SELECT {quoted_column_name} FROM \"{table}\""
-                column_data = pd.read_sql(query, conn)
-
-                # Then use the original column name to access the data, assuming it's correctly cased in `row['column_name']`
-                embedding = correlation_embedding(column_data[column_name].values, 10)
+                embedding = (embeddings.get(column_name) or [])[:10]
 
                 column_data = {
                     "name": column_name,
@@ -327,7 +566,7 @@ def postgres_to_croissant(host, user, password, auto_describe=True):
             
             croissant_metadata_list.append(croissant_table_metadata)
 
-    conn.close()
+        conn.close()
 
     # Convert the metadata list to JSON
     return json.dumps(croissant_metadata_list, indent=2)
@@ -0,0 +1,263 @@
+import json
+import os
+import select
+import sys
+import time
+from pathlib import Path
+
+import psycopg2
+import redis
+from psycopg2.extras import LogicalReplicationConnection
+
+# Get the absolute path of the parent directory
+parent_dir = Path(__file__).resolve().parent.parent
+sys.path.append(str(parent_dir))
+
+from config import config
+from log import setup_logger
+from rows import row_doc, row_id, row_key, row_templates
+from connect.postgres import database_id, table_id
+
+# logger
+logger = setup_logger("replication")
+
+CDC_SLOT = config.CDC_SLOT
+CDC_BATCH_SIZE = config.CDC_BATCH_SIZE
+CDC_FLUSH_INTERVAL = config.CDC_FLUSH_INTERVAL
+CDC_ROW_CHUNKS = config.CDC_ROW_CHUNKS
+CDC_RECONNECT_DELAY = config.CDC_RECONNECT_DELAY
+
+# Postgres change feed.
+#
+# Consumes a logical replication slot (wal2json, format version 2) for one database and
+# applies the changes in batches: table_meta row counts move by the inserted/deleted rows,
+# and with CDC_ROW_CHUNKS row_chunk docs are indexed/deleted by primary key. After a batch
+# is stored, the last commit LSN is written to redis and confirmed to the server, which may
+# then recycle the WAL. On restart the feed starts from that LSN; a transaction that was
+# half applied is replayed whole, which is harmless since row docs are keyed and counts
+# only move by the changes past the LSN already applied to the table.
+#
+# The server needs wal_level=logical and the wal2json plugin, the user the REPLICATION
+# attribute. Tables need a primary key (or REPLICA IDENTITY FULL) for updates/deletes of
+# row chunks.
+
+# params.changes: [{"lsn", "delta", "truncated"}] in LSN order, one per change of the table
+ROW_COUNT_SCRIPT = """
+long applied = ctx._source.cdc_lsn == null ? -1 : ((Number) ctx._source.cdc_lsn).longValue();
+long count = ctx._source.row_count == null ? 0 : ((Number) ctx._source.row_count).longValue();
+long last = applied;
+int changes = 0;
+for (def change : params.changes) {
+    long lsn = ((Number) change.lsn).longValue();
+    if (lsn <= applied) {
+        continue;
+    }
+    long delta = ((Number) change.delta).longValue();
+    count = change.truncated ? 0 : Math.max(0L, count + delta);
+    last = Math.max(last, lsn);
+    changes++;
+}
+if (changes == 0) {
+    ctx.op = 'noop';
+} else {
+    ctx._source.row_count = count;
+    ctx._source.cdc_lsn = last;
+    ctx._source.cdc_changes = (ctx._source.cdc_changes == null ? 0 : ctx._source.cdc_changes) + changes;
+}
+"""
+
+def _values(fields) -> dict:
+    # wal2json v2 columns / identity: [{"name", "type", "value"}]
+    return {field["name"]: field.get("value") for field in fields or []}
+
+class ChangeFeed:
+    def __init__(self, host, user, password, db, es, slot=CDC_SLOT, row_chunks=CDC_ROW_CHUNKS, schema="public"):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.db = db
+        self.es = es
+        self.slot = slot
+        self.row_chunks = row_chunks
+        self.schema = schema
+
+        self.database_id = database_id(host)
+        self.checkpoint_key = f"cdc:{host}:{db}:{slot}"
+        self._redis = redis.Redis.from_url(config.TASK_REGISTRY_URL)
+
+        self.pending = [] # (lsn, change) since the last flush
+        self.commit_lsn = 0 # last commit seen, checkpointed on the next flush
+        self.checkpoint_lsn = 0 # last commit checkpointed
+        self.flushed_at = time.monotonic()
+
+    ## checkpoint
+
+    def load_checkpoint(self) -> int:
+        lsn = self._redis.get(self.checkpoint_key)
+        return int(lsn) if lsn else 0
+
+    def save_checkpoint(self, lsn: int):
+        self._redis.set(self.checkpoint_key, lsn)
+
+    def _confirm(self, cur=None):
+        # everything up to commit_lsn is stored: checkpoint it and let the server recycle the WAL
+        if self.commit_lsn and self.commit_lsn != self.checkpoint_lsn:
+            self.save_checkpoint(self.commit_lsn)
+            self.checkpoint_lsn = self.commit_lsn
+        if cur is not None:
+            cur.send_feedback(flush_lsn=self.commit_lsn)
+
+    ## replication
+
+    def _connect(self):
+        return psycopg2.connect(
+            dbname=self.db,
+            user=self.user,
+            password=self.password,
+            host=self.host,
+            connection_factory=LogicalReplicationConnection,
+        )
+
+    def _ensure_slot(self, cur):
+        try:
+            cur.create_replication_slot(self.slot, output_plugin="wal2json")
+            logger.info(f"Created replication slot {self.slot} on {self.db}")
+        except psycopg2.errors.DuplicateObject:
+            pass
+
+    def run(self, stop=None):
+        """Consume until stop() is true, reconnecting after errors."""
+        while stop is None or not stop():
+            conn = None
+            try:
+                conn = self._connect()
+                with conn.cursor() as cur:
+                    self._ensure_slot(cur)
+                    self._consume(cur, stop)
+            except psycopg2.OperationalError as e:
+                logger.warning(f"Change feed for {self.db} lost its connection, reconnecting in {CDC_RECONNECT_DELAY}s: {e}")
+                self._reset()
+            except Exception as e:
+                # a failed batch (es, redis, a server side replication error) is not confirmed, it is streamed again
+                logger.error(f"Change feed for {self.db} failed, restarting from LSN {self.checkpoint_lsn} in {CDC_RECONNECT_DELAY}s: {e}")
+                self._reset()
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _reset(self):
+        self.pending = [] # not confirmed, the server sends them again
+        time.sleep(CDC_RECONNECT_DELAY)
+
+    def _consume(self, cur, stop=None):
+        start_lsn = self.load_checkpoint()
+        self.commit_lsn = self.checkpoint_lsn = start_lsn
+        cur.start_replication(
+            slot_name=self.slot,
+            decode=True,
+            start_lsn=start_lsn,
+            options={"format-version": "2", "include-pk": "1", "add-tables": f"{self.schema}.*"},
+        )
+        logger.info(f"Streaming changes of {self.db} from LSN {start_lsn}")
+
+        while stop is None or not stop():
+            message = cur.read_message()
+            if message is None:
+                if not self.pending:
+                    self._confirm(cur) # commits without changes of the schema move the LSN too
+                elif time.monotonic() - self.flushed_at >= CDC_FLUSH_INTERVAL:
+                    self.flush(cur)
+                else:
+                    cur.send_feedback() # keepalive
+                select.select([cur], [], [], CDC_FLUSH_INTERVAL)
+                continue
+
+            change = json.loads(message.payload)
+            action = change.get("action")
+            if action in ("I", "U", "D", "T"):
+                self.pending.append((message.data_start, change))
+            elif action == "C":
+                self.commit_lsn = message.data_start
+
+            # a flush inside a big transaction still only checkpoints the previous commit
+            if len(self.pending) >= CDC_BATCH_SIZE:
+                self.flush(cur)
+
+        if self.pending:
+            self.flush(cur)
+
+    def flush(self, cur=None):
+        changes, self.pending = self.pending, []
+        self.flushed_at = time.monotonic()
+
+        stats = {}
+        rows = []
+        for lsn, change in changes:
+            table = change["table"]
+            tid = table_id(self.host, self.db, table, change.get("schema", self.schema))
+            action = change["action"]
+            stats.setdefault(tid, []).append({"lsn": lsn, "delta": {"I": 1, "D": -1}.get(action, 0), "truncated": action == "T"})
+
+            if action == "T":
+                rows = [row for row in rows if row[0] != tid] # earlier changes of the batch are gone too
+                if self.row_chunks:
+                    self.es.delete_where("row_chunk", "table_id", tid)
+                continue
+
+            if self.row_chunks:
+                rows.extend((tid, op) for op in self._row_ops(tid, change))
+
+        if rows:
+            indexed, errors = self.es.insert_objects([op for _, op in rows], index="row_chunk")
+            if errors:
+                raise RuntimeError(f"{len(errors)} row change(s) of {self.db} failed to index") # not checkpointed, replayed
+        if stats:
+            indexed, errors = self.es.insert_objects(self._stat_updates(stats), index="table_meta")
+            errors = [error for error in errors if error.get("update", {}).get("status") != 404] # tables not synced yet have no doc
+            if errors:
+                raise RuntimeError(f"{len(errors)} row count update(s) of {self.db} failed")
+
+        self._confirm(cur)
+        logger.info(f"Applied {len(changes)} change(s) of {self.db}, up to LSN {self.commit_lsn}")
+
+    def _row_ops(self, tid: str, change: dict):
+        table = change["table"]
+        key_columns = [field["name"] for field in change.get("pk", [])]
+        row = _values(change.get("columns"))
+        old_key = row_key(_values(change.get("identity")), key_columns)
+
+        if change["action"] == "D":
+            if old_key is not None:
+                yield {"_op_type": "delete", "_id": row_id(tid, old_key)}
+            return
+
+        table_name = f"{self.db}.{table}"
+        doc = row_doc(row, self.database_id, tid, table_name, key_columns, row_templates().get(table_name))
+        if doc is None:
+            return
+        if old_key is not None and old_key != doc["row_key"]: # the key itself changed
+            yield {"_op_type": "delete", "_id": row_id(tid, old_key)}
+        yield doc
+
+    def _stat_updates(self, stats: dict):
+        for tid, changes in stats.items():
+            yield {
+                "_op_type": "update",
+                "_id": tid,
+                "script": {"source": ROW_COUNT_SCRIPT, "lang": "painless", "params": {"changes": changes}},
+            }
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv(".env"))
+
+    from elasticutils import Search
+
+    feed = ChangeFeed(
+        host=os.getenv("PG_HOST", "localhost"),
+        user=os.getenv("PG_USER"),
+        password=os.getenv("PG_PWD"),
+        db=sys.argv[1],
+        es=Search(),
+    )
+    feed.run()
@@ -0,0 +1,182 @@
+import os
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+from uuid import uuid5, NAMESPACE_URL
+
+from config import config
+from log import setup_logger
+from typeutils import get_pathtypes
+
+# logger
+logger = setup_logger("crawl")
+
+TEMP_DIR = config.TEMP_DIR
+DIR_TYPE_BATCH_SIZE = config.DIR_TYPE_BATCH_SIZE
+DIR_PROGRESS_INTERVAL = config.DIR_PROGRESS_INTERVAL
+
+ARCHIVE_TYPES = ("zip", "tar", "gzip", "bzip")
+
+# Directory and archive crawling for load_data.
+#
+# crawl() walks a directory (or an archive) lazily and yields (filepath, c_type, remove)
+# for every file in it, detecting types in batches (typeutils.get_pathtypes). Archives, including
+# ones nested in a directory or in another archive, are extracted one member at a time
+# under TEMP_DIR/extract, and their members are marked for removal once ingested.
+
+def walk_files(root: str):
+    # depth first, hidden entries (.git, .DS_Store) and symlinks are skipped
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path
+        except OSError as e:
+            logger.warning(f"Cannot read {current}: {e}")
+
+def is_archive(filepath: str) -> bool:
+    # gzip and bzip are only archives if there is a tar inside
+    return zipfile.is_zipfile(filepath) or tarfile.is_tarfile(filepath)
+
+def extract_dir(archive_path: str) -> str:
+    # stable per archive path, so members keep their document ids across re-ingests
+    name = os.path.basename(archive_path)
+    return os.path.join(TEMP_DIR, "extract", f"{name}-{str(uuid5(NAMESPACE_URL, archive_path))[:8]}")
+
+def _hidden(member_name: str) -> bool:
+    return any(part.startswith(".") for part in member_name.split("/") if part not in ("", "."))
+
+def _target(dest: str, member_name: str):
+    target = os.path.realpath(os.path.join(dest, member_name))
+    if os.path.commonpath([target, os.path.realpath(dest)]) != os.path.realpath(dest):
+        logger.warning(f"Skipping archive member outside the extract dir: {member_name}")
+        return None
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    return target
+
+def extract_members(archive_path: str, dest: str):
+    """Extract one member at a time, yielding each extracted file path."""
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or _hidden(info.filename):
+                    continue
+                target = _target(dest, info.filename)
+                if target:
+                    with archive.open(info) as src, open(target, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                    yield target
+
+    else:
+        # stream mode reads the tar front to back once, members must be copied before moving on
+        with tarfile.open(archive_path, "r|*") as archive:
+            for member in archive:
+                if not member.isfile() or _hidden(member.name):
+                    continue
+                target = _target(dest, member.name)
+                if target:
+                    with archive.extractfile(member) as src, open(target, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                    yield target
+
+def _batched(items, batch_size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def crawl(root: str, c_type: str = "dir", extracted: list = None, batch_size: int = DIR_TYPE_BATCH_SIZE):
+    """
+    Yields (filepath, c_type, remove) for every file under root. Extract dirs are appended
+    to `extracted`, the caller removes them once every yielded file has been ingested.
+    """
+    if extracted is None:
+        extracted = []
+
+    if c_type == "dir":
+        files, remove = walk_files(root), False
+    else:
+        dest = extract_dir(root)
+        extracted.append(dest)
+        files, remove = extract_members(root, dest), True
+
+    for batch in _batched(files, batch_size):
+        for filepath, file_type in zip(batch, get_pathtypes(batch)):
+            if file_type in ARCHIVE_TYPES and is_archive(filepath):
+                yield from crawl(filepath, file_type, extracted, batch_size)
+                if remove:
+                    os.remove(filepath)
+            else:
+                yield filepath, file_type, remove
+
+class CrawlProgress:
+    """Per-file status and aggregate counts for a directory load, reported at most every DIR_PROGRESS_INTERVAL s."""
+
+    def __init__(self, root: str, report=None, interval: float = DIR_PROGRESS_INTERVAL):
+        self.root = root
+        self.report = report # callable(meta), e.g. a bound celery task's update_state
+        self.interval = interval
+
+        self.files = {} # filepath -> queued | indexed | skipped: <type> | failed: <error>
+        self.counts = {"queued": 0, "indexed": 0, "skipped": 0, "failed": 0}
+        self._lock = threading.Lock()
+        self._reported_at = 0.0
+
+    def _set(self, filepath: str, status: str, count: str):
+        with self._lock:
+            previous = self.files.get(filepath)
+            if previous == "queued":
+                self.counts["queued"] -= 1
+            self.files[filepath] = status
+            self.counts[count] += 1
+
+    def queued(self, filepath: str):
+        self._set(filepath, "queued", "queued")
+        self.publish()
+
+    def skipped(self, filepath: str, c_type: str):
+        self._set(filepath, f"skipped: {c_type}", "skipped")
+        self.publish()
+
+    def finished(self, filepath: str, error: BaseException = None):
+        if error is None:
+            self._set(filepath, "indexed", "indexed")
+        else:
+            logger.warning(f"Failed to ingest {filepath}: {error}")
+            self._set(filepath, f"failed: {error}", "failed")
+        self.publish()
+
+    def meta(self):
+        with self._lock:
+            return {"root": self.root, "seen": len(self.files), **self.counts} # queued is the in-flight count
+
+    def publish(self, force: bool = False):
+        if self.report is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._reported_at < self.interval:
+            return
+        self._reported_at = now
+        self.report(self.meta())
+
+    def summary(self):
+        return {**self.meta(), "files": dict(self.files)}
+
+if __name__ == "__main__":
+    import sys
+
+    for filepath, c_type, remove in crawl(sys.argv[1]):
+        print(c_type, remove, filepath)
@@ -1,6 +1,7 @@
 from fastapi import APIRouter
 
-from storage import _retrieve_all_objects
+from storage import _retrieve_all_objects, es
+from elasticutils import query_cache
 
 router = APIRouter()
 
@@ -8,4 +9,12 @@ router = APIRouter()
 async def retrieve_all(index: str):
     return _retrieve_all_objects(index)
 
+@router.get("/debug/query_cache")
+async def query_cache_stats():
+    return query_cache.stats()
+
+@router.get("/debug/rerank")
+async def rerank_stats():
+    return es.reranker.stats()
+
 # stats!!
\ No newline at end of file
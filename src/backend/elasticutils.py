@@ -1,8 +1,15 @@
-from elasticsearch import Elasticsearch, BadRequestError
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from elasticsearch import Elasticsearch, AsyncElasticsearch, ApiError, BadRequestError, helpers
 
 from config import config
 from log import setup_logger
-from embed.e5_small import embed_passage, embed_query
+from embed.e5_small import EMB_MODEL, embed_passage, embed_passages, query_batcher
+from embed.cache import EmbeddingCache
+from rerank import Reranker, RERANK_MAX_CANDIDATES
+from fusion import fuse, normalize_scores, FUSION_METHODS, NORMALIZATIONS, RANK_CONSTANT, RANK_WINDOW_SIZE, TOP_K
 
 # logger
 logger = setup_logger("elastic")
@@ -12,6 +19,181 @@ ELASTIC_CA_CERT_PATH=config.ELASTIC_CA_CERT_PATH
 ELASTIC_USER=config.ELASTIC_USER
 ELASTIC_URL=config.ELASTIC_URL
 
+ES_BULK_CHUNK_SIZE=config.ES_BULK_CHUNK_SIZE
+ES_BULK_MAX_BYTES=config.ES_BULK_MAX_BYTES
+ES_BULK_MAX_RETRIES=config.ES_BULK_MAX_RETRIES
+EMBED_BATCH_SIZE=config.EMBED_BATCH_SIZE
+QUERY_EMBED_WORKERS=config.QUERY_EMBED_WORKERS
+RETRIEVAL_MODE=config.RETRIEVAL_MODE
+NUM_CANDIDATES=50 # knn candidates per shard, raised to the rank window when that is larger
+
+# how the match and knn legs of hybrid search reach ES and get fused
+#   client_rrf: two searches, fused in python
+#   msearch_rrf: one _msearch carrying both legs, fused in python
+#   server_rrf: one search with the rrf retriever (ES >= 8.14), falls back to client_rrf
+RETRIEVAL_MODES = ("client_rrf", "msearch_rrf", "server_rrf")
+
+# repeated /query requests skip the forward pass
+query_cache = EmbeddingCache(
+    maxsize=config.QUERY_CACHE_SIZE,
+    ttl=config.QUERY_CACHE_TTL,
+    redis_url=config.QUERY_CACHE_REDIS_URL,
+)
+
+def embed_query_cached(query: str) -> list:
+    # misses go through the micro-batcher, so concurrent /query requests share a forward pass
+    return query_cache.get_or_compute(query, EMB_MODEL, lambda q: query_batcher.embed(q).tolist())
+
+# field that gets embedded into 'e5' for each index
+EMBED_FIELDS = {
+    "text_chunk": "chunk_text",
+    "table_meta": "description_text",
+    "model_meta": "description_text",
+    "row_chunk": "chunk_text",
+}
+
+## mappings
+
+# vector storage profiles, mapped to dense_vector index_options types
+#   float: plain hnsw over float32
+#   int8_hnsw (ES >= 8.12), int4_hnsw (ES >= 8.15), bbq_hnsw (ES >= 8.16): quantized hnsw,
+#   ES keeps the raw floats on disk for rescoring but only the quantized vectors in the graph
+VECTOR_PROFILES = {
+    "float": "hnsw",
+    "int8_hnsw": "int8_hnsw",
+    "int4_hnsw": "int4_hnsw",
+    "bbq_hnsw": "bbq_hnsw",
+}
+
+def vector_mapping(index: str, profile: str = None):
+    profile = profile or config.VECTOR_PROFILE
+    if profile not in VECTOR_PROFILES:
+        raise ValueError(f"Unknown vector profile ({profile}), expected one of {list(VECTOR_PROFILES)}.")
+
+    # vectors that are never searched are kept in _source only, without a graph
+    if index not in config.VECTOR_KNN_INDICES:
+        return {
+            'type': 'dense_vector',
+            'dims': config.E5_DIMS,
+            'index': False
+            }
+
+    return {
+        'type': 'dense_vector',
+        'dims': config.E5_DIMS,
+        'index': True,
+        'similarity': 'cosine',
+        'index_options': {
+            'type': VECTOR_PROFILES[profile],
+            'm': config.HNSW_M,
+            'ef_construction': config.HNSW_EF_CONSTRUCTION
+            }
+        }
+
+def index_mappings(profile: str = None):
+    return {
+        # inferior to documents
+        'text_chunk': {
+            'properties': {
+                'document_id': {'type': 'keyword'}, # TODO: Should this be murmur? check the available types
+                'access_group': {'type': 'keyword'},
+                "document_name": {
+                        "type": "text",  # Main type for full-text search
+                        "fields": {
+                            "kw": {  # Sub-field for exact matches and aggregations
+                                "type": "keyword"
+                            }
+                        }
+                    },
+                'chunk_text': {'type': 'text'},
+                'chunking_strategy': {'type': 'keyword'},
+                'chunk_no': {'type': 'integer'},
+                'file_hash': {'type': 'keyword'}, # sha256 of the source file
+                'chunk_hash': {'type': 'keyword'}, # sha256 of chunk_text, used to skip and reuse embeddings
+                # embeddings
+                'e5': vector_mapping('text_chunk', profile),
+                'colbert': {'type': 'object', 'enabled': False}  # disable indexing for the 'colbert' field
+
+            }
+        },
+        # inferior to databases
+        'table_meta': {
+            'properties': {
+                'database_id': {'type': 'keyword'},
+                'access_group': {'type': 'keyword'},
+                'table_name': {'type': 'text'},
+                'description_text': {'type': 'text'},
+                'chunking_strategy': {'type': 'keyword'},
+                'chunk_no': {'type': 'integer'},
+                'table_hash': {'type': 'keyword'},
+                'row_count': {'type': 'long'},
+                'column_stats': {'type': 'object', 'enabled': False}, # per column type, nulls, min/max/mean/std
+                # embeddings
+                'e5': vector_mapping('table_meta', profile),
+                "correlation_embedding": {
+                    "type": "nested",
+                    "properties": {
+                        "key": {"type": "keyword"},
+                    }
+                },
+                'colbert': {'type': 'object', 'enabled': False} # disable indexing for the 'colbert' field
+                # meta
+            }
+        },
+        # rows of database tables, see rows.py
+        'row_chunk': {
+            'properties': {
+                'database_id': {'type': 'keyword'},
+                'table_id': {'type': 'keyword'},
+                'access_group': {'type': 'keyword'},
+                'table_name': {
+                        'type': 'text',
+                        'fields': {
+                            'kw': {'type': 'keyword'}
+                        }
+                    },
+                'row_key': {'type': 'keyword'}, # primary key values, joined with |
+                'row_sync': {'type': 'keyword'}, # table hash of the extraction that wrote the row
+                'chunk_text': {'type': 'text'},
+                # embeddings
+                'e5': vector_mapping('row_chunk', profile),
+                'colbert': {'type': 'object', 'enabled': False}
+            }
+        },
+        # inferior to model tasks
+        'model_meta': {
+            'properties': {
+                'model_id': {'type': 'keyword'},
+                'access_group': {'type': 'keyword'},
+                'model_name': {'type': 'text'},
+                'description_text': {'type': 'text'},
+                'chunking_strategy': {'type': 'keyword'},
+                'model_hash': {'type': 'keyword'},
+                # embeddings
+                'e5': vector_mapping('model_meta', profile),
+                "correlation_embedding": {
+                    "type": "nested",
+                    "properties": {
+                        "key": {"type": "keyword"},
+                    }
+                },
+                'colbert': {'type': 'object', 'enabled': False},  # disable indexing for the 'colbert' field
+                # meta
+                'input_features': {
+                    'type': 'nested',  # Use nested to support future complexity
+                    'properties': {
+                        'feature_name': {'type': 'keyword'},
+                        'feature_type': {'type': 'keyword'},  # e.g., categorical, numerical, etc.
+                        'encoding': {
+                            'type': 'keyword',  # Store encoding types like 'one-hot', 'label', 'binary', etc.
+                            'null_value': 'none'  # Default to 'none' if no encoding is used
+                        }
+                    }
+                }
+            }
+        },
+    }
+
 class Search:
     def __init__(self):
         self.es = Elasticsearch(
@@ -19,130 +201,25 @@ class Search:
             ca_certs=ELASTIC_CA_CERT_PATH,
             basic_auth=(ELASTIC_USER, ELASTIC_PASSWORD)
         )
+        self._async_es = None
+        self._reranker = None
+        self._server_rrf_supported = True # flipped off the first time the cluster rejects the rrf retriever
+        self._embed_executor = ThreadPoolExecutor(max_workers=QUERY_EMBED_WORKERS, thread_name_prefix="query-embed")
+
         client_info = self.es.info()
         logger.info("ES is available")
         logger.info(str(client_info))
 
-        # inferior to documents
-        # configure text_chunk
-        try:
-            self.es.indices.create( # may fail if index exists
-                index='text_chunk', 
-                mappings={
-                    'properties': {
-                        'document_id': {'type': 'keyword'}, # TODO: Should this be murmur? check the available types
-                        'access_group': {'type': 'keyword'},
-                        "document_name": {
-                                "type": "text",  # Main type for full-text search
-                                "fields": {
-                                    "kw": {  # Sub-field for exact matches and aggregations
-                                        "type": "keyword"
-                                    }
-                                }
-                            },
-                        'chunk_text': {'type': 'text'},
-                        'chunking_strategy': {'type': 'keyword'},
-                        'chunk_no': {'type': 'integer'},
-                        # embeddings
-                        'e5': {
-                            'type': 'dense_vector',
-                            # 'dim': 'not set',
-                            'similarity': 'cosine'
-                            },
-                        'colbert': {'type': 'object', 'enabled': False}  # disable indexing for the 'colbert' field
-                        
-                    }
-                })
-        except BadRequestError as e:
-            if e.error != "resource_already_exists_exception" or e.status_code != 400:
-                logger.warn(e.error)
-                raise
-        
-        # inferior to databases
-        # configure table_meta
-        try:
-            self.es.indices.create( # may fail if index exists
-                index='table_meta', 
-                mappings={
-                    'properties': {
-                        'database_id': {'type': 'keyword'},
-                        'access_group': {'type': 'keyword'},
-                        'table_name': {'type': 'text'},
-                        'description_text': {'type': 'text'},
-                        'chunking_strategy': {'type': 'keyword'},
-                        'chunk_no': {'type': 'integer'},
-                        'table_hash': {'type': 'keyword'},
-                        # embeddings
-                        'e5': {
-                            'type': 'dense_vector',
-                            # 'dim': 'not set',
-                            'similarity': 'cosine'
-                            },
-                        "correlation_embedding": {
-                            "type": "nested",
-                            "properties": {
-                                "key": {"type": "keyword"},
-                            }
-                        },
-                        'colbert': {'type': 'object', 'enabled': False} # disable indexing for the 'colbert' field
-                        # meta
-                    }
-                })
-        except BadRequestError as e:
-            if e.error != "resource_already_exists_exception" or e.status_code != 400:
-                logger.warn(e.error)
-                raise
-        
-        # inferior to model tasks
-        # configure model_meta
-        try:
-            self.es.indices.create( # may fail if index exists
-                index='model_meta', 
-                mappings={
-                    'properties': {
-                        'model_id': {'type': 'keyword'},
-                        'access_group': {'type': 'keyword'},
-                        'model_name': {'type': 'text'},
-                        'description_text': {'type': 'text'},
-                        'chunking_strategy': {'type': 'keyword'},
-                        'model_hash': {'type': 'keyword'},
-                        # embeddings
-                        'e5': {
-                            'type': 'dense_vector',
-                            # 'dim': 'not set',
-                            'similarity': 'cosine'
-                            },
-                        "correlation_embedding": {
-                            "type": "nested",
-                            "properties": {
-                                "key": {"type": "keyword"},
-                            }
-                        },
-                        'colbert': {'type': 'object', 'enabled': False},  # disable indexing for the 'colbert' field
-                        # meta
-                        'input_features': {
-                            'type': 'nested',  # Use nested to support future complexity
-                            'properties': {
-                                'feature_name': {'type': 'keyword'},
-                                'feature_type': {'type': 'keyword'},  # e.g., categorical, numerical, etc.
-                                'encoding': {
-                                    'type': 'keyword',  # Store encoding types like 'one-hot', 'label', 'binary', etc.
-                                    'null_value': 'none'  # Default to 'none' if no encoding is used
-                                }
-                            }
-                        }
-                    }
-                })
-        except BadRequestError as e:
-            if e.error != "resource_already_exists_exception" or e.status_code != 400:
-                logger.warn(e.error)
-                raise
+        # configure text_chunk, table_meta, row_chunk and model_meta
+        for index, mappings in index_mappings().items():
+            self._create_index(index, mappings)
 
         logger.info("Configured.")
 
         self.registered_indices = [
             "text_chunk",
             "table_meta",
+            "row_chunk",
             "model_meta"
         ]
 
@@ -156,6 +233,96 @@ class Search:
             r = r + f"\n.... [{idx}] storing {self.es.count(index=idx)['count']} value(s)"
         return r
     
+    def _create_index(self, index: str, mappings: dict):
+        try:
+            self.es.indices.create(index=index, mappings=mappings) # may fail if index exists
+        except BadRequestError as e:
+            # an alias left by migrate_index also counts as existing
+            alias_exists = e.error == "invalid_index_name_exception" and self.es.indices.exists_alias(name=index)
+            if not alias_exists and (e.error != "resource_already_exists_exception" or e.status_code != 400):
+                logger.warn(e.error)
+                raise
+            self._sync_mappings(index, mappings)
+
+    def _sync_mappings(self, index: str, mappings: dict):
+        # add fields introduced since the index was created. existing fields are left
+        # alone, changing those needs a reindex (see migrate_index)
+        current = self.es.indices.get_mapping(index=index)
+        existing = set()
+        for mapping in current.values():
+            existing.update(mapping["mappings"].get("properties", {}))
+
+        missing = {k: v for k, v in mappings["properties"].items() if k not in existing}
+        if missing:
+            logger.info(f"Adding {list(missing)} to {index} mappings")
+            self.es.indices.put_mapping(index=index, properties=missing)
+
+    # admin ops
+    def migrate_index(self, index: str, profile: str = None, poll_interval: float = 5.0):
+        """
+        Reindex `index` into a fresh index with the current mappings (vector profile, dims,
+        hnsw settings), then atomically point the `index` alias at it and drop the old one.
+        The source is write blocked for the duration, so stop ingestion first.
+        """
+        profile = profile or config.VECTOR_PROFILE
+        mappings = index_mappings(profile)[index]
+
+        # the first migration replaces a concrete index, later ones move an alias
+        if self.es.indices.exists_alias(name=index):
+            source = next(iter(self.es.indices.get_alias(name=index)))
+        else:
+            source = index
+
+        target = f"{index}-{profile}-{int(time.time())}"
+        logger.info(f"Migrating {source} -> {target}")
+
+        self.es.indices.put_settings(index=source, settings={"index.blocks.write": True})
+        try:
+            self.es.indices.create(index=target, mappings=mappings)
+
+            task = self.es.reindex(
+                source={"index": source},
+                dest={"index": target},
+                slices="auto",
+                wait_for_completion=False,
+            )["task"]
+
+            while True:
+                status = self.es.tasks.get(task_id=task)
+                if status["completed"]:
+                    break
+                progress = status["task"]["status"]
+                logger.info(f"Reindexed {progress['created']}/{progress['total']} document(s)")
+                time.sleep(poll_interval)
+
+            failures = status.get("response", {}).get("failures") or status.get("error")
+            if failures:
+                raise RuntimeError(f"Reindex of {source} failed: {failures}")
+
+            self.es.indices.refresh(index=target)
+            source_count = self.es.count(index=source)["count"]
+            target_count = self.es.count(index=target)["count"]
+            if source_count != target_count:
+                raise RuntimeError(f"Reindex of {source} copied {target_count}/{source_count} document(s)")
+        except Exception:
+            self.es.indices.put_settings(index=source, settings={"index.blocks.write": False})
+            raise
+
+        # remove_index + add in one request, so readers never see a missing index
+        actions = [{"add": {"index": target, "alias": index}}]
+        if source == index:
+            actions.insert(0, {"remove_index": {"index": source}})
+        else:
+            actions.insert(0, {"remove": {"index": source, "alias": index}})
+        self.es.indices.update_aliases(actions=actions)
+
+        if source != index:
+            self.es.indices.delete(index=source)
+
+        logger.info(f"Migrated {index} to {target} ({target_count} document(s))")
+
+        return target
+
     # load ops
     def insert_object(self, document: any, index: str):
 
@@ -177,12 +344,158 @@ class Search:
 
         return self.es.index(index=index, body=document)
 
-    def insert_objects(self, documents: any, index: str):
-        operations = []
+    def _embed_batch(self, batch: list, index: str):
+        field = EMBED_FIELDS.get(index)
+
+        if field:
+            # documents may arrive with embeddings already attached, or be updates/deletes
+            pending = [document for document in batch if 'e5' not in document and '_op_type' not in document]
+            vectors = embed_passages([document[field] for document in pending])
+            for document, vector in zip(pending, vectors):
+                document['e5'] = vector.tolist()
+
+            for document in batch:
+                if '_op_type' not in document:
+                    document.setdefault('colbert', {})
+
+        return batch
+
+    def _bulk_actions(self, documents, index: str, embed_batch_size: int):
+        # pulled lazily by streaming_bulk, so at most one embedding batch plus one
+        # bulk chunk is held in memory and a slow cluster slows the producer down
+        batch = []
         for document in documents:
-            operations.append({'index': {'_index': index}})
-            operations.append(document)
-        return self.es.bulk(operations=operations)
+            batch.append(document)
+            if len(batch) >= embed_batch_size:
+                yield from self._to_actions(self._embed_batch(batch, index), index)
+                batch = []
+
+        if batch:
+            yield from self._to_actions(self._embed_batch(batch, index), index)
+
+    def _to_actions(self, documents: list, index: str):
+        for document in documents:
+            op_type = document.pop("_op_type", "index")
+
+            if op_type == "update" and "script" in document:
+                action = {"_op_type": "update", "_index": index, "_id": document.pop("_id"), "script": document.pop("script")}
+                if "upsert" in document:
+                    action["upsert"] = document.pop("upsert")
+                yield action
+            elif op_type == "update":
+                yield {"_op_type": "update", "_index": index, "_id": document.pop("_id"), "doc": document}
+            elif op_type == "delete":
+                yield {"_op_type": "delete", "_index": index, "_id": document["_id"]}
+            else:
+                action = {"_index": index, "_source": document}
+                if "_id" in document:
+                    action["_id"] = document.pop("_id")
+                yield action
+
+    def stream_objects(
+            self,
+            documents,
+            index: str,
+            chunk_size: int = ES_BULK_CHUNK_SIZE,
+            max_chunk_bytes: int = ES_BULK_MAX_BYTES,
+            embed_batch_size: int = EMBED_BATCH_SIZE,
+            ):
+        """
+        Embed and bulk index an iterable of documents. Yields (ok, item) per document,
+        where item is the per-item response from _bulk.
+        """
+        yield from helpers.streaming_bulk(
+            self.es,
+            self._bulk_actions(documents, index, embed_batch_size),
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
+            max_retries=ES_BULK_MAX_RETRIES, # 429s are retried with exponential backoff
+            raise_on_error=False,
+            raise_on_exception=False,
+        )
+
+    def insert_objects(self, documents, index: str, progress=None, checkpoint=None, **bulk_args):
+        """
+        Returns (indexed, errors). checkpoint(indexed) is called per success until something
+        fails; results come back in document order, except for 429 retries inside a chunk.
+        """
+        indexed = 0
+        errors = []
+
+        for ok, item in self.stream_objects(documents, index, **bulk_args):
+            if ok:
+                indexed += 1
+                if progress is not None:
+                    progress.add("indexed")
+                if checkpoint is not None and not errors:
+                    checkpoint(indexed)
+            else:
+                errors.append(item)
+                logger.warning(f"Failed to index document: {item}")
+
+        logger.info(f"Bulk inserted {indexed} document(s) into {index}, {len(errors)} failed.")
+
+        return indexed, errors
+
+    def delete_objects(self, ids, index: str):
+        return self.insert_objects(({"_op_type": "delete", "_id": _id} for _id in ids), index)
+
+    def delete_where(self, index: str, field: str, value, keep: dict = None):
+        # e.g. every row_chunk of a truncated table. docs matching a `keep` term are spared
+        query = {"bool": {"filter": [{"term": {field: value}}]}}
+        if keep:
+            query["bool"]["must_not"] = [{"term": {name: term}} for name, term in keep.items()]
+        response = self.es.delete_by_query(index=index, query=query, conflicts="proceed", refresh=True)
+        return response["deleted"]
+
+    # content addressing ops
+    def document_file_hashes(self, document_id: str, index: str = "text_chunk") -> set:
+        response = self.es.search(
+            index=index,
+            size=0,
+            query={"term": {"document_id": document_id}},
+            aggs={"file_hashes": {"terms": {"field": "file_hash", "missing": "", "size": 10}}},
+        )
+        return {bucket["key"] for bucket in response["aggregations"]["file_hashes"]["buckets"]}
+
+    def chunk_ids_by_hash(self, document_id: str, index: str = "text_chunk") -> dict:
+        chunk_ids = {}
+        for hit in helpers.scan(
+                self.es,
+                index=index,
+                query={"query": {"term": {"document_id": document_id}}},
+                _source=["chunk_hash"],
+                ):
+            chunk_ids.setdefault(hit["_source"].get("chunk_hash"), []).append(hit["_id"])
+        return chunk_ids
+
+    def table_hashes(self, database_id: str, index: str = "table_meta") -> dict:
+        # _id -> (table_hash, table_name) of every table indexed for a database
+        tables = {}
+        for hit in helpers.scan(
+                self.es,
+                index=index,
+                query={"query": {"term": {"database_id": database_id}}},
+                _source=["table_hash", "table_name"],
+                ):
+            tables[hit["_id"]] = (hit["_source"].get("table_hash"), hit["_source"].get("table_name"))
+        return tables
+
+    def embeddings_by_hash(self, chunk_hashes: list, index: str = "text_chunk") -> dict:
+        if not chunk_hashes:
+            return {}
+        response = self.es.search(
+            index=index,
+            size=len(chunk_hashes),
+            query={"terms": {"chunk_hash": list(chunk_hashes)}},
+            collapse={"field": "chunk_hash"}, # one hit per hash is enough
+            _source=["chunk_hash", "e5"],
+        )
+        return {
+            hit["_source"]["chunk_hash"]: hit["_source"]["e5"]
+            for hit in response["hits"]["hits"]
+            if "e5" in hit["_source"]
+        }
 
     # query ops
     def retrieve_object_by_id(self, id, index):
@@ -240,136 +553,335 @@ class Search:
     def search(self, index: str, **query_args):
         return self.es.search(index=index, **query_args)
 
-    def _rrf(self, result_sets_with_rankings, weights, field, k=60, normalize=False, INSPECT=False):
-        combined_results = {}
-
-        # Process each result set and apply reciprocal rank formula
-        for result_set, results in result_sets_with_rankings.items():
-            weight = weights[result_set]
-            for rank, result in enumerate(results, 1):
-                _id = result['_id']
-                if _id in combined_results:
-                    combined_results[_id]["score"] += weight / (k + rank)
-                else:
-                    combined_results[_id] = {
-                        "score": weight / (k + rank),
-                        "text": result["_source"].get(field, '')
+    def _search_field(self, index: str):
+        # Determine the field to use based on the index
+        if index not in EMBED_FIELDS:
+            raise NotImplementedError
+        return EMBED_FIELDS[index]
+
+    def _match_query(self, query: str, field: str, doc_ids: list[str] = None, size: int = RANK_WINDOW_SIZE):
+        match_query = {
+            "size": size,
+            "query": {
+                "bool": {
+                    "must": [
+                        {"match": {field: query}}
+                    ]
+                }
+            },
+            "_source": [field]
+        }
+
+        # add filter if doc_id is provided
+        if doc_ids:
+            match_query["query"]["bool"]["filter"] = [{"terms": {"document_id": doc_ids}}]
+
+        return match_query
+
+    def _knn_query(self, query_vector: list, field: str, doc_ids: list[str] = None, size: int = RANK_WINDOW_SIZE):
+        knn_query = {
+                "size" : size,
+                "query" : {
+                    "bool" : {
+                        "must" : {
+                            "knn": {
+                                'field': 'e5',
+                                'query_vector': query_vector,
+                                'num_candidates': max(size, NUM_CANDIDATES)
+                            }
+                        }
                     }
+                },
+                "_source": [field]
+            }
+
+        # add filter if doc_id is provided
+        if doc_ids:
+            knn_query["query"]["bool"]["filter"] = [{"terms": {"document_id": doc_ids}}]
 
-        # Sort results by score in descending order
-        sorted_results = sorted(combined_results.items(), key=lambda item: item[1]['score'], reverse=True)
+        return knn_query
+
+    def _fuse(self, responses: dict, field: str, fusion_args: dict, INSPECT=False):
+        if INSPECT:
+            for leg, response in responses.items():
+                print(leg.upper())
+                for hit in response['hits']['hits']:
+                    print(f"ID: {hit['_id']}, Score: {hit['_score']}, Snippet: {hit['_source'][field][:100]}...")
+
+        fusion_args = dict(fusion_args)
+        normalize = fusion_args.pop("normalize", None)
+
+        fused = fuse({leg: response['hits']['hits'] for leg, response in responses.items()}, **fusion_args)
 
         # convert to list of dicts (readability)
-        sorted_results = [{"id": _id, "score": res["score"], "text": res["text"]} for _id, res in sorted_results]
+        results = [{"id": _id, "score": score, "text": hit["_source"].get(field, '')} for _id, score, hit in fused]
 
         # Optionally normalize scores
-        if normalize:
-            min_score = min(result["score"] for _, result in sorted_results)
-            max_score = max(result["score"] for _, result in sorted_results)
-            for _, result in sorted_results:
-                result["normalized_score"] = (result["score"] - min_score) / (max_score - min_score) if max_score > min_score else 0
+        if normalize and results:
+            normalized = normalize_scores([r["score"] for r in results], normalize)
+            for result, score in zip(results, normalized):
+                result["normalized_score"] = float(score)
 
         # Optionally inspect final results
         if INSPECT:
             print("FINAL")
-            for _id, res in sorted_results:
-                print(f"ID: {_id}, Score: {res['score']:.6f}, Snippet: {res['text'][:100]}...")
+            for res in results:
+                print(f"ID: {res['id']}, Score: {res['score']:.6f}, Snippet: {res['text'][:100]}...")
 
-        return sorted_results
-    
-    def hybrid_search(self, query: str, index: str, doc_ids: list[str] = None):
-        INSPECT = False
-        print(doc_ids)
-        if not doc_ids:
-            print("no doc_id")
-        # Determine the field to use based on the index
-        if index == 'text_chunk':
-            _field = "chunk_text"
-        elif index == 'table_meta':
-            _field = "description_text"
-        elif index == 'model_meta':
-            _field = "description_text"
-        else:
-            raise NotImplementedError
+        logger.info(f"Hybrid search returned {len(results)} elements.")
 
-        # construct the match query
-        try:
-            match_query = {
-                "query": {
-                    "bool": {
-                        "must": [
-                            {"match": {_field: query}}
-                        ]
-                    }
-                },
-                "_source": [_field]
-            }
+        return results
 
-            # add filter if doc_id is provided
-            if doc_ids:
-                match_query["query"]["bool"]["filter"] = [{"terms": {"document_id": doc_ids}}]
+    def _retriever_query(self, query: str, query_vector: list, field: str, doc_ids: list[str] = None, fusion_args: dict = None):
+        # sent as body=, elasticsearch-py < 8.14 has no retriever keyword
+        fusion_args = fusion_args or {}
+        window = fusion_args.get("rank_window_size", RANK_WINDOW_SIZE)
 
-            match_response = self.es.search(index=index, body=match_query)
-        except BadRequestError as e:
-            logger.info(e)
-            return None
+        knn = {
+            'field': 'e5',
+            'query_vector': query_vector,
+            'k': window,
+            'num_candidates': max(window, NUM_CANDIDATES)
+        }
 
-        if INSPECT:
-            print("MATCH")
-            for hit in match_response['hits']['hits']:
-                print(f"ID: {hit['_id']}, Score: {hit['_score']}, Snippet: {hit['_source'][_field][:100]}...")
+        # add filter if doc_id is provided
+        if doc_ids:
+            knn["filter"] = {"terms": {"document_id": doc_ids}}
+
+        return {
+            "retriever": {
+                "rrf": {
+                    "retrievers": [
+                        {"standard": {"query": self._match_query(query, field, doc_ids)["query"]}},
+                        {"knn": knn}
+                    ],
+                    "rank_window_size": window,
+                    "rank_constant": fusion_args.get("rank_constant", RANK_CONSTANT)
+                }
+            },
+            "size": fusion_args.get("top_k", TOP_K),
+            "_source": [field]
+        }
+
+    def _msearch_body(self, index: str, query: str, query_vector: list, field: str, doc_ids: list[str] = None, size: int = RANK_WINDOW_SIZE):
+        return [
+            {"index": index},
+            self._match_query(query, field, doc_ids, size),
+            {"index": index},
+            self._knn_query(query_vector, field, doc_ids, size),
+        ]
+
+    def _msearch_responses(self, response):
+        # _msearch reports failures per search instead of raising
+        responses = response["responses"]
+        for r in responses:
+            if "error" in r:
+                logger.info(r["error"])
+                return None
+        return dict(zip(("match", "knn"), responses))
+
+    def _server_results(self, response, field: str, fusion_args: dict):
+        results = [
+            {"id": hit["_id"], "score": hit["_score"], "text": hit["_source"].get(field, '')}
+            for hit in response["hits"]["hits"]
+        ]
 
-        match_results = match_response['hits']['hits']
+        normalize = fusion_args.get("normalize")
+        if normalize and results:
+            normalized = normalize_scores([r["score"] for r in results], normalize)
+            for result, score in zip(results, normalized):
+                result["normalized_score"] = float(score)
+
+        logger.info(f"Hybrid search returned {len(results)} elements.")
+
+        return results
+
+    def _resolve_mode(self, mode: str, fusion_args: dict):
+        mode = mode or RETRIEVAL_MODE
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode ({mode}), expected one of {RETRIEVAL_MODES}.")
+
+        if mode == "server_rrf":
+            # the rrf retriever has no per-leg weights or score-based fusion, but
+            # msearch still keeps it to one round trip
+            weights = fusion_args.get("weights") or {}
+            if fusion_args.get("method", "rrf") != "rrf" or len(set(weights.values())) > 1:
+                return "msearch_rrf"
+            if not self._server_rrf_supported:
+                return "client_rrf"
+
+        return mode
+
+    def _server_rrf_failed(self, e: ApiError):
+        # only a cluster that rejects the retriever (ES < 8.14, or rrf not in the license)
+        # turns server_rrf off; bad arguments, timeouts, 429s etc. fall back for this one query
+        error = e.body.get("error") if isinstance(e.body, dict) else None
+        error = error if isinstance(error, dict) else {}
+        error_type = error.get("type", "")
+        reason = str(error.get("reason", "")).lower()
+        unknown_retriever = e.status_code == 400 and error_type in ("parsing_exception", "x_content_parse_exception") and "retriever" in reason
+        unlicensed = e.status_code == 403 and error_type == "security_exception" and "license" in reason
+        if unknown_retriever or unlicensed:
+            logger.warning(f"Server side rrf unsupported, using client_rrf from now on: {e}")
+            self._server_rrf_supported = False
+        else:
+            logger.warning(f"Server side rrf failed, falling back to client_rrf for this query: {e}")
+
+    def _fusion_args(self, fusion_args: dict):
+        fusion_args = {k: v for k, v in fusion_args.items() if v is not None}
+        method = fusion_args.get("method", "rrf")
+        if method not in FUSION_METHODS:
+            raise ValueError(f"Unknown fusion method ({method}), expected one of {FUSION_METHODS}.")
+        for key in ("normalization", "normalize"):
+            if fusion_args.get(key, "minmax") not in NORMALIZATIONS:
+                raise ValueError(f"Unknown normalization ({fusion_args[key]}), expected one of {NORMALIZATIONS}.")
+        # es rejects a size above rank_window_size, and a smaller window can't fill top_k anyway
+        if "top_k" in fusion_args:
+            fusion_args["rank_window_size"] = max(fusion_args["top_k"], fusion_args.get("rank_window_size", RANK_WINDOW_SIZE))
+        return fusion_args
+
+    @property
+    def reranker(self):
+        # the cross-encoder only loads once something asks for a rerank
+        if self._reranker is None:
+            self._reranker = Reranker()
+        return self._reranker
+
+    def _rerank_args(self, fusion_args: dict):
+        # fuse a deeper pool than requested so the reranker has candidates to promote
+        top_k = fusion_args.get("top_k", TOP_K)
+        pool = max(top_k, RERANK_MAX_CANDIDATES)
+        return top_k, {
+            **fusion_args,
+            "top_k": pool,
+            "rank_window_size": max(pool, fusion_args.get("rank_window_size", RANK_WINDOW_SIZE)),
+        }
+
+    def hybrid_search(self, query: str, index: str, doc_ids: list[str] = None, mode: str = None, rerank: bool = False, **fusion_args):
+        """
+        fusion_args are passed to fusion.fuse (method, weights, rank_constant,
+        rank_window_size, top_k, normalization), plus `normalize` to attach a
+        normalized_score to the fused results. With rerank, the fused candidates
+        are rescored by the cross-encoder (see rerank.py) before the top_k cut.
+        """
+        fusion_args = self._fusion_args(fusion_args)
+
+        if rerank:
+            top_k, pool_args = self._rerank_args(fusion_args)
+            results = self._hybrid_search(query, index, doc_ids, mode, pool_args)
+            return self.reranker.rerank(query, results, top_k) if results else results
+
+        return self._hybrid_search(query, index, doc_ids, mode, fusion_args)
+
+    def _hybrid_search(self, query: str, index: str, doc_ids: list[str], mode: str, fusion_args: dict):
+        INSPECT = False
+        _field = self._search_field(index)
+        mode = self._resolve_mode(mode, fusion_args)
+        window = fusion_args.get("rank_window_size", RANK_WINDOW_SIZE)
+
+        if mode == "server_rrf":
+            try:
+                response = self.es.search(index=index, body=self._retriever_query(query, embed_query_cached(query), _field, doc_ids, fusion_args))
+                return self._server_results(response, _field, fusion_args)
+            except ApiError as e:
+                self._server_rrf_failed(e)
+                mode = "client_rrf"
 
-        # Construct the knn query
         try:
-            knn_query = {
-                    "size" : 0,
-                    "query" : {
-                        "bool" : {
-                            "must" : {
-                                "knn": {
-                                    'field': 'e5',
-                                    'query_vector': embed_query(query).tolist()[0],
-                                    'num_candidates': 50
-                                }
-                            }
-                        }
-                    }
+            if mode == "msearch_rrf":
+                responses = self._msearch_responses(self.es.msearch(
+                    searches=self._msearch_body(index, query, embed_query_cached(query), _field, doc_ids, window)
+                ))
+                if responses is None:
+                    return None
+            else:
+                responses = {
+                    "match": self.es.search(index=index, body=self._match_query(query, _field, doc_ids, window)),
+                    "knn": self.es.search(index=index, body=self._knn_query(embed_query_cached(query), _field, doc_ids, window)),
                 }
-            
-            # add filter if doc_id is provided
-            if doc_ids:
-                knn_query["query"]["bool"]["filter"] = [{"terms": {"document_id": doc_ids}}]
-
-            knn_response = self.es.search(index=index, body=knn_query)
         except BadRequestError as e:
             logger.info(e)
             return None
 
-        if INSPECT:
-            print("KNN")
-            for hit in knn_response['hits']['hits']:
-                print(f"ID: {hit['_id']}, Score: {hit['_score']}, Snippet: {hit['_source'][_field][:100]}...")
-
-        knn_results = knn_response['hits']['hits']
-
-        # Combine results with reciprocal rank fusion
-        result_sets_with_rankings = {
-            "match": match_results,
-            "knn": knn_results
-        }
-
-        weights = {
-            "match": 1.0,
-            "knn": 1.0
-        }
+        return self._fuse(responses, _field, fusion_args, INSPECT=INSPECT)
+
+    # async query ops
+
+    @property
+    def async_es(self):
+        # created on first use, so celery workers never open an aiohttp session
+        if self._async_es is None:
+            self._async_es = AsyncElasticsearch(
+                ELASTIC_URL,
+                ca_certs=ELASTIC_CA_CERT_PATH,
+                basic_auth=(ELASTIC_USER, ELASTIC_PASSWORD)
+            )
+        return self._async_es
+
+    async def _embed_query_async(self, query: str):
+        # the cache lookup runs in the pool too, its shared tier is a blocking redis GET.
+        # torch releases the GIL during the forward pass, so a thread pool is enough
+        # to keep the event loop free without paying for a second copy of the model
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._embed_executor, embed_query_cached, query)
+
+    async def async_hybrid_search(self, query: str, index: str, doc_ids: list[str] = None, mode: str = None, rerank: bool = False, **fusion_args):
+        fusion_args = self._fusion_args(fusion_args)
+
+        if rerank:
+            top_k, pool_args = self._rerank_args(fusion_args)
+            results = await self._async_hybrid_search(query, index, doc_ids, mode, pool_args)
+            if not results:
+                return results
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._embed_executor, self.reranker.rerank, query, results, top_k)
+
+        return await self._async_hybrid_search(query, index, doc_ids, mode, fusion_args)
+
+    async def _async_hybrid_search(self, query: str, index: str, doc_ids: list[str], mode: str, fusion_args: dict):
+        INSPECT = False
+        _field = self._search_field(index)
+        mode = self._resolve_mode(mode, fusion_args)
+        window = fusion_args.get("rank_window_size", RANK_WINDOW_SIZE)
+
+        if mode == "server_rrf":
+            try:
+                query_vector = await self._embed_query_async(query)
+                response = await self.async_es.search(index=index, body=self._retriever_query(query, query_vector, _field, doc_ids, fusion_args))
+                return self._server_results(response, _field, fusion_args)
+            except ApiError as e:
+                self._server_rrf_failed(e)
+                mode = "client_rrf"
+
+        async def knn_leg():
+            # fires as soon as the vector is ready, whatever the match leg is doing
+            query_vector = await self._embed_query_async(query)
+            return await self.async_es.search(index=index, body=self._knn_query(query_vector, _field, doc_ids, window))
 
-        rrf_results = self._rrf(result_sets_with_rankings, weights, _field, INSPECT=INSPECT)
+        try:
+            if mode == "msearch_rrf":
+                query_vector = await self._embed_query_async(query)
+                responses = self._msearch_responses(await self.async_es.msearch(
+                    searches=self._msearch_body(index, query, query_vector, _field, doc_ids, window)
+                ))
+                if responses is None:
+                    return None
+            else:
+                match_response, knn_response = await asyncio.gather(
+                    self.async_es.search(index=index, body=self._match_query(query, _field, doc_ids, window)),
+                    knn_leg(),
+                )
+                responses = {"match": match_response, "knn": knn_response}
+        except BadRequestError as e:
+            logger.info(e)
+            return None
 
-        logger.info(f"Hybrid search returned {len(rrf_results)} elements.")
+        return self._fuse(responses, _field, fusion_args, INSPECT=INSPECT)
 
-        return rrf_results
+    async def aclose(self):
+        if self._async_es is not None:
+            await self._async_es.close()
+            self._async_es = None
 
 
 if __name__ == "__main__":    
@@ -0,0 +1,148 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from log import setup_logger
+
+# logger
+logger = setup_logger("embed_cache")
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of query embeddings, keyed on (model, normalized query).
+
+    The local tier is a per-process OrderedDict. If a redis url is given, misses fall
+    through to a shared redis tier (float32 bytes) before the model is run, so api
+    workers warm each other. Redis errors are logged and treated as misses.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, redis_url=None, namespace="qemb"):
+        self.maxsize = maxsize
+        self.ttl = ttl or None # seconds, None/0 means entries only leave by eviction
+        self.namespace = namespace
+
+        self._entries = OrderedDict() # key -> (expires_at, embedding)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+        self._redis = None
+        if redis_url:
+            if redis is None:
+                logger.warning("redis is not installed, query cache is local only.")
+            else:
+                self._redis = redis.Redis.from_url(redis_url)
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        # e5 is uncased, so case and whitespace differences embed identically
+        return " ".join(query.casefold().split())
+
+    def _key(self, query: str, model: str) -> str:
+        return f"{model}:{self.normalize(query)}"
+
+    def _shared_key(self, key: str) -> str:
+        return f"{self.namespace}:{hashlib.sha1(key.encode()).hexdigest()}"
+
+    def get(self, query: str, model: str):
+        key = self._key(query, model)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, embedding = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return embedding
+                del self._entries[key]
+
+        embedding = self._shared_get(key)
+        with self._lock:
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+
+        self._local_set(key, embedding)
+        return embedding
+
+    def set(self, query: str, model: str, embedding: list):
+        key = self._key(query, model)
+        self._local_set(key, embedding)
+        self._shared_set(key, embedding)
+
+    def get_or_compute(self, query: str, model: str, compute):
+        embedding = self.get(query, model)
+        if embedding is None:
+            embedding = compute(query)
+            self.set(query, model, embedding)
+        return embedding
+
+    def _local_set(self, key: str, embedding: list):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _shared_get(self, key: str):
+        if self._redis is None:
+            return None
+        try:
+            raw = self._redis.get(self._shared_key(key))
+        except redis.RedisError as e:
+            logger.warning(f"Shared query cache unavailable: {e}")
+            return None
+        if raw is None:
+            return None
+        return np.frombuffer(raw, dtype=np.float32).tolist()
+
+    def _shared_set(self, key: str, embedding: list):
+        if self._redis is None:
+            return
+        try:
+            self._redis.set(self._shared_key(key), np.asarray(embedding, dtype=np.float32).tobytes(), ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Shared query cache unavailable: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "shared": self._redis is not None,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
+
+if __name__ == "__main__":
+    cache = EmbeddingCache(maxsize=2, ttl=1)
+
+    cache.set("What is Bridge?", "e5", [0.1, 0.2])
+    print(cache.get("  what is   bridge? ", "e5")) # hit
+    cache.set("a", "e5", [0.3])
+    cache.set("b", "e5", [0.4]) # evicts "what is bridge?"
+    print(cache.get("What is Bridge?", "e5")) # miss
+    time.sleep(1.1)
+    print(cache.get("b", "e5")) # expired
+    print(cache.stats())
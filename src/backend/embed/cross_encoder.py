@@ -0,0 +1,71 @@
+import torch
+
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+import os
+import threading
+
+import warnings
+
+# Suppress specific FutureWarning from huggingface_hub
+warnings.filterwarnings("ignore", category=FutureWarning, module="huggingface_hub.file_download")
+
+CROSS_ENCODER_MAX_LEN = 512
+CROSS_ENCODER_MODEL = os.getenv('CROSS_ENCODER_MODEL', "cross-encoder/ms-marco-MiniLM-L-6-v2")
+CROSS_ENCODER_BATCH_SIZE = int(os.getenv('CROSS_ENCODER_BATCH_SIZE', 32))
+
+cache_dir = os.getenv('HF_HOME', './cache')
+
+# loaded on first use: only api processes that rerank should pay for a second model
+_tokenizer = None
+_model = None
+_lock = threading.Lock()
+
+def load_model():
+    global _tokenizer, _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                _tokenizer = AutoTokenizer.from_pretrained(CROSS_ENCODER_MODEL, cache_dir=cache_dir)
+                model = AutoModelForSequenceClassification.from_pretrained(CROSS_ENCODER_MODEL, cache_dir=cache_dir)
+                model.eval()
+                _model = model
+    return _tokenizer, _model
+
+def score_pairs(query, passages, max_len=CROSS_ENCODER_MAX_LEN, batch_size=CROSS_ENCODER_BATCH_SIZE):
+    """Relevance logits for (query, passage) pairs, in input order."""
+    if not passages:
+        return []
+
+    tokenizer, model = load_model()
+
+    # sort by length so each batch is padded to its own longest pair
+    order = sorted(range(len(passages)), key=lambda i: len(passages[i]))
+
+    scores = [0.0] * len(passages)
+    with torch.inference_mode():
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            batch_dict = tokenizer(
+                [query] * len(bucket),
+                [passages[i] for i in bucket],
+                max_length=max_len,
+                padding=True,
+                truncation='only_second',
+                return_tensors='pt'
+            )
+            logits = model(**batch_dict).logits[:, 0]
+            for row, i in enumerate(bucket):
+                scores[i] = float(logits[row])
+
+    return scores
+
+
+if __name__ == "__main__":
+    print(score_pairs(
+        "how much protein should a female eat",
+        [
+            "As a general guideline, the CDC's average requirement of protein for women ages 19 to 70 is 46 grams per day.",
+            "Definition of summit for English Language Learners: the highest point of a mountain.",
+        ]
+    ))
@@ -1,9 +1,14 @@
+import torch
 import torch.nn.functional as F
 
 from torch import Tensor
 from transformers import AutoTokenizer, AutoModel
 
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
 
 import warnings
 
@@ -13,6 +18,9 @@ warnings.filterwarnings("ignore", category=FutureWarning, module="huggingface_hu
 E5_SMALL_MAX_LEN = 512
 EMB_MODEL = "intfloat/e5-small-v2"
 
+E5_SMALL_BATCH_SIZE = int(os.getenv('E5_SMALL_BATCH_SIZE', 32)) # rows per forward pass
+E5_SMALL_BATCH_WAIT_MS = float(os.getenv('E5_SMALL_BATCH_WAIT_MS', 5)) # how long the micro-batcher waits for company
+
 cache_dir = os.getenv('HF_HOME', './cache')
 
 try:
@@ -29,14 +37,121 @@ def average_pool(last_hidden_states: Tensor,
 def embed_query(query, max_len=E5_SMALL_MAX_LEN, tokenizer=tokenizer, model=model):
     input_text = "query: " + query
     batch_dict = tokenizer(input_text, max_length=max_len, padding=True, truncation=True, return_tensors='pt')
-    outputs = model(**batch_dict)
-    return average_pool(outputs.last_hidden_state, batch_dict['attention_mask'])
+    with torch.inference_mode():
+        outputs = model(**batch_dict)
+        return average_pool(outputs.last_hidden_state, batch_dict['attention_mask'])
 
 def embed_passage(passage, max_len=E5_SMALL_MAX_LEN, tokenizer=tokenizer, model=model):
     input_text = "passage: " + passage
     batch_dict = tokenizer(input_text, max_length=max_len, padding=True, truncation=True, return_tensors='pt')
-    outputs = model(**batch_dict)
-    return average_pool(outputs.last_hidden_state, batch_dict['attention_mask'])
+    with torch.inference_mode():
+        outputs = model(**batch_dict)
+        return average_pool(outputs.last_hidden_state, batch_dict['attention_mask'])
+
+def _embed_batched(input_texts, max_len, batch_size, tokenizer, model):
+    # tokenize once without padding so every row can be bucketed by its real length
+    encoded = tokenizer(input_texts, max_length=max_len, truncation=True)
+    input_ids = encoded['input_ids']
+
+    # sort by length so each batch is padded to its own longest row, not the global one
+    order = sorted(range(len(input_ids)), key=lambda i: len(input_ids[i]))
+
+    embeddings = [None] * len(input_ids)
+    with torch.inference_mode():
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            batch_dict = tokenizer.pad(
+                {k: [encoded[k][i] for i in bucket] for k in encoded.keys()},
+                padding=True,
+                return_tensors='pt'
+            )
+            outputs = model(**batch_dict)
+            pooled = average_pool(outputs.last_hidden_state, batch_dict['attention_mask'])
+            for row, i in enumerate(bucket):
+                embeddings[i] = pooled[row]
+
+    return embeddings
+
+def embed_queries(queries, max_len=E5_SMALL_MAX_LEN, batch_size=E5_SMALL_BATCH_SIZE, tokenizer=tokenizer, model=model):
+    """Embed a list of queries. Returns one 1-D tensor per query, in input order."""
+    if not queries:
+        return []
+    return _embed_batched(["query: " + q for q in queries], max_len, batch_size, tokenizer, model)
+
+def embed_passages(passages, max_len=E5_SMALL_MAX_LEN, batch_size=E5_SMALL_BATCH_SIZE, tokenizer=tokenizer, model=model):
+    """Embed a list of passages. Returns one 1-D tensor per passage, in input order."""
+    if not passages:
+        return []
+    return _embed_batched(["passage: " + p for p in passages], max_len, batch_size, tokenizer, model)
+
+class MicroBatcher:
+    """
+    Collects single-text embedding requests from concurrent callers (api requests)
+    and runs them as one forward pass.
+
+    The first request in an empty queue waits at most `max_wait_ms` for others to
+    join before the batch is flushed, so a lone caller only pays a few ms.
+    """
+
+    def __init__(self, embed_fn, max_batch_size=E5_SMALL_BATCH_SIZE, max_wait_ms=E5_SMALL_BATCH_WAIT_MS):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, text) -> Future:
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text):
+        return self.submit(text).result()
+
+    def _ensure_started(self):
+        # started lazily so importing this module does not spawn threads (celery forks after import)
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="e5-micro-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _ in batch]
+
+            try:
+                embeddings = self.embed_fn(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+# bulk ingestion already embeds in batches (embed_passages), only queries arrive one at a time
+query_batcher = MicroBatcher(embed_queries)
 
 
 if __name__ == "__main__":
@@ -55,4 +170,9 @@ if __name__ == "__main__":
     embeddings = [F.normalize(embedding, p=2, dim=1) for embedding in embeddings]
 
     scores = embeddings[0] * embeddings[-1]
-    print(scores.tolist())
\ No newline at end of file
+    print(scores.tolist())
+
+    # batched path should agree with the single-row path
+    batched = embed_passages([x.split(": ")[1] for x in input_texts[2:]])
+    single = embed_passage(input_texts[2].split(": ")[1])[0]
+    print(torch.allclose(batched[0], single, atol=1e-5))
\ No newline at end of file
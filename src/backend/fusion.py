@@ -0,0 +1,144 @@
+import heapq
+
+import numpy as np
+
+# Result fusion for hybrid search.
+#
+# Every function takes `result_lists`: a dict of leg name -> ranked list of ES hits
+# (best first), and returns the fused top_k as a list of (id, score, hit), best first.
+# `hit` is the first hit seen for that id, so callers can pull whatever _source they need.
+#
+# See notes/architectural decisions/search/rrf.md for the rrf formula.
+
+RANK_CONSTANT = 60
+RANK_WINDOW_SIZE = 50
+TOP_K = 10
+
+FUSION_METHODS = ("rrf", "convex")
+NORMALIZATIONS = ("minmax", "zscore")
+
+# below this many candidates heapq beats the numpy round trip
+_ARGPARTITION_MIN = 256
+
+def normalize_scores(scores: np.ndarray, method: str = "minmax") -> np.ndarray:
+    scores = np.asarray(scores, dtype=np.float64)
+    if scores.size == 0:
+        return scores
+
+    if method == "minmax":
+        lo, hi = scores.min(), scores.max()
+        return (scores - lo) / (hi - lo) if hi > lo else np.zeros_like(scores)
+
+    if method == "zscore":
+        std = scores.std()
+        return (scores - scores.mean()) / std if std > 0 else np.zeros_like(scores)
+
+    raise ValueError(f"Unknown normalization ({method}), expected one of {NORMALIZATIONS}.")
+
+def _weights(result_lists: dict, weights: dict = None) -> dict:
+    weights = weights or {}
+    return {name: float(weights.get(name, 1.0)) for name in result_lists}
+
+def _collect(result_lists: dict, rank_window_size: int):
+    # one pass over every leg: dense ids for numpy, plus (leg, position, rank) triples
+    ids = {}
+    hits = []
+    legs, positions, ranks = [], [], []
+
+    for leg, (name, results) in enumerate(result_lists.items()):
+        for rank, hit in enumerate(results[:rank_window_size], 1):
+            _id = hit["_id"]
+            position = ids.get(_id)
+            if position is None:
+                position = ids[_id] = len(hits)
+                hits.append(hit)
+            legs.append(leg)
+            positions.append(position)
+            ranks.append(rank)
+
+    return list(ids), hits, np.array(legs, dtype=np.intp), np.array(positions, dtype=np.intp), np.array(ranks, dtype=np.float64)
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first, without sorting the whole pool."""
+    n = scores.size
+    if k is None or k >= n:
+        return np.argsort(-scores, kind="stable")
+
+    if n < _ARGPARTITION_MIN:
+        return np.array(heapq.nlargest(k, range(n), key=scores.__getitem__), dtype=np.intp)
+
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+def rrf(result_lists: dict, weights: dict = None, k: int = RANK_CONSTANT, rank_window_size: int = RANK_WINDOW_SIZE, top_k: int = TOP_K):
+    ids, hits, legs, positions, ranks = _collect(result_lists, rank_window_size)
+    if not ids:
+        return []
+
+    leg_weights = np.array(list(_weights(result_lists, weights).values()), dtype=np.float64)
+
+    scores = np.zeros(len(ids), dtype=np.float64)
+    np.add.at(scores, positions, leg_weights[legs] / (k + ranks))
+
+    return [(ids[i], float(scores[i]), hits[i]) for i in top_k_indices(scores, top_k)]
+
+def convex(result_lists: dict, weights: dict = None, normalization: str = "minmax", rank_window_size: int = RANK_WINDOW_SIZE, top_k: int = TOP_K):
+    """
+    Convex combination of per-leg normalized ES scores. Weights are rescaled to sum to 1;
+    a document missing from a leg contributes nothing for that leg.
+    """
+    ids, hits, legs, positions, _ = _collect(result_lists, rank_window_size)
+    if not ids:
+        return []
+
+    leg_weights = np.array(list(_weights(result_lists, weights).values()), dtype=np.float64)
+    total = leg_weights.sum()
+    leg_weights = leg_weights / total if total > 0 else np.full_like(leg_weights, 1 / len(leg_weights))
+
+    raw = np.array([
+        hit["_score"] or 0.0
+        for results in result_lists.values()
+        for hit in results[:rank_window_size]
+    ], dtype=np.float64)
+
+    normalized = np.empty_like(raw)
+    for leg in range(len(result_lists)):
+        mask = legs == leg
+        normalized[mask] = normalize_scores(raw[mask], normalization)
+
+    scores = np.zeros(len(ids), dtype=np.float64)
+    np.add.at(scores, positions, leg_weights[legs] * normalized)
+
+    return [(ids[i], float(scores[i]), hits[i]) for i in top_k_indices(scores, top_k)]
+
+def fuse(
+        result_lists: dict,
+        method: str = "rrf",
+        weights: dict = None,
+        rank_constant: int = RANK_CONSTANT,
+        rank_window_size: int = RANK_WINDOW_SIZE,
+        top_k: int = TOP_K,
+        normalization: str = "minmax",
+        ):
+    if method == "rrf":
+        return rrf(result_lists, weights, k=rank_constant, rank_window_size=rank_window_size, top_k=top_k)
+    if method == "convex":
+        return convex(result_lists, weights, normalization=normalization, rank_window_size=rank_window_size, top_k=top_k)
+    raise ValueError(f"Unknown fusion method ({method}), expected one of {FUSION_METHODS}.")
+
+if __name__ == "__main__":
+    import time
+
+    def leg(n, offset):
+        return [{"_id": str(i + offset), "_score": float(n - i), "_source": {}} for i in range(n)]
+
+    legs = {"match": leg(5, 0), "knn": leg(5, 2)}
+    for _id, score, _ in rrf(legs, top_k=5):
+        print(_id, round(score, 6))
+
+    print(convex(legs, weights={"match": 0.3, "knn": 0.7}, top_k=3))
+
+    big = {"match": leg(10_000, 0), "knn": leg(10_000, 5_000)}
+    start = time.perf_counter()
+    rrf(big, rank_window_size=10_000, top_k=10)
+    print(f"rrf over 20k hits: {(time.perf_counter() - start) * 1000:.1f} ms")
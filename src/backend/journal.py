@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+
+import redis
+
+from config import config
+from log import setup_logger
+
+# logger
+logger = setup_logger("journal")
+
+JOURNAL_DIR = config.JOURNAL_DIR
+JOURNAL_TTL = config.JOURNAL_TTL
+JOURNAL_ACK_EVERY = config.JOURNAL_ACK_EVERY
+ES_BULK_CHUNK_SIZE = config.ES_BULK_CHUNK_SIZE
+
+# Ingestion journal, so a redelivered task resumes instead of starting over.
+#
+# Per document (and file hash) a redis hash keeps the status, the number of partitioned
+# texts and the acked offset: every chunk before it is known to be in ES. The partition
+# output itself is written to JOURNAL_DIR (jsonl) before anything is chunked or embedded,
+# and replayed on retry so ocr is not run twice. Chunk ids are deterministic, so re-sending
+# chunks after the acked offset is idempotent.
+
+_redis = None
+_redis_lock = threading.Lock()
+_swept_at = 0.0
+
+def _client():
+    global _redis
+    if _redis is None:
+        with _redis_lock:
+            if _redis is None:
+                _redis = redis.Redis.from_url(config.TASK_REGISTRY_URL, decode_responses=True)
+    return _redis
+
+def expire_files(journal_dir: str = JOURNAL_DIR, ttl: int = JOURNAL_TTL):
+    # the redis state expires by itself, partition output of documents that never finished
+    # (the task failed for good, or the file was not uploaded again) has to be swept
+    cutoff = time.time() - ttl
+    try:
+        entries = list(os.scandir(journal_dir))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass # another worker got it first
+
+def _sweep(journal_dir: str):
+    # at most once an hour per process
+    global _swept_at
+    now = time.monotonic()
+    if _swept_at and now - _swept_at < 3600:
+        return
+    _swept_at = now
+    expire_files(journal_dir)
+
+class IngestJournal:
+    def __init__(self, doc_id: str, file_hash: str, journal_dir: str = JOURNAL_DIR):
+        self.doc_id = doc_id
+        self.file_hash = file_hash
+        self.key = f"journal:{doc_id}"
+        self.path = os.path.join(journal_dir, f"{doc_id}-{file_hash[:16]}.jsonl")
+        _sweep(journal_dir)
+
+        state = self._load()
+        if state.get("file_hash") != file_hash:
+            state = {} # other version of the file, nothing to resume
+        self.state = state
+
+    def _load(self) -> dict:
+        try:
+            return _client().hgetall(self.key)
+        except redis.RedisError as e:
+            logger.warning(f"Journal unavailable, ingesting {self.doc_id} from scratch: {e}")
+            return {}
+
+    def _save(self, **fields):
+        self.state.update({k: str(v) for k, v in fields.items()})
+        try:
+            with _client().pipeline(transaction=True) as pipe:
+                pipe.hset(self.key, mapping=fields)
+                pipe.expire(self.key, JOURNAL_TTL)
+                pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Could not checkpoint {self.doc_id}: {e}")
+
+    @property
+    def in_progress(self) -> bool:
+        return self.state.get("status") == "running"
+
+    @property
+    def acked(self) -> int:
+        return int(self.state.get("acked", 0))
+
+    def begin(self):
+        if self.in_progress:
+            logger.info(f"Resuming {self.doc_id} at chunk {self.acked}")
+        else:
+            self._save(file_hash=self.file_hash, status="running", started_at=time.time(), acked=0)
+            self.state.pop("partitioned", None)
+            self._remove_partition_output()
+
+    ## partition output
+
+    def replay(self):
+        """Texts of a finished partition pass, or None."""
+        if "partitioned" not in self.state or not os.path.exists(self.path):
+            return None
+        logger.info(f"Replaying {self.state['partitioned']} partitioned text(s) of {self.doc_id}")
+        return self._read()
+
+    def _read(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def record(self, texts):
+        """Write a whole partition pass to disk, then read it back."""
+        # the file only counts once the pass is complete, a worker dying while embedding or
+        # indexing later on replays it instead of partitioning again
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        part_path = f"{self.path}.part"
+        count = 0
+        with open(part_path, 'w', encoding='utf-8') as f:
+            for text in texts:
+                f.write(json.dumps(text) + "\n")
+                count += 1
+        os.replace(part_path, self.path)
+        self._save(partitioned=count)
+        return self._read()
+
+    def _remove_partition_output(self):
+        for path in (self.path, f"{self.path}.part"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    ## chunks
+
+    def skip_acked(self, chunks):
+        # chunks before the acked offset are already indexed
+        skip = self.acked
+        for i, chunk in enumerate(chunks):
+            if i >= skip:
+                yield chunk
+
+    def checkpoint(self):
+        """For insert_objects: called with n, the contiguous successes of this attempt."""
+        start = self.acked
+        def ack(n: int):
+            # retried items of a bulk request come back after the rest of it, so the
+            # offset lags by one request to only cover chunks that are surely stored
+            if n % JOURNAL_ACK_EVERY == 0 and n > ES_BULK_CHUNK_SIZE:
+                self._save(acked=start + n - ES_BULK_CHUNK_SIZE)
+        return ack
+
+    def complete(self):
+        self._save(status="done", finished_at=time.time())
+        self._remove_partition_output()
@@ -0,0 +1,30 @@
+import argparse
+
+from config import config
+from elasticutils import Search, VECTOR_PROFILES, index_mappings
+
+# Reindex existing indices into the vector profile from config (or --profile).
+# Stop the celery workers first: the source index is write blocked while it is copied.
+#
+#   python migrate_vectors.py text_chunk table_meta --profile int8_hnsw
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate indices to a new dense_vector storage profile.")
+    parser.add_argument("indices", nargs="*", default=list(index_mappings()), help="indices to migrate (default: all)")
+    parser.add_argument("--profile", default=config.VECTOR_PROFILE, choices=list(VECTOR_PROFILES))
+    parser.add_argument("--dry-run", action="store_true", help="print the target mappings and exit")
+    args = parser.parse_args()
+
+    mappings = index_mappings(args.profile)
+
+    if args.dry_run:
+        for index in args.indices:
+            print(f"{index}: e5 -> {mappings[index]['properties']['e5']}")
+        exit(0)
+
+    es = Search()
+    for index in args.indices:
+        target = es.migrate_index(index, profile=args.profile)
+        print(f"{index} -> {target}")
+
+    print(es)
@@ -0,0 +1,147 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PyPDF2 import PdfReader, PdfWriter
+from unstructured.partition.pdf import partition_pdf
+
+from config import config
+from log import setup_logger
+
+# logger
+logger = setup_logger("pdfpages")
+
+PDF_WINDOW_PAGES = config.PDF_WINDOW_PAGES
+PDF_WORKERS = config.PDF_WORKERS
+PDF_MIN_TEXT_CHARS = config.PDF_MIN_TEXT_CHARS
+
+# Page-parallel pdf partitioning.
+#
+# A pdf is split into windows of PDF_WINDOW_PAGES pages, and each window is partitioned
+# in a spawned worker process (pikepdf, used by unstructured, is not fork safe). Inside a
+# window, pages that already have a text layer go through the "fast" strategy (pdfminer),
+# only pages without one pay for "hi_res" (layout model + ocr). Elements come back in
+# page order.
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=PDF_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def _can_spawn() -> bool:
+    # prefork celery workers are daemonic, and daemonic processes may not have children
+    return PDF_WORKERS > 1 and not multiprocessing.current_process().daemon
+
+def page_windows(page_count: int, window_pages: int = PDF_WINDOW_PAGES):
+    window_pages = max(1, window_pages)
+    return [(start, min(start + window_pages, page_count)) for start in range(0, page_count, window_pages)]
+
+def page_strategy(page, min_text_chars: int = PDF_MIN_TEXT_CHARS) -> str:
+    try:
+        text = page.extract_text() or ""
+    except Exception: # broken content streams, let the layout model deal with them
+        return "hi_res"
+    return "fast" if len("".join(text.split())) >= min_text_chars else "hi_res"
+
+def _runs(reader: PdfReader, start: int, end: int, min_text_chars: int):
+    # consecutive pages sharing a strategy are partitioned together
+    runs = []
+    for i in range(start, end):
+        strategy = page_strategy(reader.pages[i], min_text_chars)
+        if runs and runs[-1][0] == strategy:
+            runs[-1][1].append(i)
+        else:
+            runs.append((strategy, [i]))
+    return runs
+
+def partition_window(filepath: str, start: int, end: int, chunking_strategy: str = "by_title", min_text_chars: int = PDF_MIN_TEXT_CHARS, **partition_args):
+    """Partition pages [start, end) of a pdf, elements in page order."""
+    reader = PdfReader(filepath)
+    page_count = len(reader.pages)
+
+    elements = []
+    for strategy, pages in _runs(reader, start, end, min_text_chars):
+        if len(pages) == page_count:
+            # the whole file in one pass, no need to copy pages out
+            elements.extend(partition_pdf(filepath, strategy=strategy, chunking_strategy=chunking_strategy, **partition_args) or [])
+            continue
+
+        writer = PdfWriter()
+        for i in pages:
+            writer.add_page(reader.pages[i])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            window_path = os.path.join(tmp_dir, f"pages_{pages[0]}_{pages[-1]}.pdf")
+            with open(window_path, "wb") as f:
+                writer.write(f)
+            elements.extend(partition_pdf(
+                window_path,
+                strategy=strategy,
+                chunking_strategy=chunking_strategy,
+                **partition_args,
+            ) or [])
+
+    return elements
+
+def partition_pdf_pages(filepath: str, chunking_strategy: str = "by_title", window_pages: int = PDF_WINDOW_PAGES, **partition_args):
+    """Drop-in partitioner for pipeline.FORMATS: pdf elements, in page order."""
+    page_count = len(PdfReader(filepath).pages)
+    windows = page_windows(page_count, window_pages)
+
+    logger.info(f"Partitioning {os.path.basename(filepath)}: {page_count} page(s) in {len(windows)} window(s).")
+
+    if len(windows) <= 1 or not _can_spawn():
+        return [
+            element
+            for start, end in windows
+            for element in partition_window(filepath, start, end, chunking_strategy, **partition_args)
+        ]
+
+    pool = _get_pool()
+    futures = [
+        pool.submit(partition_window, filepath, start, end, chunking_strategy, **partition_args)
+        for start, end in windows
+    ]
+
+    elements = []
+    try:
+        for future in futures: # submission order is page order
+            elements.extend(future.result())
+    except BrokenProcessPool:
+        # a worker died (oom on a large scan), the next document gets a fresh pool
+        _reset_pool()
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+
+    return elements
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    start = time.perf_counter()
+    elements = partition_pdf_pages(sys.argv[1])
+    print(f"{len(elements)} element(s) in {time.perf_counter() - start:.1f} s")
+    for element in elements[:5]:
+        print(element.text[:80])
@@ -0,0 +1,261 @@
+import hashlib
+import os
+import re
+import unicodedata
+from uuid import uuid5, NAMESPACE_URL
+
+from unstructured.partition.text import partition_text
+from unstructured.partition.rtf import partition_rtf
+from unstructured.partition.doc import partition_doc
+from unstructured.partition.docx import partition_docx
+from unstructured.partition.epub import partition_epub
+# from unstructured.partition.latex import partition_latex # there is no partition_latex
+from unstructured.partition.md import partition_md
+from unstructured.partition.ppt import partition_ppt
+from unstructured.partition.pptx import partition_pptx
+
+from config import config
+from log import setup_logger
+from embed.e5_small import embed_passages
+from journal import IngestJournal
+from progress import counted
+from pdfpages import partition_pdf_pages # pikepdf is not fork safe, windows are partitioned in spawned processes
+
+# logger
+logger = setup_logger("pipeline")
+
+EMBED_BATCH_SIZE = config.EMBED_BATCH_SIZE
+
+# document ingestion runs as a chain of generators:
+#   partition -> normalize -> chunk -> dedupe -> reuse embeddings -> embed -> index
+# every stage pulls from the previous one, so a document is never held as more than
+# one embedding batch + one bulk request past the partitioner.
+# progress is journaled (journal.py) so a redelivered task resumes where the last one died.
+
+## normalize
+
+def _control_ranges(last=0xFFFF):
+    # codepoint ranges of unicode category C* (Cc, Cf, Cs, Co, Cn) in the BMP, computed once at import
+    ranges = []
+    start = None
+    for cp in range(last + 1):
+        if unicodedata.category(chr(cp))[0] == "C":
+            if start is None:
+                start = cp
+        elif start is not None:
+            ranges.append((start, cp - 1))
+            start = None
+    if start is not None:
+        ranges.append((start, last))
+    return ranges
+
+def _char_class(ranges):
+    return "".join(
+        re.escape(chr(lo)) if lo == hi else f"{re.escape(chr(lo))}-{re.escape(chr(hi))}"
+        for lo, hi in ranges
+    )
+
+# sre compiles a BMP-only class to a lookup table, so the common case is O(1) per char.
+# an astral class would need hundreds of ranges scanned per char, so astral characters
+# (emoji etc.) are matched as a block and checked one by one instead
+_BMP_CONTROL_RE = re.compile("[" + _char_class(_control_ranges()) + "]+")
+_ASTRAL_RE = re.compile("[\U00010000-\U0010FFFF]")
+
+_SENTENCE_SPACING_RE = re.compile(r'(?<=[.?!])(?=[^\s])')
+
+def _drop_astral_control(match) -> str:
+    char = match.group()
+    return "" if unicodedata.category(char)[0] == "C" else char
+
+def remove_control_chars(text: str) -> str:
+    text = _BMP_CONTROL_RE.sub("", text)
+    if _ASTRAL_RE.search(text):
+        text = _ASTRAL_RE.sub(_drop_astral_control, text)
+    return text
+
+def space_sentences(text: str) -> str:
+    return _SENTENCE_SPACING_RE.sub(" ", text) # this will add a space character after every ". ? !"
+
+DEFAULT_NORMALIZERS = (remove_control_chars, space_sentences)
+
+## formats
+
+class DocumentFormat:
+    def __init__(self, name, partitioner, chunking_strategy="by_title", normalizers=DEFAULT_NORMALIZERS, **partition_args):
+        self.name = name
+        self.partitioner = partitioner
+        self.chunking_strategy = chunking_strategy
+        self.normalizers = normalizers
+        self.partition_args = partition_args
+
+    def __repr__(self):
+        return f"DocumentFormat({self.name}, {self.chunking_strategy})"
+
+FORMATS = {}
+
+def register_format(c_type: str, partitioner, chunking_strategy="by_title", normalizers=DEFAULT_NORMALIZERS, **partition_args):
+    FORMATS[c_type] = DocumentFormat(c_type.upper(), partitioner, chunking_strategy, normalizers, **partition_args)
+    return FORMATS[c_type]
+
+register_format("txt", partition_text, chunking_strategy="basic")
+register_format("rtf", partition_rtf)
+register_format("doc", partition_doc)
+register_format("docx", partition_docx)
+register_format("pdf", partition_pdf_pages) # fast per page, hi_res only where there is no text layer
+register_format("epub", partition_epub)
+register_format("markdown", partition_md)
+register_format("ppt", partition_ppt)
+register_format("pptx", partition_pptx)
+
+## hashing
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def file_hash(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+## stages
+
+def partition(filepath: str, fmt: DocumentFormat):
+    # unstructured hands back a list, so parse errors surface here rather than mid-stream
+    elements = fmt.partitioner(filepath, chunking_strategy=fmt.chunking_strategy, **fmt.partition_args)
+    return (element.text for element in elements or [])
+
+def normalize(texts, normalizers=DEFAULT_NORMALIZERS):
+    for text in texts:
+        for normalizer in normalizers:
+            text = normalizer(text)
+        yield text
+
+def chunk_id(doc_id: str, file_hash: str, chunk_no: int) -> str:
+    # deterministic, so re-sending a chunk after a crash overwrites instead of duplicating
+    return f"{doc_id}-{file_hash[:16]}-{chunk_no}"
+
+def chunk(texts, doc_id: str, document_name: str, chunking_strategy: str, file_hash: str = None):
+    for i, text in enumerate(texts):
+        fields = {
+            "document_id": doc_id,  # document id from path
+            "access_group": "",  # not yet implemented
+            "document_name": document_name,
+            "chunk_text": text,
+            "chunking_strategy": chunking_strategy,
+            "chunk_no": i,
+            "file_hash": file_hash,
+            "chunk_hash": text_hash(text),
+        }
+        if file_hash:
+            fields["_id"] = chunk_id(doc_id, file_hash, i)
+        yield fields
+
+def dedupe(chunks, existing: dict):
+    """
+    existing maps chunk_hash -> ids already indexed for this document. Chunks whose text is
+    unchanged become partial updates (new position, new file hash) instead of being
+    embedded again. Whatever ids are left in `existing` afterwards are stale.
+    """
+    for fields in chunks:
+        ids = existing.get(fields["chunk_hash"])
+        if ids:
+            yield {
+                "_op_type": "update",
+                "_id": ids.pop(),
+                "chunk_no": fields["chunk_no"],
+                "file_hash": fields["file_hash"],
+            }
+        else:
+            yield fields
+
+def _batched(items, batch_size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _needs_embedding(fields) -> bool:
+    return "_op_type" not in fields and "e5" not in fields
+
+def reuse_embeddings(chunks, lookup, batch_size: int = EMBED_BATCH_SIZE):
+    """Attach embeddings already stored for identical chunk text (in any document)."""
+    for batch in _batched(chunks, batch_size):
+        wanted = {fields["chunk_hash"] for fields in batch if _needs_embedding(fields)}
+        found = lookup(list(wanted)) if wanted else {}
+        for fields in batch:
+            if _needs_embedding(fields) and fields["chunk_hash"] in found:
+                fields["e5"] = found[fields["chunk_hash"]]
+                fields["colbert"] = {}
+        yield from batch
+
+def embed(chunks, batch_size: int = EMBED_BATCH_SIZE):
+    for batch in _batched(chunks, batch_size):
+        yield from _embed_batch(batch)
+
+def _embed_batch(batch):
+    pending = [fields for fields in batch if _needs_embedding(fields)]
+
+    # repeated text inside a batch (headers, footers) is embedded once
+    texts = list(dict.fromkeys(fields["chunk_text"] for fields in pending))
+    vectors = dict(zip(texts, embed_passages(texts)))
+
+    for fields in pending:
+        fields["e5"] = vectors[fields["chunk_text"]].tolist()
+        fields["colbert"] = {}
+    return batch
+
+def ingest_document(filepath: str, fmt: DocumentFormat, es, index="text_chunk", progress=None):
+    doc_id = str(uuid5(NAMESPACE_URL, filepath))
+    document_name = os.path.basename(filepath)
+    digest = file_hash(filepath)
+    journal = IngestJournal(doc_id, digest)
+
+    # same name, same bytes: nothing to do, unless an earlier attempt died halfway
+    if not journal.in_progress and es.document_file_hashes(doc_id, index) == {digest}:
+        logger.info(f"{document_name} is unchanged, skipping.")
+        return 0
+
+    journal.begin()
+    existing = es.chunk_ids_by_hash(doc_id, index)
+
+    texts = journal.replay()
+    if texts is None:
+        try:
+            texts = journal.record(partition(filepath, fmt))
+        except Exception as e:
+            logger.error(f"Failed to parse {fmt.name} elements: {e}")
+            return 0
+
+    chunks = chunk(
+        normalize(counted(texts, progress, "partitioned"), fmt.normalizers),
+        doc_id=doc_id,
+        document_name=document_name,
+        chunking_strategy=fmt.chunking_strategy,
+        file_hash=digest,
+    )
+    chunks = dedupe(chunks, existing) # before skipping, so acked chunks still claim their ids
+    chunks = journal.skip_acked(chunks)
+    chunks = reuse_embeddings(chunks, lambda hashes: es.embeddings_by_hash(hashes, index))
+
+    chunks = counted(embed(chunks), progress, "embedded") # includes reused and unchanged chunks
+    indexed, errors = es.insert_objects(chunks, index=index, progress=progress, checkpoint=journal.checkpoint())
+
+    stale = [_id for ids in existing.values() for _id in ids]
+    if stale and errors:
+        logger.warning(f"Keeping {len(stale)} stale chunk(s) of {document_name}, {len(errors)} chunk(s) failed to index.")
+    elif stale:
+        es.delete_objects(stale, index)
+        logger.info(f"Removed {len(stale)} stale chunk(s) of {document_name}.")
+
+    if not errors: # otherwise the next attempt resumes from the last checkpoint
+        journal.complete()
+
+    return indexed
@@ -0,0 +1,143 @@
+import json
+import threading
+import time
+
+import redis
+import redis.asyncio as aioredis
+
+from config import config
+from log import setup_logger
+
+# logger
+logger = setup_logger("progress")
+
+PROGRESS_REDIS_URL = config.PROGRESS_REDIS_URL
+PROGRESS_INTERVAL = config.PROGRESS_INTERVAL
+PROGRESS_TTL = config.PROGRESS_TTL
+PROGRESS_KEEPALIVE = config.PROGRESS_KEEPALIVE
+
+TERMINAL_STATES = ("SUCCESS", "FAILURE", "REVOKED")
+
+# Task progress over redis pub/sub.
+#
+# Workers publish {"task_id", "state", "counts", ...} events on progress:{task_id}, and
+# the latest one is also kept under progress:{task_id}:last so a subscriber that arrives
+# late starts from the current state. Count updates are throttled to PROGRESS_INTERVAL,
+# state changes always go out.
+
+def channel(task_id: str) -> str:
+    return f"progress:{task_id}"
+
+def last_key(task_id: str) -> str:
+    return f"progress:{task_id}:last"
+
+_redis = None
+_redis_lock = threading.Lock()
+
+def _client():
+    global _redis
+    if _redis is None:
+        with _redis_lock:
+            if _redis is None:
+                _redis = redis.Redis.from_url(PROGRESS_REDIS_URL)
+    return _redis
+
+class TaskProgress:
+    """Per task publisher, safe to share between the threads of a directory load."""
+
+    def __init__(self, task_id: str, interval: float = PROGRESS_INTERVAL):
+        self.task_id = task_id
+        self.interval = interval
+        self.state = "PENDING"
+        self.counts = {}
+
+        self._lock = threading.Lock()
+        self._published_at = 0.0
+
+    def set_state(self, state: str, **detail):
+        with self._lock:
+            self.state = state
+            event = self._event(detail)
+        self._publish(event)
+
+    def add(self, stage: str, n: int = 1):
+        # e.g. add("embedded", 64). published at most every `interval` seconds
+        with self._lock:
+            self.counts[stage] = self.counts.get(stage, 0) + n
+            now = time.monotonic()
+            if now - self._published_at < self.interval:
+                return
+            event = self._event({})
+        self._publish(event)
+
+    def update(self, **detail):
+        # free form snapshot, e.g. directory load counts
+        with self._lock:
+            event = self._event(detail)
+        self._publish(event)
+
+    def flush(self):
+        with self._lock:
+            event = self._event({})
+        self._publish(event)
+
+    def _event(self, detail: dict) -> dict:
+        self._published_at = time.monotonic()
+        return {"task_id": self.task_id, "state": self.state, "counts": dict(self.counts), **detail}
+
+    def _publish(self, event: dict):
+        payload = json.dumps(event, default=str)
+        try:
+            with _client().pipeline(transaction=False) as pipe:
+                pipe.set(last_key(self.task_id), payload, ex=PROGRESS_TTL)
+                pipe.publish(channel(self.task_id), payload)
+                pipe.execute()
+        except redis.RedisError as e:
+            # progress is best effort, never fail the ingestion over it
+            logger.warning(f"Could not publish progress for {self.task_id}: {e}")
+
+def counted(items, progress: TaskProgress, stage: str):
+    # pass-through generator that reports every item it yields
+    for item in items:
+        if progress is not None:
+            progress.add(stage)
+        yield item
+
+async def subscribe(task_id: str, keepalive: float = PROGRESS_KEEPALIVE, fallback_state=None):
+    """
+    Async iterator of events (dicts) for one task, None on keepalive ticks. Ends after a
+    terminal state. fallback_state() is asked for the state when nothing was published yet.
+    """
+    client = aioredis.Redis.from_url(PROGRESS_REDIS_URL, decode_responses=True)
+    pubsub = client.pubsub()
+    try:
+        # subscribe before reading the snapshot so nothing falls in between
+        await pubsub.subscribe(channel(task_id))
+
+        last = await client.get(last_key(task_id))
+        if last is not None:
+            event = json.loads(last)
+        elif fallback_state is not None:
+            event = {"task_id": task_id, "state": await fallback_state(), "counts": {}}
+        else:
+            event = None
+
+        if event is not None:
+            yield event
+            if event["state"] in TERMINAL_STATES:
+                return
+
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=keepalive)
+            if message is None:
+                yield None
+                continue
+
+            event = json.loads(message["data"])
+            yield event
+            if event["state"] in TERMINAL_STATES:
+                return
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+        await client.aclose()
@@ -0,0 +1,159 @@
+import json
+import math
+import threading
+import time
+
+import redis
+from kombu import Queue
+
+from config import config
+from log import setup_logger
+
+# logger
+logger = setup_logger("queues")
+
+CELERY_BROKER_URL = config.CELERY_BROKER_URL
+HEAVY_TYPES = set(config.HEAVY_TYPES)
+LIGHT_MAX_BYTES = config.LIGHT_MAX_BYTES
+PRIORITY_BASE_BYTES = config.PRIORITY_BASE_BYTES
+TASK_VISIBILITY_TIMEOUT = config.TASK_VISIBILITY_TIMEOUT
+
+# Ingestion queue topology.
+#
+#   light: small documents and structured files, should never wait behind ocr
+#   heavy: pdf/office formats that go through layout models, and anything over LIGHT_MAX_BYTES
+#   bulk:  directory/archive loads, which mostly wait on their subtasks
+#
+# Inside a queue smaller files run first (priority by size). Workers are started per
+# queue so each gets its own concurrency and prefetch, e.g.
+#   celery -A storage worker -Q light -c 8 --prefetch-multiplier 4
+#   celery -A storage worker -Q heavy -c 2 --prefetch-multiplier 1
+#   celery -A storage worker -Q bulk -c 2 --prefetch-multiplier 1
+# a worker started without -Q consumes all three.
+
+LIGHT, HEAVY, BULK = "light", "heavy", "bulk"
+QUEUES = (LIGHT, HEAVY, BULK)
+PRIORITY_LEVELS = 10
+
+# redis emulates priorities with one list per level, "<queue>:<level>" (level 0 is the bare queue name)
+REDIS_PRIORITY_SEP = ":"
+IS_REDIS = CELERY_BROKER_URL.startswith(("redis://", "rediss://"))
+
+def task_queues():
+    # x-max-priority is needed by rabbitmq and ignored by redis
+    return [Queue(name, routing_key=name, queue_arguments={"x-max-priority": PRIORITY_LEVELS - 1}) for name in QUEUES]
+
+def broker_transport_options():
+    if not IS_REDIS:
+        return {}
+    return {
+        "priority_steps": list(range(PRIORITY_LEVELS)),
+        "sep": REDIS_PRIORITY_SEP,
+        "queue_order_strategy": "priority",
+        "visibility_timeout": TASK_VISIBILITY_TIMEOUT, # unacked tasks are redelivered after this
+    }
+
+def size_rank(size: int = None) -> int:
+    # 0 for files under PRIORITY_BASE_BYTES, +1 per doubling, capped at 9. unknown sizes go in the middle
+    if size is None:
+        return PRIORITY_LEVELS // 2
+    if size < PRIORITY_BASE_BYTES:
+        return 0
+    return min(PRIORITY_LEVELS - 1, int(math.log2(size / PRIORITY_BASE_BYTES)) + 1)
+
+def broker_priority(rank: int) -> int:
+    # redis serves 0 first, rabbitmq serves the highest number first
+    return rank if IS_REDIS else PRIORITY_LEVELS - 1 - rank
+
+def route(c_type: str = None, size: int = None, collection: bool = False):
+    """(queue, broker priority) for a load."""
+    if collection:
+        queue = BULK
+    elif c_type in HEAVY_TYPES or (size is not None and size > LIGHT_MAX_BYTES):
+        queue = HEAVY
+    else:
+        queue = LIGHT
+    return queue, broker_priority(size_rank(size))
+
+## stats
+
+WAIT_SAMPLES = 200
+
+_redis = None
+_redis_lock = threading.Lock()
+
+def _client():
+    global _redis
+    if _redis is None:
+        with _redis_lock:
+            if _redis is None:
+                _redis = redis.Redis.from_url(config.TASK_REGISTRY_URL)
+    return _redis
+
+def _wait_key(queue: str) -> str:
+    return f"queue_wait:{queue}"
+
+def record_wait(queue: str, enqueued_at: float):
+    # called when a task starts, keeps the last WAIT_SAMPLES queue waits per queue
+    if queue not in QUEUES or not enqueued_at:
+        return
+    try:
+        with _client().pipeline(transaction=False) as pipe:
+            pipe.lpush(_wait_key(queue), round(time.time() - float(enqueued_at), 3))
+            pipe.ltrim(_wait_key(queue), 0, WAIT_SAMPLES - 1)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record queue wait for {queue}: {e}")
+
+def _percentile(samples: list, p: float):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+def _oldest_wait(client, queue: str):
+    # messages are lpush'ed and brpop'ed, so the oldest one of each level is at the tail
+    keys = [queue] + [f"{queue}{REDIS_PRIORITY_SEP}{level}" for level in range(1, PRIORITY_LEVELS)]
+    with client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.lindex(key, -1)
+        tails = pipe.execute()
+
+    oldest = None
+    for tail in tails:
+        if tail is None:
+            continue
+        enqueued_at = json.loads(tail).get("headers", {}).get("enqueued_at")
+        if enqueued_at and (oldest is None or enqueued_at < oldest):
+            oldest = enqueued_at
+    return round(time.time() - oldest, 3) if oldest else 0.0
+
+def queue_stats(app):
+    """Depth and wait times per queue. Blocking, run it off the event loop."""
+    stats = {}
+    with app.connection_for_read() as connection:
+        channel = connection.default_channel
+        for queue in QUEUES:
+            try:
+                depth = channel.queue_declare(queue=queue, passive=True).message_count
+            except Exception: # not declared yet: no worker or producer has used it
+                depth = 0
+            stats[queue] = {"depth": depth}
+
+    client = _client()
+    broker = redis.Redis.from_url(CELERY_BROKER_URL) if IS_REDIS else None
+    try:
+        for queue in QUEUES:
+            samples = [float(sample) for sample in client.lrange(_wait_key(queue), 0, -1)]
+            stats[queue].update({
+                "wait_p50_s": _percentile(samples, 0.50),
+                "wait_p95_s": _percentile(samples, 0.95),
+                "wait_samples": len(samples),
+            })
+            if broker is not None:
+                stats[queue]["oldest_wait_s"] = _oldest_wait(broker, queue)
+    finally:
+        if broker is not None:
+            broker.close()
+
+    return stats
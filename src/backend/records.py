@@ -0,0 +1,311 @@
+import json
+import os
+from uuid import uuid5, NAMESPACE_URL
+
+import yaml
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+from config import config
+from log import setup_logger
+from progress import counted
+
+# logger
+logger = setup_logger("records")
+
+RECORD_CHUNK_CHARS = config.RECORD_CHUNK_CHARS
+
+# Streaming ingestion for record-shaped files (json, ndjson, yaml, linear exports).
+#
+# Readers yield (key, record) pairs without loading the file: ijson parse events for json,
+# one line at a time for ndjson, yaml parse events for yaml. A record is an element of
+# a top level array, or of an array under a top level key (key is then that key); other top
+# level values are gathered into one record at the end. Records are flattened into
+# "path: value" lines, split into chunks and indexed through batched embedding + bulk.
+
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+
+## readers
+
+def _records_from_value(data):
+    # same shapes as _records_from_events, for values that are already parsed
+    if isinstance(data, list):
+        for item in data:
+            yield "", item
+        return
+
+    if not isinstance(data, dict):
+        yield "", data
+        return
+
+    meta = {}
+    for key, value in data.items():
+        if isinstance(value, list):
+            for item in value:
+                yield key, item
+        else:
+            meta[key] = value
+    if meta:
+        yield "", meta
+
+def _records_from_events(events):
+    stack = [] # open containers outside of the record being built
+    meta = {}
+    key = None
+
+    builder, depth, target = None, 0, None
+    for _, event, value in events:
+        if builder is not None:
+            builder.event(event, value)
+            depth += event in ("start_map", "start_array")
+            depth -= event in ("end_map", "end_array")
+            if depth == 0:
+                if target is meta:
+                    meta[key] = builder.value
+                else:
+                    yield target, builder.value
+                builder = None
+            continue
+
+        if event == "map_key":
+            key = value
+            continue
+        if event in ("end_map", "end_array"):
+            stack.pop()
+            continue
+
+        if stack == ["start_array"] or (not stack and event not in ("start_map", "start_array")):
+            target = "" # element of a top level array, or a lone top level scalar
+        elif stack == ["start_map", "start_array"]:
+            target = key # element of an array under a top level key
+        elif stack == ["start_map"] and event != "start_array":
+            target = meta # any other top level value
+        else:
+            stack.append(event) # the top level container, or an array of records under a key
+            continue
+
+        if event in ("start_map", "start_array"):
+            builder, depth = ijson.ObjectBuilder(), 1
+            builder.event(event, value)
+        elif target is meta:
+            meta[key] = value
+        else:
+            yield target, value
+
+    if meta:
+        yield "", meta
+
+def _is_ndjson(filepath: str) -> bool:
+    if filepath.lower().endswith(NDJSON_EXTENSIONS):
+        return True
+
+    # a first line that is a complete object on its own, followed by more lines
+    with open(filepath, 'r', encoding='utf-8') as f:
+        first = f.readline().strip()
+        rest = f.readline().strip()
+    if not first.startswith("{") or not rest:
+        return False
+    try:
+        json.loads(first)
+    except ValueError:
+        return False
+    return True
+
+def read_ndjson(filepath: str):
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield "", json.loads(line)
+            except ValueError as e:
+                logger.warning(f"Skipping line {line_no} of {os.path.basename(filepath)}: {e}")
+
+def read_json(filepath: str):
+    if _is_ndjson(filepath):
+        yield from read_ndjson(filepath)
+        return
+
+    if ijson is None:
+        logger.warning("ijson is not installed, loading the whole file.")
+        with open(filepath, 'r', encoding='utf-8') as f:
+            yield from _records_from_value(json.load(f))
+        return
+
+    with open(filepath, 'rb') as f:
+        yield from _records_from_events(ijson.parse(f, use_float=True))
+
+def _yaml_node(loader, anchors):
+    # compose one node from parse events, like yaml's Composer (which CSafeLoader does not expose)
+    event = loader.get_event()
+    if isinstance(event, yaml.AliasEvent):
+        if event.anchor not in anchors:
+            raise yaml.composer.ComposerError(None, None, f"found undefined alias {event.anchor}", event.start_mark)
+        return anchors[event.anchor]
+
+    if isinstance(event, yaml.ScalarEvent):
+        tag = event.tag if event.tag not in (None, "!") else loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        node = yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+    elif isinstance(event, yaml.SequenceStartEvent):
+        tag = event.tag if event.tag not in (None, "!") else loader.resolve(yaml.SequenceNode, None, event.implicit)
+        node = yaml.SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+    else:
+        tag = event.tag if event.tag not in (None, "!") else loader.resolve(yaml.MappingNode, None, event.implicit)
+        node = yaml.MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+
+    if isinstance(node, yaml.SequenceNode):
+        while not loader.check_event(yaml.SequenceEndEvent):
+            node.value.append(_yaml_node(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+    elif isinstance(node, yaml.MappingNode):
+        while not loader.check_event(yaml.MappingEndEvent):
+            node.value.append((_yaml_node(loader, anchors), _yaml_node(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+    return node
+
+def _records_from_yaml(loader):
+    # same shapes as _records_from_value, for one document. the elements of a top level
+    # sequence (or of sequences under top level keys) are composed one at a time, unless
+    # the sequence has an anchor: an alias may need all of it later on
+    anchors = {}
+    def value():
+        return loader.construct_document(_yaml_node(loader, anchors))
+    def streamed_sequence():
+        return loader.check_event(yaml.SequenceStartEvent) and loader.peek_event().anchor is None
+
+    if streamed_sequence():
+        loader.get_event()
+        while not loader.check_event(yaml.SequenceEndEvent):
+            yield "", value()
+        loader.get_event()
+        return
+
+    if not loader.check_event(yaml.MappingStartEvent):
+        document = value()
+        if document is not None: # empty document
+            yield "", document
+        return
+
+    loader.get_event()
+    meta = {}
+    while not loader.check_event(yaml.MappingEndEvent):
+        key = value()
+        if streamed_sequence():
+            loader.get_event()
+            while not loader.check_event(yaml.SequenceEndEvent):
+                yield key, value()
+            loader.get_event()
+            continue
+
+        item = value()
+        if isinstance(item, list): # an anchored sequence, or an alias of one
+            for record in item:
+                yield key, record
+        else:
+            meta[key] = item
+    loader.get_event()
+    if meta:
+        yield "", meta
+
+def read_yaml(filepath: str):
+    loader_class = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(filepath, 'r', encoding='utf-8') as f:
+        loader = loader_class(f)
+        try:
+            loader.get_event() # stream start
+            while loader.check_event(yaml.DocumentStartEvent): # multi document streams
+                loader.get_event()
+                yield from _records_from_yaml(loader)
+                loader.get_event() # document end
+        finally:
+            loader.dispose()
+
+def read_linear(filepath: str):
+    if ijson is None:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            yield from (("issues", issue) for issue in json.load(f)["issues"])
+        return
+
+    with open(filepath, 'rb') as f:
+        yield from (("issues", issue) for issue in ijson.items(f, "issues.item", use_float=True))
+
+## chunks
+
+def flatten(value, path: str = ""):
+    """Yields "path: value" lines, lists of scalars are joined on one line."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{path}.{key}" if path else str(key))
+    elif isinstance(value, list):
+        if all(not isinstance(item, (dict, list)) for item in value):
+            if value:
+                yield f"{path}: {', '.join(str(item) for item in value)}"
+        else:
+            for i, item in enumerate(value):
+                yield from flatten(item, f"{path}[{i}]")
+    elif value is not None and value != "":
+        yield f"{path}: {value}" if path else str(value)
+
+def split_lines(lines, max_chars: int = RECORD_CHUNK_CHARS):
+    # whole lines only, a single line longer than max_chars is its own chunk
+    chunk, size = [], 0
+    for line in lines:
+        if chunk and size + len(line) > max_chars:
+            yield "\n".join(chunk)
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line) + 1
+    if chunk:
+        yield "\n".join(chunk)
+
+def linear_text(issue: dict) -> str:
+    return f"Title: {issue['title']}\nStatus: {issue['status']}\nCreated At: {issue['createdAt']}"
+
+def record_chunks(records, doc_id: str, document_name: str, to_text=None, chunking_strategy: str = "by_record"):
+    chunk_no = 0
+    for key, record in records:
+        if to_text:
+            texts = [to_text(record)]
+        else:
+            texts = split_lines(flatten(record, key))
+
+        for text in texts:
+            yield {
+                "_id": f"{doc_id}-{chunk_no}", # stable, re-ingesting overwrites
+                "document_id": doc_id,
+                "access_group": "", # not yet implemented
+                "document_name": document_name,
+                "chunk_text": text,
+                "chunking_strategy": chunking_strategy,
+                "chunk_no": chunk_no,
+            }
+            chunk_no += 1
+
+RECORD_READERS = {
+    "json": (read_json, None, "by_record"),
+    "yaml": (read_yaml, None, "by_record"),
+    "linear": (read_linear, linear_text, "by issue"),
+}
+
+def ingest_records(filepath: str, c_type: str, es, index="text_chunk", progress=None):
+    reader, to_text, chunking_strategy = RECORD_READERS[c_type]
+
+    doc_id = str(uuid5(NAMESPACE_URL, filepath))
+    chunks = record_chunks(reader(filepath), doc_id, os.path.basename(filepath), to_text, chunking_strategy)
+
+    indexed, _ = es.insert_objects(counted(chunks, progress, "chunked"), index=index, progress=progress)
+    return indexed
+
+if __name__ == "__main__":
+    import sys
+
+    c_type = sys.argv[2] if len(sys.argv) > 2 else "json"
+    reader, to_text, chunking_strategy = RECORD_READERS[c_type]
+    for chunk in record_chunks(reader(sys.argv[1]), "doc", os.path.basename(sys.argv[1]), to_text, chunking_strategy):
+        print(chunk["chunk_no"], repr(chunk["chunk_text"][:100]))
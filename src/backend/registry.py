@@ -0,0 +1,125 @@
+import json
+import os
+import time
+
+import redis.asyncio as redis
+
+from config import config
+from log import setup_logger
+
+# logger
+logger = setup_logger("registry")
+
+TASK_REGISTRY_URL = config.TASK_REGISTRY_URL
+
+# celery's redis result backend stores each result under this prefix
+CELERY_META_PREFIX = "celery-task-meta-"
+TERMINAL_STATES = ("SUCCESS", "FAILURE", "REVOKED")
+
+class TaskRegistry:
+    """
+    Submitted load tasks, kept in the redis that backs celery.
+
+    Each task is a hash ({namespace}:{task_id}) indexed by submit time in a sorted set
+    ({namespace}:index), both written in one MULTI so concurrent api workers never lose
+    an entry. States come from celery's result keys with one MGET per page; terminal
+    states are copied onto the task hash so finished tasks are not looked up again.
+    """
+
+    def __init__(self, url: str = TASK_REGISTRY_URL, namespace: str = "tasks"):
+        self.namespace = namespace
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+    def _key(self, task_id: str) -> str:
+        return f"{self.namespace}:{task_id}"
+
+    @property
+    def _index(self) -> str:
+        return f"{self.namespace}:index"
+
+    async def add(self, task_id: str, filename: str, submitted_at: float = None, **fields):
+        submitted_at = submitted_at or time.time()
+        entry = {"task_id": task_id, "filename": filename, "submitted_at": submitted_at, **fields}
+
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(task_id), mapping={k: v for k, v in entry.items() if v is not None})
+            pipe.zadd(self._index, {task_id: submitted_at})
+            await pipe.execute()
+
+    async def count(self) -> int:
+        return await self._redis.zcard(self._index)
+
+    async def page(self, offset: int = 0, limit: int = 50):
+        """Newest first."""
+        task_ids = await self._redis.zrevrange(self._index, offset, offset + limit - 1)
+        if not task_ids:
+            return []
+
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for task_id in task_ids:
+                pipe.hgetall(self._key(task_id))
+            entries = await pipe.execute()
+
+        # one round trip for every task that may still change state
+        pending = [entry for entry in entries if entry.get("status") not in TERMINAL_STATES]
+        if pending:
+            metas = await self._redis.mget([CELERY_META_PREFIX + entry["task_id"] for entry in pending])
+            finished = {}
+            for entry, meta in zip(pending, metas):
+                self._apply_meta(entry, meta)
+                if entry["status"] in TERMINAL_STATES:
+                    finished[entry["task_id"]] = entry
+
+            if finished:
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    for task_id, entry in finished.items():
+                        pipe.hset(self._key(task_id), mapping={k: entry[k] for k in ("status", "type") if k in entry})
+                    await pipe.execute()
+
+        return [self._view(entry) for entry in entries]
+
+    @staticmethod
+    def _apply_meta(entry: dict, meta: str):
+        if meta is None:
+            entry["status"] = "PENDING" # celery has no record until the task starts
+            return
+
+        meta = json.loads(meta)
+        entry["status"] = meta.get("status", "PENDING")
+
+        result = meta.get("result")
+        if entry["status"] == "SUCCESS":
+            entry["type"] = result["c_type"] if isinstance(result, dict) else result # directory loads return a summary
+
+    @staticmethod
+    def _view(entry: dict):
+        view = {"task_id": entry["task_id"], "status": entry.get("status", "PENDING"), "filename": entry.get("filename")}
+        if entry.get("type"):
+            view["type"] = entry["type"]
+        return view
+
+    async def import_json(self, path: str):
+        # one-off move of the old task_ids.json list into the registry
+        if not os.path.exists(path):
+            return 0
+
+        with open(path, 'r') as f:
+            try:
+                tasks = json.load(f)
+            except json.JSONDecodeError:
+                tasks = []
+
+        # keep the file order: older entries get older timestamps
+        start = time.time() - len(tasks)
+        for i, task in enumerate(tasks):
+            await self.add(task["task_id"], task.get("filename"), submitted_at=start + i, sha256=task.get("sha256"))
+
+        try:
+            os.replace(path, f"{path}.imported")
+        except FileNotFoundError: # another api worker imported it at the same time, adds are idempotent
+            pass
+        logger.info(f"Imported {len(tasks)} task(s) from {path}")
+        return len(tasks)
+
+    async def aclose(self):
+        await self._redis.aclose()
@@ -0,0 +1,128 @@
+import math
+import threading
+import time
+from collections import deque
+
+from cachetools import TTLCache
+
+from config import config
+from log import setup_logger
+from embed.cross_encoder import CROSS_ENCODER_MODEL, score_pairs
+
+# logger
+logger = setup_logger("rerank")
+
+RERANK_BUDGET_MS = config.RERANK_BUDGET_MS
+RERANK_MIN_CANDIDATES = config.RERANK_MIN_CANDIDATES
+RERANK_MAX_CANDIDATES = config.RERANK_MAX_CANDIDATES
+
+class Reranker:
+    """
+    Cross-encoder rerank stage that runs after fusion.
+
+    The number of candidates scored per query adapts to a latency budget. A running
+    per-pair cost estimate sets the candidate count, and a correction factor shrinks it
+    whenever the recent p95 goes over budget and grows it back slowly otherwise.
+    Pairs already in the (query, doc id) score cache are free and do not use the budget.
+    """
+
+    def __init__(
+            self,
+            budget_ms=RERANK_BUDGET_MS,
+            min_candidates=RERANK_MIN_CANDIDATES,
+            max_candidates=RERANK_MAX_CANDIDATES,
+            cache_size=config.RERANK_CACHE_SIZE,
+            cache_ttl=config.RERANK_CACHE_TTL,
+            ):
+        self.budget_ms = budget_ms
+        self.min_candidates = min_candidates
+        self.max_candidates = max_candidates
+
+        self._scores = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._scores_lock = threading.Lock() # cachetools caches are not thread safe
+        self._lock = threading.Lock()
+
+        self._per_pair_ms = None # ewma, unknown until the first batch
+        self._scale = 1.0
+        self._latencies = deque(maxlen=200)
+
+    def candidate_budget(self) -> int:
+        with self._lock:
+            if self._per_pair_ms is None:
+                return self.min_candidates
+            n = int(self.budget_ms / self._per_pair_ms * self._scale)
+        return max(self.min_candidates, min(self.max_candidates, n))
+
+    def _record(self, pairs: int, elapsed_ms: float):
+        with self._lock:
+            if pairs:
+                per_pair = elapsed_ms / pairs
+                self._per_pair_ms = per_pair if self._per_pair_ms is None else 0.8 * self._per_pair_ms + 0.2 * per_pair
+
+            self._latencies.append(elapsed_ms)
+            if self.p95() > self.budget_ms:
+                self._scale = max(0.1, self._scale * 0.8)
+            else:
+                self._scale = min(1.0, self._scale * 1.05)
+
+    def p95(self) -> float:
+        if not self._latencies:
+            return 0.0
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(len(ordered) * 0.95) - 1)]
+
+    def _key(self, query: str, doc_id: str):
+        return (CROSS_ENCODER_MODEL, " ".join(query.casefold().split()), doc_id)
+
+    def rerank(self, query: str, results: list, top_k: int = None) -> list:
+        """
+        results are fused hits ({"id", "score", "text"}), best first. Returns the scored
+        candidates ordered by rerank_score, followed by the unscored remainder in fused order.
+        """
+        if not results:
+            return results
+
+        start = time.perf_counter()
+        budget = self.candidate_budget()
+
+        scored, pending = [], []
+        for result in results:
+            with self._scores_lock:
+                cached = self._scores.get(self._key(query, result["id"]))
+            if cached is not None:
+                scored.append((result, cached))
+            elif len(pending) < budget:
+                pending.append(result)
+            else:
+                break
+
+        # everything the walk above did not reach keeps its fused order
+        reached = len(scored) + len(pending)
+        remainder = results[reached:]
+
+        if pending:
+            scores = score_pairs(query, [result["text"] for result in pending])
+            with self._scores_lock:
+                for result, score in zip(pending, scores):
+                    self._scores[self._key(query, result["id"])] = score
+            scored.extend(zip(pending, scores))
+
+        self._record(len(pending), (time.perf_counter() - start) * 1000)
+
+        scored.sort(key=lambda pair: pair[1], reverse=True)
+        reranked = [{**result, "rerank_score": score} for result, score in scored] + remainder
+
+        logger.info(f"Reranked {len(scored)} candidate(s), {len(pending)} scored by the model.")
+
+        return reranked[:top_k] if top_k else reranked
+
+    def stats(self):
+        candidates = self.candidate_budget()
+        with self._lock:
+            return {
+                "budget_ms": self.budget_ms,
+                "candidates": candidates,
+                "per_pair_ms": self._per_pair_ms,
+                "p95_ms": self.p95(),
+                "cached_pairs": len(self._scores),
+            }
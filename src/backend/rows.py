@@ -0,0 +1,106 @@
+import hashlib
+import os
+import threading
+
+import yaml
+
+from config import config
+from log import setup_logger
+
+# logger
+logger = setup_logger("rows")
+
+ROW_TEMPLATES = config.ROW_TEMPLATES
+ROW_ID_MAX_CHARS = 256
+
+# Database rows as row_chunk documents, one per row.
+#
+# The _id is the table id plus the primary key, so re-extracting a row or replaying a
+# change overwrites the same document, and a delete knows which document to drop. The
+# text is the "column: value" rendering, or a per table str.format template from the
+# ROW_TEMPLATES yaml, e.g.
+#   shop.orders: "Order {id} by {customer} on {created_at}: {total} {currency}"
+#
+# Full extractions stamp every doc with row_sync (the table hash of that sync), and once
+# a table is through, its docs with another stamp are rows that no longer exist.
+
+def row_key(row: dict, key_columns: list):
+    """Primary key values of a row, None when the table has no key or a key value is missing."""
+    if not key_columns:
+        return None
+    values = [row.get(column) for column in key_columns]
+    if any(value is None for value in values):
+        return None
+    return "|".join(str(value) for value in values)
+
+def row_id(table_id: str, key: str) -> str:
+    _id = f"{table_id}:{key}"
+    if len(_id) > ROW_ID_MAX_CHARS: # es ids are capped at 512 bytes
+        _id = f"{table_id}:{hashlib.sha256(key.encode('utf-8')).hexdigest()}"
+    return _id
+
+def row_text(row: dict, template: str = None) -> str:
+    if template:
+        return template.format_map({name: "" if value is None else value for name, value in row.items()})
+    return " | ".join(f"{name}: {value}" for name, value in row.items() if value is not None)
+
+def row_doc(row: dict, database_id: str, table_id: str, table_name: str, key_columns: list, template: str = None):
+    key = row_key(row, key_columns)
+    if key is None:
+        return None
+    return {
+        "_id": row_id(table_id, key),
+        "database_id": database_id,
+        "table_id": table_id,
+        "access_group": "", # not yet implemented
+        "table_name": table_name,
+        "row_key": key,
+        "chunk_text": row_text(row, template),
+    }
+
+def row_docs(rows, database_id: str, table_id: str, table_name: str, key_columns: list, template: str = None, sync: str = None):
+    skipped = 0
+    for row in rows:
+        doc = row_doc(row, database_id, table_id, table_name, key_columns, template)
+        if doc is None:
+            skipped += 1
+            continue
+        if sync is not None:
+            doc["row_sync"] = sync
+        yield doc
+
+    if skipped:
+        logger.warning(f"Skipped {skipped} row(s) of {table_name} without a primary key")
+
+_templates = None
+_templates_lock = threading.Lock()
+
+def row_templates() -> dict:
+    global _templates
+    if _templates is None:
+        with _templates_lock:
+            if _templates is None:
+                templates = {}
+                if os.path.isfile(ROW_TEMPLATES):
+                    with open(ROW_TEMPLATES, 'r') as f:
+                        templates = yaml.safe_load(f) or {}
+                _templates = templates
+    return _templates
+
+def index_table_rows(es, rows, database_id: str, table_id: str, table_name: str, key_columns: list, sync: str, progress=None):
+    """Index a full extraction of a table, then drop the docs of rows that are gone. Raises if rows failed to index."""
+    if not key_columns:
+        logger.warning(f"{table_name} has no primary key, its rows are not indexed")
+        return 0
+
+    docs = row_docs(rows, database_id, table_id, table_name, key_columns, row_templates().get(table_name), sync)
+    indexed, errors = es.insert_objects(docs, index="row_chunk", progress=progress)
+    if errors:
+        # docs of the previous sync are kept, the caller must not record this sync as done
+        raise RuntimeError(f"{len(errors)} row(s) of {table_name} failed to index")
+
+    removed = es.delete_where("row_chunk", "table_id", table_id, keep={"row_sync": sync})
+    if removed:
+        logger.info(f"Removed {removed} deleted row(s) of {table_name}")
+    logger.info(f"Indexed {indexed} row(s) of {table_name}")
+    return indexed
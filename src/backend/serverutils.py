@@ -1,6 +1,6 @@
 from enum import Enum
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 class Status(Enum):
     OK = "OK"
@@ -19,6 +19,27 @@ class Query(BaseModel):
     query: str
     index: str
     doc_ids: Optional[List[str]] = None # to restrict search to a specific file
+    retrieval_mode: Optional[str] = None # client_rrf | msearch_rrf | server_rrf, defaults to config
+    # fusion, unset values fall back to the defaults in fusion.py
+    fusion: Optional[str] = None # rrf | convex
+    weights: Optional[Dict[str, float]] = None # per leg, e.g. {"match": 1.0, "knn": 2.0}
+    rank_constant: Optional[int] = None # k in 1 / (k + rank)
+    rank_window_size: Optional[int] = None # hits fetched from each leg before fusion
+    top_k: Optional[int] = None # fused hits returned
+    normalization: Optional[str] = None # per leg score normalization for convex: minmax | zscore
+    normalize: Optional[str] = None # attach a normalized_score to results: minmax | zscore
+    rerank: Optional[bool] = False # rescore fused candidates with the cross-encoder
+
+    def fusion_args(self):
+        return {
+            "method": self.fusion,
+            "weights": self.weights,
+            "rank_constant": self.rank_constant,
+            "rank_window_size": self.rank_window_size,
+            "top_k": self.top_k,
+            "normalization": self.normalization,
+            "normalize": self.normalize,
+        }
 
 class Load(BaseModel):
     filepath: str
@@ -1,31 +1,25 @@
-import unicodedata
 import os
-import yaml
-from uuid import uuid5, NAMESPACE_URL
-import re
+import shutil
+import time
 from pathlib import Path
-import json
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 from celery import Celery
+from celery.signals import task_prerun
 
-from unstructured.partition.text import partition_text
-from unstructured.partition.rtf import partition_rtf
-from unstructured.partition.doc import partition_doc
-from unstructured.partition.docx import partition_docx
-from unstructured.partition.pdf import partition_pdf # pikapdf dependency is not fork safe, can we remove this dep?
-from unstructured.partition.epub import partition_epub
-# from unstructured.partition.latex import partition_latex # there is no partition_latex
-from unstructured.partition.md import partition_md
-from unstructured.partition.ppt import partition_ppt
-from unstructured.partition.pptx import partition_pptx
-
-
-from connect.postgres import postgres_to_yamls
+from connect.postgres import PostgresCrawler, database_id, remove_yaml, write_yaml
 from config import config
 from log import setup_logger
 from typeutils import get_pathtype, parse_connection_string
 from elasticutils import Search
 from tritonutils import TritonClient
+from pipeline import FORMATS, ingest_document
+from tables import ingest_table
+from records import ingest_records
+from rows import index_table_rows
+from progress import TaskProgress
+from queues import LIGHT, broker_transport_options, record_wait, route, task_queues
+from crawl import ARCHIVE_TYPES, CrawlProgress, crawl, is_archive
 
 import warnings
 
@@ -33,6 +27,12 @@ warnings.filterwarnings("ignore", category=UserWarning, module="celery.platforms
 
 CELERY_BROKER_URL = config.CELERY_BROKER_URL
 CELERY_RESULT_BACKEND = config.CELERY_RESULT_BACKEND
+DIR_FANOUT = config.DIR_FANOUT
+DIR_WORKERS = config.DIR_WORKERS
+DIR_MAX_IN_FLIGHT = config.DIR_MAX_IN_FLIGHT
+DIR_POLL_INTERVAL = config.DIR_POLL_INTERVAL
+DB_ROW_INDEX = config.DB_ROW_INDEX
+ROWS_SUFFIX = ":rows" # table_hash of tables whose rows are indexed too
 
 # logger
 logger = setup_logger("storage")
@@ -54,8 +54,22 @@ celery_app.conf.update(
     enable_utc=True,
     result_expires=None,  # Results do not expire
     task_track_started=True,
+    # light / heavy / bulk queues with size based priorities, see queues.py
+    task_queues=task_queues(),
+    task_default_queue=LIGHT,
+    broker_transport_options=broker_transport_options(),
+    worker_prefetch_multiplier=config.WORKER_PREFETCH_MULTIPLIER, # a worker should not hoard ocr jobs
+    # ack once a load is done, so a load whose worker is killed is redelivered and resumes from its journal
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
 )
 
+@task_prerun.connect
+def _record_queue_wait(task=None, **kwargs):
+    request = task.request
+    enqueued_at = getattr(request, "enqueued_at", None) or (request.headers or {}).get("enqueued_at")
+    record_wait((request.delivery_info or {}).get("routing_key"), enqueued_at)
+
 # elasticsearch
 es = Search()
 
@@ -66,8 +80,26 @@ try:
 except Exception as e:
     print(f"Triton not available: {e}")
 
-@celery_app.task(name="load_data_task")
-def load_data(filepath: str, read=True, c_type=None):
+def submit_load(filepath: str, c_type: str = None, size: int = None, remove: bool = True):
+    # queue by type and size, smaller files first within a queue
+    collection = c_type == "dir" or c_type in ARCHIVE_TYPES
+    if size is None and os.path.isfile(filepath):
+        size = os.path.getsize(filepath)
+    queue, priority = route(c_type, size, collection)
+
+    return load_data.apply_async(
+        args=[filepath],
+        kwargs={"c_type": c_type, "remove": remove},
+        queue=queue,
+        priority=priority,
+        headers={"enqueued_at": time.time()}, # for queue wait stats
+    )
+
+# file types a directory load fans out, anything else found in a tree is skipped
+FILE_TYPES = set(FORMATS) | {"latex", "csv", "tsv", "parquet", "xlsx", "json", "jsonl", "yaml"}
+
+@celery_app.task(name="load_data_task", bind=True)
+def load_data(self, filepath: str, read=True, c_type=None, remove=True):
 
     # if connection type is not provided, try to infer it
     if not c_type:
@@ -76,51 +108,60 @@ def load_data(filepath: str, read=True, c_type=None):
 
     print("Using connection type: " + c_type)
 
-    # unstructured
+    # state transitions and stage counts for /task/{task_id}/events
+    progress = TaskProgress(self.request.id)
+    progress.set_state("STARTED", c_type=c_type, filename=os.path.basename(filepath))
 
-    if c_type == "txt":
-        _txt(filepath)
+    try:
+        result = c_type
 
-    elif c_type == "rtf":
-        _rtf(filepath)
-    
-    elif c_type == "doc":
-        _doc(filepath)
+        # mixed
 
-    elif c_type == "docx":
-        _docx(filepath)
-    
-    elif c_type == "pdf":
-        _pdf(filepath, read_pdf=read)
-    
-    elif c_type == "epub":
-        _epub(filepath)
+        if c_type == "dir" or (c_type in ARCHIVE_TYPES and is_archive(filepath)):
+            # walk the tree and fan files out to subtasks
+            result = _dir(self, filepath, c_type, progress)
 
-    elif c_type == "latex":
-        _latex(filepath)
+        else:
+            _load(filepath, read, c_type, progress)
+
+        if remove and os.path.isfile(filepath): # remove tempfile, not needed if we don't create the temp file
+            os.remove(filepath)
+    except Exception as e:
+        progress.set_state("FAILURE", error=str(e))
+        # the failed message is acked and not retried, a file left here would count against QUEUE_MAX_BYTES for good
+        if remove and os.path.isfile(filepath):
+            os.remove(filepath)
+        raise
 
-    elif c_type == "markdown":
-        _markdown(filepath)
+    progress.set_state("SUCCESS")
+    return result
 
-    elif c_type == "ppt":
-        _ppt(filepath)
-    
-    elif c_type == "pptx":
-        _pptx(filepath)
+def _load(filepath: str, read=True, c_type=None, progress=None):
+
+    # unstructured
+
+    if c_type == "pdf" and not read:
+        raise PermissionError('File is not readable.')
+
+    if c_type in FORMATS:
+        _document(filepath, c_type, progress)
+
+    elif c_type == "latex":
+        _latex(filepath)
 
     # structured
 
     elif c_type == "csv":
-        _csv(filepath)
+        _csv(filepath, progress)
 
     elif c_type == "tsv":
-        _tsv(filepath)
+        _tsv(filepath, progress)
     
     elif c_type == "parquet":
-        _parquet(filepath)
+        _parquet(filepath, progress)
     
     elif c_type == "xlsx":
-        _xlsx(filepath)
+        _xlsx(filepath, progress)
 
     elif c_type == "db":
         # check if input is a supported connection string
@@ -136,29 +177,20 @@ def load_data(filepath: str, read=True, c_type=None):
 
     # mixed
 
-    elif c_type == "dir":
-        # recursively call load_data
-        pass
-
-    elif c_type == "json":
-        _json(filepath)
+    elif c_type in ("json", "jsonl"):
+        _json(filepath, progress) # ndjson is detected by the json reader
     
     elif c_type == "yaml":
-        _yaml(filepath)
+        _yaml(filepath, progress)
 
     # third party
 
     elif c_type == "linear":
-        _linear(filepath)
+        _linear(filepath, progress)
 
     else:
         logger.warning("unsupported filetype encountered.")
         raise NotImplementedError(f"File ({c_type}) type is not supported.")
-    
-    if os.path.exists(filepath): # remove tempfile, not needed if we don't create the temp file
-            os.remove(filepath)
-
-    return c_type
 
 def _retrieve_all_objects(index: str):
     response = es.retrieve_all_objects(index)
@@ -172,392 +204,217 @@ def retrieve_object_ids(index: str):
 
     return doc_tuples
 
-def query(q: str, index: str, doc_ids: str = None):
-    return es.hybrid_search(q, index, doc_ids)
+def query(q: str, index: str, doc_ids: str = None, mode: str = None, rerank: bool = False, **fusion_args):
+    return es.hybrid_search(q, index, doc_ids, mode=mode, rerank=rerank, **fusion_args)
 
-## unstructured formats
+async def aquery(q: str, index: str, doc_ids: str = None, mode: str = None, rerank: bool = False, **fusion_args):
+    return await es.async_hybrid_search(q, index, doc_ids, mode=mode, rerank=rerank, **fusion_args)
 
-def _txt(filepath, chunking_strategy="basic"):
-    
-    doc_id = str(uuid5(NAMESPACE_URL, filepath))
+async def close_search():
+    await es.aclose()
 
-    try:
-        elements = partition_text(filepath, chunking_strategy=chunking_strategy)
-    except Exception as e:
-        logger.error(f"Failed to parse TEXT elements: {e}")
-        return
-
-    if elements is not None:
-
-        for i, e in enumerate(elements):
-            chunk = "".join(
-                ch for ch in e.text if unicodedata.category(ch)[0] != "C"
-            )  # remove control characters
-            
-            formatted_chunk = re.sub(r'(?<=[.?!])(?=[^\s])', ' ', chunk) # this will add a space character after every ". ? !"
-
-            fields = {
-                "document_id": doc_id,  # document id from path
-                "access_group": "",  # not yet implemented
-                "document_name": os.path.basename(filepath),
-                "chunk_text": formatted_chunk,
-                "chunking_strategy": chunking_strategy,
-                "chunk_no": i,
-            }
-
-            # Insert the document into Elasticsearch
-            es.insert_object(fields, index="text_chunk")
-    
-    os.remove(filepath)
+## collections
 
-def _rtf(filepath, chunking_strategy="by_title"):
-    doc_id = str(uuid5(NAMESPACE_URL, filepath))
+def _dir(task, root: str, c_type: str = "dir", task_progress: TaskProgress = None):
+    # crawl lazily, at most DIR_MAX_IN_FLIGHT files are queued or being ingested at once
+    def report(meta):
+        task.update_state(state="PROGRESS", meta=meta)
+        if task_progress is not None:
+            task_progress.update(files=meta)
 
-    try:
-        elements = partition_rtf(filepath, chunking_strategy=chunking_strategy)
-    except Exception as e:
-        logger.error(f"Failed to parse RTF elements: {e}")
-        return
-
-    if elements is not None:
-
-        for i, e in enumerate(elements):
-            chunk = "".join(
-                ch for ch in e.text if unicodedata.category(ch)[0] != "C"
-            )  # remove control characters
-            
-            formatted_chunk = re.sub(r'(?<=[.?!])(?=[^\s])', ' ', chunk) # this will add a space character after every ". ? !"
-
-            fields = {
-                "document_id": doc_id,  # document id from path
-                "access_group": "",  # not yet implemented
-                "document_name": os.path.basename(filepath),
-                "chunk_text": formatted_chunk,
-                "chunking_strategy": chunking_strategy,
-                "chunk_no": i,
-            }
-
-            # Insert the document into Elasticsearch
-            es.insert_object(fields, index="text_chunk")
-    
-    os.remove(filepath)
+    progress = CrawlProgress(root, report=report)
+    extracted = []
 
-def _doc(filepath, chunking_strategy="by_title"):
-    doc_id = str(uuid5(NAMESPACE_URL, filepath))
+    files = _supported(crawl(root, c_type, extracted), progress)
 
     try:
-        elements = partition_doc(filepath, chunking_strategy=chunking_strategy)
-    except Exception as e:
-        logger.error(f"Failed to parse DOC elements: {e}")
-        return
-
-    if elements is not None:
-
-        for i, e in enumerate(elements):
-            chunk = "".join(
-                ch for ch in e.text if unicodedata.category(ch)[0] != "C"
-            )  # remove control characters
-            
-            formatted_chunk = re.sub(r'(?<=[.?!])(?=[^\s])', ' ', chunk) # this will add a space character after every ". ? !"
-
-            fields = {
-                "document_id": doc_id,  # document id from path
-                "access_group": "",  # not yet implemented
-                "document_name": os.path.basename(filepath),
-                "chunk_text": formatted_chunk,
-                "chunking_strategy": chunking_strategy,
-                "chunk_no": i,
-            }
-
-            # Insert the document into Elasticsearch
-            es.insert_object(fields, index="text_chunk")
-    
-    os.remove(filepath)
-
-def _docx(filepath, chunking_strategy="by_title"):
-    doc_id = str(uuid5(NAMESPACE_URL, filepath))
-
+        if DIR_FANOUT == "local":
+            _fan_out_local(files, progress, task_progress)
+        else:
+            _fan_out_celery(files, progress)
+    finally:
+        for dest in extracted:
+            shutil.rmtree(dest, ignore_errors=True)
+
+    progress.publish(force=True)
+    logger.info(f"Loaded {root}: {progress.meta()}")
+
+    return {"c_type": c_type, **progress.summary()}
+
+def _supported(files, progress: CrawlProgress):
+    for filepath, c_type, remove in files:
+        if c_type in FILE_TYPES:
+            yield filepath, c_type, remove
+        else:
+            progress.skipped(filepath, c_type)
+            if remove:
+                os.remove(filepath)
+
+def _load_file(filepath: str, c_type: str, remove: bool, task_progress: TaskProgress = None):
     try:
-        elements = partition_docx(filepath, chunking_strategy=chunking_strategy)
-    except Exception as e:
-        logger.error(f"Failed to parse DOCX elements: {e}")
-        return
-
-    if elements is not None:
-
-        for i, e in enumerate(elements):
-            chunk = "".join(
-                ch for ch in e.text if unicodedata.category(ch)[0] != "C"
-            )  # remove control characters
-            
-            formatted_chunk = re.sub(r'(?<=[.?!])(?=[^\s])', ' ', chunk) # this will add a space character after every ". ? !"
-
-            fields = {
-                "document_id": doc_id,  # document id from path
-                "access_group": "",  # not yet implemented
-                "document_name": os.path.basename(filepath),
-                "chunk_text": formatted_chunk,
-                "chunking_strategy": chunking_strategy,
-                "chunk_no": i,
-            }
-
-            # Insert the document into Elasticsearch
-            es.insert_object(fields, index="text_chunk")
-    
-    os.remove(filepath)
+        _load(filepath, True, c_type, task_progress)
+    finally:
+        if remove and os.path.isfile(filepath):
+            os.remove(filepath)
 
-def _pdf(filepath, read_pdf=True, chunking_strategy="by_title"):
-    
-    doc_id = str(uuid5(NAMESPACE_URL, filepath))
-
-    if read_pdf: # read pdf
-        try:
-            elements = partition_pdf(filepath, strategy="hi_res", chunking_strategy=chunking_strategy)
-        except Exception as e:
-            logger.error(f"Failed to parse PDF elements: {e}")
-            return
-
-        if elements is not None:
-            for i, e in enumerate(elements):
-                chunk = "".join(
-                    ch for ch in e.text if unicodedata.category(ch)[0] != "C"
-                )  # remove control characters
-                
-                formatted_chunk = re.sub(r'(?<=[.?!])(?=[^\s])', ' ', chunk) # this will add a space character after every ". ? !"
-
-                fields = {
-                    "document_id": doc_id,  # document id from path
-                    "access_group": "",  # not yet implemented
-                    "document_name": os.path.basename(filepath),
-                    "chunk_text": formatted_chunk,
-                    "chunking_strategy": chunking_strategy,
-                    "chunk_no": i,
-                }
-
-                # Insert the document into Elasticsearch
-                es.insert_object(fields, index="text_chunk")
-    else:
-        raise PermissionError('File is not readable.')
-    
-    os.remove(filepath)
+def _fan_out_local(files, progress: CrawlProgress, task_progress: TaskProgress = None):
+    in_flight = {}
 
-def _epub(filepath, chunking_strategy="by_title"):
-    doc_id = str(uuid5(NAMESPACE_URL, filepath))
+    def reap(done):
+        for future in done:
+            progress.finished(in_flight.pop(future), future.exception())
 
-    try:
-        elements = partition_epub(filepath, chunking_strategy=chunking_strategy)
-    except Exception as e:
-        logger.error(f"Failed to parse EPUB elements: {e}")
-        return
-
-    if elements is not None:
-
-        for i, e in enumerate(elements):
-            chunk = "".join(
-                ch for ch in e.text if unicodedata.category(ch)[0] != "C"
-            )  # remove control characters
-            
-            formatted_chunk = re.sub(r'(?<=[.?!])(?=[^\s])', ' ', chunk) # this will add a space character after every ". ? !"
-
-            fields = {
-                "document_id": doc_id,  # document id from path
-                "access_group": "",  # not yet implemented
-                "document_name": os.path.basename(filepath),
-                "chunk_text": formatted_chunk,
-                "chunking_strategy": chunking_strategy,
-                "chunk_no": i,
-            }
-
-            # Insert the document into Elasticsearch
-            es.insert_object(fields, index="text_chunk")
-    
-    os.remove(filepath)
+    with ThreadPoolExecutor(max_workers=DIR_WORKERS) as pool:
+        for filepath, c_type, remove in files:
+            if len(in_flight) >= DIR_MAX_IN_FLIGHT:
+                reap(wait(in_flight, return_when=FIRST_COMPLETED).done)
 
-def _latex(filepath, chunking_strategy="by_title"):
-    raise NotImplementedError(f"Ingestion for {filepath} is not implemented yet.")
+            in_flight[pool.submit(_load_file, filepath, c_type, remove, task_progress)] = filepath
+            progress.queued(filepath)
 
-def _markdown(filepath, chunking_strategy="by_title"):
-    doc_id = str(uuid5(NAMESPACE_URL, filepath))
+        reap(wait(in_flight).done)
 
-    try:
-        elements = partition_md(filepath, chunking_strategy=chunking_strategy)
-    except Exception as e:
-        logger.error(f"Failed to parse MARKDOWN elements: {e}")
-        return
-
-    if elements is not None:
-
-        for i, e in enumerate(elements):
-            chunk = "".join(
-                ch for ch in e.text if unicodedata.category(ch)[0] != "C"
-            )  # remove control characters
-            
-            formatted_chunk = re.sub(r'(?<=[.?!])(?=[^\s])', ' ', chunk) # this will add a space character after every ". ? !"
-
-            fields = {
-                "document_id": doc_id,  # document id from path
-                "access_group": "",  # not yet implemented
-                "document_name": os.path.basename(filepath),
-                "chunk_text": formatted_chunk,
-                "chunking_strategy": chunking_strategy,
-                "chunk_no": i,
-            }
-
-            # Insert the document into Elasticsearch
-            es.insert_object(fields, index="text_chunk")
-    
-    os.remove(filepath)
+def _fan_out_celery(files, progress: CrawlProgress):
+    in_flight = {}
 
-def _ppt(filepath, chunking_strategy="by_title"):
-    doc_id = str(uuid5(NAMESPACE_URL, filepath))
+    def reap(limit):
+        # poll until fewer than `limit` subtasks are outstanding
+        while True:
+            for result in [result for result in in_flight if result.ready()]:
+                filepath = in_flight.pop(result)
+                progress.finished(filepath, result.result if result.failed() else None)
+                result.forget() # the parent keeps the per-file status
+            if len(in_flight) < limit:
+                return
+            time.sleep(DIR_POLL_INTERVAL)
 
-    try:
-        elements = partition_ppt(filepath, chunking_strategy=chunking_strategy)
-    except Exception as e:
-        logger.error(f"Failed to parse PPT elements: {e}")
-        return
-
-    if elements is not None:
-
-        for i, e in enumerate(elements):
-            chunk = "".join(
-                ch for ch in e.text if unicodedata.category(ch)[0] != "C"
-            )  # remove control characters
-            
-            formatted_chunk = re.sub(r'(?<=[.?!])(?=[^\s])', ' ', chunk) # this will add a space character after every ". ? !"
-
-            fields = {
-                "document_id": doc_id,  # document id from path
-                "access_group": "",  # not yet implemented
-                "document_name": os.path.basename(filepath),
-                "chunk_text": formatted_chunk,
-                "chunking_strategy": chunking_strategy,
-                "chunk_no": i,
-            }
-
-            # Insert the document into Elasticsearch
-            es.insert_object(fields, index="text_chunk")
-    
-    os.remove(filepath)
+    for filepath, c_type, remove in files:
+        reap(DIR_MAX_IN_FLIGHT)
 
-def _pptx(filepath, chunking_strategy="by_title"):
-    doc_id = str(uuid5(NAMESPACE_URL, filepath))
+        result = submit_load(filepath, c_type, remove=remove)
+        in_flight[result] = filepath
+        progress.queued(filepath)
 
-    try:
-        elements = partition_pptx(filepath, chunking_strategy=chunking_strategy)
-    except Exception as e:
-        logger.error(f"Failed to parse PPTX elements: {e}")
-        return
-
-    if elements is not None:
-
-        for i, e in enumerate(elements):
-            chunk = "".join(
-                ch for ch in e.text if unicodedata.category(ch)[0] != "C"
-            )  # remove control characters
-            
-            formatted_chunk = re.sub(r'(?<=[.?!])(?=[^\s])', ' ', chunk) # this will add a space character after every ". ? !"
-
-            fields = {
-                "document_id": doc_id,  # document id from path
-                "access_group": "",  # not yet implemented
-                "document_name": os.path.basename(filepath),
-                "chunk_text": formatted_chunk,
-                "chunking_strategy": chunking_strategy,
-                "chunk_no": i,
-            }
-
-            # Insert the document into Elasticsearch
-            es.insert_object(fields, index="text_chunk")
-    
-    os.remove(filepath)
+    reap(1)
 
-## structured formats
+## unstructured formats
 
-def _csv(filepath, read_pdf=True, chunking_strategy="by_title"):
-    raise NotImplementedError(f"Ingestion for {filepath} is not implemented yet.")
+def _document(filepath, c_type, progress=None):
+    # partition -> normalize -> embed -> index, see pipeline.py for the per-format stages
+    indexed = ingest_document(filepath, FORMATS[c_type], es, progress=progress)
+    logger.info(f"Indexed {indexed} chunk(s) from {os.path.basename(filepath)}")
 
-def _tsv(filepath, read_pdf=True, chunking_strategy="by_title"):
+def _latex(filepath, chunking_strategy="by_title"):
     raise NotImplementedError(f"Ingestion for {filepath} is not implemented yet.")
 
-def _parquet(filepath, chunking_strategy="by_title"):
-    raise NotImplementedError(f"Ingestion for {filepath} is not implemented yet.")
+## structured formats
 
-def _xlsx(filepath, chunking_strategy="by_title"):
-    raise NotImplementedError(f"Ingestion for {filepath} is not implemented yet.")
+def _table(filepath, c_type, progress=None):
+    # record batches -> column stats + row sample -> table_meta, see tables.py
+    indexed = ingest_table(filepath, c_type, es, progress=progress)
+    logger.info(f"Indexed {indexed} table(s) from {os.path.basename(filepath)}")
 
-## Mixed formats
+def _csv(filepath, progress=None):
+    _table(filepath, "csv", progress)
 
-def _json(filepath, chunking_strategy="by_title"):
-    raise NotImplementedError(f"Ingestion for {filepath} is not implemented yet.")
+def _tsv(filepath, progress=None):
+    _table(filepath, "tsv", progress)
 
-def _yaml(filepath, chunking_strategy="by_title"):
-    raise NotImplementedError(f"Ingestion for {filepath} is not implemented yet.")
+def _parquet(filepath, progress=None):
+    _table(filepath, "parquet", progress)
 
-# third party formats
+def _xlsx(filepath, progress=None):
+    _table(filepath, "xlsx", progress)
 
-def _linear(filepath):
+## Mixed formats
 
-    doc_id = str(uuid5(NAMESPACE_URL, filepath))
+def _records(filepath, c_type, progress=None):
+    # streamed records -> flattened chunks -> embed -> index, see records.py
+    indexed = ingest_records(filepath, c_type, es, progress=progress)
+    logger.info(f"Indexed {indexed} chunk(s) from {os.path.basename(filepath)}")
 
-    with open(filepath, 'r') as f:
-        data = json.load(f)
+def _json(filepath, progress=None):
+    _records(filepath, "json", progress)
 
-    data = data['issues']
-    for issue in data:
-        fields = {
-                    "document_id": doc_id,  # should it be the id of the linear import? Or the id of the issue?
-                    "document_name": os.path.basename(filepath),
-                    "access_group": "",  # not yet implemented
-                    "chunk_text": f"Title: {issue['title']}\nStatus: {issue['status']}\nCreated At: {issue['createdAt']}",
-                    "chunking_strategy": "by issue",
-                    "chunk_no": "",
-                }
+def _yaml(filepath, progress=None):
+    _records(filepath, "yaml", progress)
+
+# third party formats
 
-        es.insert_object(fields, index="text_chunk")
+def _linear(filepath, progress=None):
+    _records(filepath, "linear", progress)
 
 def _db(db_type, host, user, password):
     # figure out which db connector to use
-    if db_type == "postgres":
-        postgres_to_yamls(host, user, password)
-    elif db_type == "mysql":
-        raise NotImplementedError
-    else:
+    if db_type != "postgres": # no mysql crawler yet
         raise NotImplementedError
 
-    node_name = f"models/{db_type}/yamls" # should be turned to path object
-    db_id = str(uuid5(NAMESPACE_URL, node_name))
-
-    data = {}
-
-    for i, file in enumerate(os.listdir(node_name)): # TODO: does this need to be enumerated?
-        filepath = os.path.join(node_name, file)
-        if file.endswith('.yaml') and os.path.isfile(filepath):
-            with open(filepath, 'r') as f:
-                data = yaml.safe_load(f)
-
-                column_embeddings = {}
-                if 'dimensions' in data:
-                    for dimension in data['dimensions']:
-                        column_name = dimension.get('name')
-                        embedding = dimension.get('embedding')
-                        if column_name and embedding:
-                            column_embeddings[column_name] = embedding
-
-                fields = {
-                    "database_id" : db_id,
-                    "access_group" : "", # not yet implemented
-                    "table_name" : data["sql_name"],
-                    "description_text" : data["description"],
-                    "correlation_embedding" : column_embeddings,
-                    "chunking_strategy" : "", # not chunked rn
-                    "chunking_no" : "", # not chunked rn
-                    "data_hash" : "not implemented", # for integrity check
-                }
-
-                es.insert_object(fields, index="table_meta")
-                
-                print("stored: " + file.split(".")[0])
+    db_id = database_id(host)
+
+    def index_rows(db, table, entry, rows):
+        # raises if rows failed, the table is then not stored and crawled again next time
+        index_table_rows(es, rows, db_id, entry["id"], f"{db}.{table}", entry["primary_keys"], sync=entry["table_hash"])
+
+    # only tables whose catalog signals changed since the last sync are profiled again. with
+    # DB_ROW_INDEX the stored hash is suffixed once the rows are indexed too, so turning it on
+    # for an already synced server (or a failed row sync) extracts the tables again
+    stored = es.table_hashes(db_id)
+    known = {}
+    for _id, (table_hash, _) in stored.items():
+        table_hash = table_hash or ""
+        if table_hash.endswith(ROWS_SUFFIX):
+            known[_id] = table_hash[:-len(ROWS_SUFFIX)]
+        elif not DB_ROW_INDEX:
+            known[_id] = table_hash
+    crawler = PostgresCrawler(
+        host,
+        user,
+        password,
+        known=known,
+        row_sink=index_rows if DB_ROW_INDEX else None, # opt in, every row of every changed table
+    )
+    yamls = crawler.crawl(on_table=write_yaml)
+
+    tables = []
+    for data in yamls:
+        column_embeddings = {}
+        if 'dimensions' in data:
+            for dimension in data['dimensions']:
+                column_name = dimension.get('name')
+                embedding = dimension.get('embedding')
+                if column_name and embedding:
+                    column_embeddings[column_name] = embedding
+
+        fields = {
+            "_id" : data["id"],
+            "database_id" : db_id,
+            "access_group" : "", # not yet implemented
+            "table_name" : data["sql_name"],
+            "description_text" : data["description"],
+            "correlation_embedding" : column_embeddings,
+            "chunking_strategy" : "", # not chunked rn
+            "chunking_no" : "", # not chunked rn
+            "table_hash" : data["table_hash"] + (ROWS_SUFFIX if DB_ROW_INDEX else ""), # catalog signals, see connect/postgres.py
+            "row_count" : data.get("row_count"),
+        }
+
+        tables.append(fields)
+
+    indexed, _ = es.insert_objects(tables, index="table_meta")
+    print(f"stored: {indexed} table(s), {crawler.unchanged} unchanged")
+
+    # tables of databases that could not be read are kept
+    vanished = {
+        _id: table_name for _id, (_, table_name) in stored.items()
+        if _id not in crawler.seen and (table_name or "").split(".", 1)[0] not in crawler.skipped_databases
+    }
+    if vanished:
+        es.delete_objects(list(vanished), "table_meta")
+        for _id, table_name in vanished.items():
+            es.delete_where("row_chunk", "table_id", _id)
+            if table_name:
+                remove_yaml(table_name)
+        print(f"removed: {len(vanished)} table(s)")
 
 if __name__ == "__main__":
     # load_data("/Users/noelthomas/Desktop/Mistral 7B Paper.pdf", True)
@@ -0,0 +1,325 @@
+import os
+from uuid import uuid5, NAMESPACE_URL
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from config import config
+from log import setup_logger
+from auto_description import describe_table
+from connect.correlation import correlation_embedding
+from pipeline import file_hash
+from progress import counted
+
+# logger
+logger = setup_logger("tables")
+
+TABLE_BATCH_ROWS = config.TABLE_BATCH_ROWS
+TABLE_CSV_BLOCK_BYTES = config.TABLE_CSV_BLOCK_BYTES
+TABLE_SAMPLE_SIZE = config.TABLE_SAMPLE_SIZE
+TABLE_ROW_CHUNKS = config.TABLE_ROW_CHUNKS
+TABLE_ROWS_PER_CHUNK = config.TABLE_ROWS_PER_CHUNK
+
+# Streaming ingestion for tabular files.
+#
+# Readers yield (table_name, record batches) per table in a file, and only one batch is
+# alive at a time. Column statistics and a uniform row sample (for correlation_embedding)
+# are built in the same pass, then a table_meta doc is indexed per table. Rows can also
+# be indexed as text_chunk docs (TABLE_ROW_CHUNKS), streamed through bulk indexing.
+
+NULL_VALUES = ["", "NA", "N/A", "NaN", "nan", "NULL", "null", "None", "-"]
+
+## readers
+
+def _open_csv(filepath: str, delimiter: str, column_types: dict = None, skip_rows: int = 0):
+    return pa_csv.open_csv(
+        filepath,
+        read_options=pa_csv.ReadOptions(block_size=TABLE_CSV_BLOCK_BYTES, skip_rows_after_names=skip_rows),
+        parse_options=pa_csv.ParseOptions(delimiter=delimiter),
+        convert_options=pa_csv.ConvertOptions(null_values=NULL_VALUES, strings_can_be_null=True, column_types=column_types or {}),
+    )
+
+def _lenient_cast(batch, schema):
+    # inferred type if every value fits, float64 for an int column that does not, else text
+    arrays = []
+    for name, column in zip(batch.schema.names, batch.columns):
+        target = schema.field(name).type if name in schema.names else column.type
+        for data_type in (target, pa.float64()) if pa.types.is_integer(target) else (target,):
+            try:
+                column = pc.cast(column, data_type)
+                break
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                continue
+        arrays.append(column)
+    return pa.RecordBatch.from_arrays(arrays, names=batch.schema.names)
+
+def _csv_batches(filepath: str, delimiter: str):
+    # column types are inferred from the first block only. a later value that does not fit
+    # fails the read, the rest of the file is then read as text and converted per batch
+    reader = _open_csv(filepath, delimiter)
+    schema = reader.schema
+    rows = 0
+    try:
+        for batch in reader:
+            rows += batch.num_rows
+            yield batch
+        return
+    except pa.ArrowInvalid as e:
+        logger.warning(f"{os.path.basename(filepath)}: {e}, reading from row {rows} as text")
+
+    reader = _open_csv(filepath, delimiter, {name: pa.string() for name in schema.names}, skip_rows=rows)
+    for batch in reader:
+        yield _lenient_cast(batch, schema)
+
+def read_csv(filepath: str, delimiter: str = ","):
+    yield os.path.basename(filepath), _csv_batches(filepath, delimiter)
+
+def read_tsv(filepath: str):
+    return read_csv(filepath, delimiter="\t")
+
+def read_parquet(filepath: str):
+    # one row group is decoded at a time
+    parquet_file = pq.ParquetFile(filepath)
+    yield os.path.basename(filepath), parquet_file.iter_batches(batch_size=TABLE_BATCH_ROWS)
+
+def _sheet_batches(sheet, batch_rows: int):
+    rows = sheet.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return
+    names = [str(name) if name is not None else f"column_{i}" for i, name in enumerate(header)]
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_rows:
+            yield rows_to_batch(names, batch)
+            batch = []
+    if batch:
+        yield rows_to_batch(names, batch)
+
+def rows_to_batch(names: list, rows: list):
+    columns = list(zip(*rows)) if rows else [[] for _ in names]
+    arrays = []
+    for column in columns[:len(names)]:
+        try:
+            arrays.append(pa.array(column, from_pandas=True))
+        except (pa.ArrowInvalid, pa.ArrowTypeError): # mixed cell types
+            arrays.append(pa.array([None if value is None else str(value) for value in column]))
+    return pa.RecordBatch.from_arrays(arrays, names=names[:len(arrays)])
+
+def read_xlsx(filepath: str):
+    from openpyxl import load_workbook # only needed for spreadsheets
+
+    # read_only streams rows from the sheet xml instead of loading the workbook
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield f"{os.path.basename(filepath)}:{sheet.title}", _sheet_batches(sheet, TABLE_BATCH_ROWS)
+    finally:
+        workbook.close()
+
+TABLE_READERS = {
+    "csv": read_csv,
+    "tsv": read_tsv,
+    "parquet": read_parquet,
+    "xlsx": read_xlsx,
+}
+
+## profiling
+
+def _is_numeric(data_type) -> bool:
+    return pa.types.is_integer(data_type) or pa.types.is_floating(data_type) or pa.types.is_boolean(data_type) or pa.types.is_decimal(data_type)
+
+class TableProfile:
+    """
+    Column statistics and a uniform row sample, updated one record batch at a time.
+
+    The sample is a reservoir (algorithm R) over row positions shared by every column,
+    so sampled values stay aligned across columns and are put back in file order before
+    correlation_embedding is computed.
+    """
+
+    def __init__(self, sample_size: int = TABLE_SAMPLE_SIZE, seed: int = 0):
+        self.sample_size = sample_size
+        self.rows = 0
+
+        self._rng = np.random.default_rng(seed)
+        self._positions = np.full(sample_size, -1, dtype=np.int64) # row number held by each slot
+        self._samples = {} # column -> float64[sample_size], nan for null / non numeric
+        self._stats = {} # column -> running stats
+
+    def _slots(self, n: int):
+        # returns (slots, rows): batch rows that enter the reservoir and the slots they take
+        offsets = np.arange(self.rows, self.rows + n, dtype=np.int64)
+        fill = max(0, min(n, self.sample_size - self.rows))
+
+        slots = np.empty(n, dtype=np.int64)
+        slots[:fill] = offsets[:fill]
+        if n > fill:
+            slots[fill:] = self._rng.integers(0, offsets[fill:] + 1)
+
+        rows = np.flatnonzero(slots < self.sample_size)
+        slots = slots[rows]
+
+        # several rows of one batch can draw the same slot, the last one wins (as if sequential)
+        _, last = np.unique(slots[::-1], return_index=True)
+        keep = np.sort(len(slots) - 1 - last)
+        return slots[keep], rows[keep]
+
+    def _column_stats(self, name: str, data_type):
+        if name not in self._stats:
+            self._stats[name] = {
+                "type": str(data_type),
+                "count": 0,
+                "null_count": 0,
+                "min": None,
+                "max": None,
+                "_sum": 0.0,
+                "_sum_sq": 0.0,
+                "_numeric": 0,
+            }
+        return self._stats[name]
+
+    def update(self, batch: pa.RecordBatch):
+        n = batch.num_rows
+        if n == 0:
+            return
+
+        slots, rows = self._slots(n)
+        self._positions[slots] = self.rows + rows
+
+        for name in self._samples.keys() - set(batch.schema.names): # columns missing from this batch
+            self._samples[name][slots] = np.nan
+
+        for name, column in zip(batch.schema.names, batch.columns):
+            stats = self._column_stats(name, column.type)
+            stats["count"] += n
+            stats["null_count"] += column.null_count
+
+            if not _is_numeric(column.type):
+                if name in self._samples:
+                    self._samples[name][slots] = np.nan
+                continue
+
+            values = pc.cast(column, pa.float64()).to_numpy(zero_copy_only=False)
+            valid = values[~np.isnan(values)]
+            if valid.size:
+                lo, hi = float(valid.min()), float(valid.max())
+                stats["min"] = lo if stats["min"] is None else min(stats["min"], lo)
+                stats["max"] = hi if stats["max"] is None else max(stats["max"], hi)
+                stats["_sum"] += float(valid.sum())
+                stats["_sum_sq"] += float(np.square(valid).sum())
+                stats["_numeric"] += valid.size
+
+            if name not in self._samples:
+                self._samples[name] = np.full(self.sample_size, np.nan)
+            self._samples[name][slots] = values[rows]
+
+        self.rows += n
+
+    def columns(self):
+        columns = []
+        for name, stats in self._stats.items():
+            column = {key: value for key, value in stats.items() if not key.startswith("_")}
+            column["name"] = name
+            if stats["_numeric"]:
+                mean = stats["_sum"] / stats["_numeric"]
+                column["mean"] = mean
+                column["std"] = float(np.sqrt(max(0.0, stats["_sum_sq"] / stats["_numeric"] - mean * mean)))
+            columns.append(column)
+        return columns
+
+    def correlation_embeddings(self):
+        filled = min(self.rows, self.sample_size)
+        order = np.argsort(self._positions[:filled], kind="stable") # back to file order
+
+        embeddings = {}
+        for name, sample in self._samples.items():
+            values = sample[:filled][order]
+            valid = ~np.isnan(values)
+            if not valid.any():
+                continue
+            values = np.where(valid, values, values[valid].mean()) # fft needs every position filled
+            embeddings[name] = correlation_embedding(values)
+        return embeddings
+
+## documents
+
+def _row_text(row: dict) -> str:
+    return " | ".join(f"{name}: {value}" for name, value in row.items() if value is not None)
+
+def row_chunks(batches, profile: TableProfile, doc_id: str, table_name: str, rows_per_chunk: int = TABLE_ROWS_PER_CHUNK):
+    chunk_no = 0
+    for batch in batches:
+        profile.update(batch)
+        if not rows_per_chunk:
+            continue
+        for start in range(0, batch.num_rows, rows_per_chunk):
+            rows = batch.slice(start, rows_per_chunk).to_pylist()
+            yield {
+                "_id": f"{doc_id}-{chunk_no}",
+                "document_id": doc_id,
+                "access_group": "", # not yet implemented
+                "document_name": table_name,
+                "chunk_text": "\n".join(_row_text(row) for row in rows),
+                "chunking_strategy": "by_rows",
+                "chunk_no": chunk_no,
+            }
+            chunk_no += 1
+
+def table_meta(profile: TableProfile, database_id: str, table_id: str, table_name: str, table_hash: str):
+    columns = profile.columns()
+    return {
+        "_id": table_id,
+        "database_id": database_id,
+        "access_group": "", # not yet implemented
+        "table_name": table_name,
+        "description_text": describe_table(str(columns)),
+        "correlation_embedding": profile.correlation_embeddings(),
+        "chunking_strategy": "", # not chunked rn
+        "table_hash": table_hash,
+        "row_count": profile.rows,
+        "column_stats": columns,
+    }
+
+def ingest_table(filepath: str, c_type: str, es, row_chunks_enabled: bool = TABLE_ROW_CHUNKS, progress=None):
+    database_id = str(uuid5(NAMESPACE_URL, filepath))
+    digest = file_hash(filepath)
+
+    tables = []
+    for table_name, batches in TABLE_READERS[c_type](filepath):
+        table_id = str(uuid5(NAMESPACE_URL, f"{filepath}:{table_name}"))
+        profile = TableProfile()
+
+        chunks = row_chunks(batches, profile, table_id, table_name, TABLE_ROWS_PER_CHUNK if row_chunks_enabled else 0)
+        if row_chunks_enabled:
+            indexed, _ = es.insert_objects(counted(chunks, progress, "chunked"), index="text_chunk", progress=progress)
+            logger.info(f"Indexed {indexed} row chunk(s) from {table_name}")
+        else:
+            for _ in chunks: # profile only
+                pass
+
+        tables.append(table_meta(profile, database_id, table_id, table_name, digest))
+        if progress is not None:
+            progress.add("rows", profile.rows)
+        logger.info(f"Profiled {table_name}: {profile.rows} row(s), {len(profile.columns())} column(s)")
+
+    indexed, _ = es.insert_objects(tables, index="table_meta")
+    return indexed
+
+if __name__ == "__main__":
+    import sys
+
+    from pprint import pprint
+
+    for table_name, batches in TABLE_READERS[sys.argv[2] if len(sys.argv) > 2 else "csv"](sys.argv[1]):
+        profile = TableProfile()
+        for batch in batches:
+            profile.update(batch)
+        print(table_name, profile.rows)
+        pprint(profile.columns())
+        print({name: embedding[:4] for name, embedding in profile.correlation_embeddings().items()})
@@ -1,9 +1,97 @@
 import os
+import threading
+import zipfile
+from pathlib import Path
 
-from magika import Magika
 import re
 
-magika = Magika()
+# Tiered type detection, cheapest first:
+#   1. magic bytes in the first SNIFF_BYTES (plus the zip central directory for office files)
+#   2. the extension, for text formats that have no signature
+#   3. magika, which reads bounded blocks from the start/middle/end of a file
+# the magika model is only loaded when a file gets to tier 3.
+
+SNIFF_BYTES = 512 # enough for the tar header (ustar at 257)
+
+_magika = None
+_magika_lock = threading.Lock()
+
+def get_magika():
+    global _magika
+    if _magika is None:
+        with _magika_lock:
+            if _magika is None:
+                from magika import Magika
+                _magika = Magika()
+    return _magika
+
+# text formats without a signature, only trusted if the head does not say otherwise
+EXTENSIONS = {
+    ".csv": "csv",
+    ".tsv": "tsv",
+    ".json": "json",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".yaml": "yaml",
+    ".yml": "yaml",
+    ".md": "markdown",
+    ".markdown": "markdown",
+    ".txt": "txt",
+    ".tex": "latex",
+}
+
+# ole2 containers (legacy office) only differ by their contents
+OLE_EXTENSIONS = {".doc": "doc", ".ppt": "ppt", ".xls": "xls"}
+
+# zip containers, told apart by the entries in the central directory
+ZIP_PREFIXES = (("word/", "docx"), ("xl/", "xlsx"), ("ppt/", "pptx"))
+
+def _zip_type(filepath: str):
+    if filepath is None:
+        return None
+    try:
+        with zipfile.ZipFile(filepath) as archive: # reads the central directory at the end only
+            names = archive.namelist()
+    except (zipfile.BadZipFile, OSError):
+        return None
+    if "mimetype" in names and "META-INF/container.xml" in names:
+        return "epub"
+    if "[Content_Types].xml" in names:
+        for prefix, label in ZIP_PREFIXES:
+            if any(name.startswith(prefix) for name in names):
+                return label
+    return "zip"
+
+def sniff(head: bytes, filepath: str = None, filename: str = None):
+    """Type from the head of a file and its name, None when magika has to decide."""
+    extension = os.path.splitext(filename or filepath or "")[1].lower()
+
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if head.startswith(b"PAR1"):
+        return "parquet"
+    if head.startswith(b"{\\rtf"):
+        return "rtf"
+    if head.startswith(b"PK\x03\x04"):
+        if extension in (".docx", ".xlsx", ".pptx", ".epub"):
+            return extension[1:]
+        return _zip_type(filepath)
+    if head.startswith(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):
+        return OLE_EXTENSIONS.get(extension)
+    if head[257:262] == b"ustar":
+        return "tar"
+    if head.startswith(b"\x1f\x8b"):
+        return "gzip"
+    if head.startswith(b"BZh"):
+        return "bzip"
+
+    if extension in EXTENSIONS and b"\x00" not in head: # binary content under a text extension goes to magika
+        return EXTENSIONS[extension]
+    return None
+
+def _read_head(filepath: str, size: int = SNIFF_BYTES) -> bytes:
+    with open(filepath, 'rb') as file:
+        return file.read(size)
 
 def get_pathtype(filepath: str):
 
@@ -11,12 +99,38 @@ def get_pathtype(filepath: str):
         if os.path.isdir(filepath):
             return 'dir'
         else:
-            with open(filepath, 'rb') as file:
-                file_bytes = file.read()
-                return magika.identify_bytes(file_bytes).output.ct_label
+            return sniff(_read_head(filepath), filepath) or get_magika().identify_path(Path(filepath)).output.ct_label
     else:
         return None
 
+def get_bytestype(content: bytes, filename: str = None):
+    # works on a partial read too (e.g. the head of an upload being spooled)
+    return sniff(content[:SNIFF_BYTES], filename=filename) or get_magika().identify_bytes(content).output.ct_label
+
+def get_pathtypes(filepaths: list):
+    # batched get_pathtype: anything the sniffer cannot place goes to magika in one call
+    types = [None] * len(filepaths)
+    pending = []
+    for i, filepath in enumerate(filepaths):
+        if not os.path.exists(filepath):
+            continue
+        if os.path.isdir(filepath):
+            types[i] = 'dir'
+            continue
+        try:
+            types[i] = sniff(_read_head(filepath), filepath)
+        except OSError:
+            continue
+        if types[i] is None:
+            pending.append(i)
+
+    if pending:
+        results = get_magika().identify_paths([Path(filepaths[i]) for i in pending])
+        for i, result in zip(pending, results):
+            types[i] = result.output.ct_label
+
+    return types
+
 def parse_connection_string(conn_string):
     # Extended pattern to match more complex connection strings, with optional port and database
     pattern = r'(?P<type>\w+)://(?P<user>[^:@\/]+):(?P<password>[^:@\/]+)@(?P<host>[^:\/]+)(?::(?P<port>\d+))?(/(?P<database>[^\/]+)?)?'
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import uuid
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from config import config
+from log import setup_logger
+
+# logger
+logger = setup_logger("uploads")
+
+TEMP_DIR = config.TEMP_DIR
+UPLOAD_CHUNK_BYTES = config.UPLOAD_CHUNK_BYTES
+UPLOAD_MAX_BYTES = config.UPLOAD_MAX_BYTES
+UPLOAD_SNIFF_BYTES = config.UPLOAD_SNIFF_BYTES
+QUEUE_MAX_BYTES = config.QUEUE_MAX_BYTES
+JOURNAL_DIR = config.JOURNAL_DIR
+
+class UploadTooLarge(Exception):
+    pass
+
+class QueueFull(Exception):
+    pass
+
+def queued_bytes(temp_dir: str = TEMP_DIR) -> int:
+    # everything in TEMP_DIR is waiting for (or going through) ingestion, load_data removes it
+    # after, whether it succeeded or not. modeltmp holds triton model downloads and the journal
+    # dir partition output (see journal.py), neither is queued data
+    skip = {os.path.realpath(os.path.join(temp_dir, "modeltmp")), os.path.realpath(JOURNAL_DIR)}
+    total = 0
+    for root, dirs, files in os.walk(temp_dir):
+        dirs[:] = [name for name in dirs if os.path.realpath(os.path.join(root, name)) not in skip]
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError: # removed by a worker in the meantime
+                pass
+    return total
+
+def check_queue(incoming: int = 0, max_bytes: int = QUEUE_MAX_BYTES):
+    queued = queued_bytes()
+    if queued + incoming > max_bytes:
+        raise QueueFull(f"Ingestion queue is full ({queued} bytes waiting), retry later.")
+
+class SpooledUpload:
+    def __init__(self, path: str, size: int, sha256: str, head: bytes):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.head = head # first UPLOAD_SNIFF_BYTES, for type detection
+
+async def spool_upload(
+        file: UploadFile,
+        temp_dir: str = TEMP_DIR,
+        max_bytes: int = UPLOAD_MAX_BYTES,
+        chunk_bytes: int = UPLOAD_CHUNK_BYTES,
+        sniff_bytes: int = UPLOAD_SNIFF_BYTES,
+        ) -> SpooledUpload:
+    """
+    Copy an upload to temp_dir in chunk_bytes reads, hashing it on the way. The file only
+    appears under its name once complete, so workers never see a partial upload.
+    """
+    os.makedirs(temp_dir, exist_ok=True)
+
+    path = os.path.join(temp_dir, os.path.basename(file.filename))
+    part_path = f"{path}.{uuid.uuid4().hex}.part"
+
+    digest = hashlib.sha256()
+    head = bytearray()
+    size = 0
+
+    try:
+        with open(part_path, "wb") as f:
+            while chunk := await file.read(chunk_bytes):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload is larger than {max_bytes} bytes.")
+
+                digest.update(chunk)
+                if len(head) < sniff_bytes:
+                    head += chunk[:sniff_bytes - len(head)]
+                await run_in_threadpool(f.write, chunk)
+
+        os.replace(part_path, path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    finally:
+        await file.close()
+
+    logger.info(f"Spooled {file.filename}: {size} bytes, sha256 {digest.hexdigest()}")
+
+    return SpooledUpload(path, size, digest.hexdigest(), bytes(head))